@@ -6,6 +6,7 @@ passing all options in its initialization method, and then calling the convert()
 Converter object and passing it the object to convert.
 '''
 
+import os
 from pydecay import *
 from pydecay.db import PARTICLE_TYPE_IMPL
 from pydecay import graphphys
@@ -73,9 +74,19 @@ class GraphPhysConverter(Converter):
     ''' Converter for converting decay trees into GraphPhys strings. These strings will not be
         the same every time, because they use objects' in-memory addresses (via the id() function)
         to uniquely name decay objects.
+
+        The GraphPhys code is produced a statement at a time in a single pass over the tree, and
+        handed to a write function as it goes: write() sends it straight to a file-like object,
+        convert() joins it into a string, and convert_to_file() writes it to a buffered file.
     '''
     
     output_type = 'GraphPhys string'
+
+    ''' Size of the buffer of files written by convert_to_file '''
+    FILE_BUFFER_SIZE = 1 << 16
+
+    ''' Number of statements convert joins together at a time '''
+    JOIN_BLOCK_SIZE = 1024
     
     @staticmethod
     def quote_if_necessary(s):
@@ -86,52 +97,91 @@ class GraphPhysConverter(Converter):
             return s
         else:
             return '"%s"' % s
-    
-    def convert(self, obj):
+
+    @staticmethod
+    def get_param_list(decay_elt, braces=True):
+        ''' @return: the parameters of a decay element as GraphPhys code: in square brackets, or if braces
+                     is False, each preceded by a comma (for appending to a particle's type parameter).
+        '''
+        quote = GraphPhysConverter.quote_if_necessary
+        params = [ '%s=%s' % (quote(name), quote(val)) for name, val in decay_elt.params.iteritems() ]
+        if not braces:
+            return ''.join([ ', ' + param for param in params ])
+        elif params:
+            return '[%s]' % ', '.join(params)
+        return ''
+
+    @staticmethod
+    def get_product_names(decay):
+        ''' @return: the names of a decay's products, with a space on both sides of each. '''
+        return ''.join([ ' ' + GraphPhysConverter.quote_if_necessary(product.get_unique_name())
+                         for product in decay.products ]) + ' '
+
+    def write_particle(self, particle, write):
+        ''' Passes the statements of a particle's subtree to write: those of its products' subtrees,
+            then the particle's own node statement and its decays. '''
+        for decay in particle.decays:
+            for product in decay.products:
+                self.write_particle(product, write)
+
+        node_name = GraphPhysConverter.quote_if_necessary( particle.get_unique_name() )
+        write( '%s[type=%s%s];\n' % (node_name, GraphPhysConverter.quote_if_necessary(particle.type),
+                                     GraphPhysConverter.get_param_list(particle, False)) )
+        for decay in particle.decays:
+            write( '%s -> {%s}%s;\n' % (node_name, GraphPhysConverter.get_product_names(decay),
+                                        GraphPhysConverter.get_param_list(decay)) )
+
+    def write_to(self, obj, write):
+        ''' Passes the GraphPhys code of obj to the function write, a piece at a time. '''
         if isinstance(obj, str):
-            return obj
-        
+            write(obj)
+
         elif isinstance(obj, Particle):
-            def get_param_list(decay_elt, braces=True):
-                params_string = ''
-                initial_comma = not braces
-                for name, val in decay_elt.params.iteritems():
-                    if initial_comma:
-                        params_string += ', '
-                    params_string += '%s=%s' % ( GraphPhysConverter.quote_if_necessary(name),
-                                                 GraphPhysConverter.quote_if_necessary(val) )
-                    initial_comma = True
-                    
-                if braces and params_string != '':
-                    params_string = '[%s]' % params_string
-                return params_string
-            
-            node_name = GraphPhysConverter.quote_if_necessary( obj.get_unique_name() )
-            
-            gp_code = ''
-            for decay in obj.decays:
-                for product in decay.products:
-                    gp_code += self.convert(product)
- 
-            gp_code += '%s[type=%s%s];\n' % ( node_name, GraphPhysConverter.quote_if_necessary(obj.type), get_param_list(obj, False) )            
-                       
-            def get_product_names(decay):
-                plist = ''
-                for prod in decay.products:
-                    plist = '%s %s' % ( plist, GraphPhysConverter.quote_if_necessary(prod.get_unique_name()) )
-                plist += ' ' # Make it even - a space on both sides
-                return plist
-            for decay in obj.decays:
-                gp_code += '%s -> {%s}%s;\n' % (node_name, get_product_names(decay), get_param_list(decay))
-                
-            return gp_code
-        
+            self.write_particle(obj, write)
+
         elif isinstance(obj, ProcessGroup):
-            gp_code = ''
             for root in obj.root_particles:
-                gp_code += self.convert(root)
-                gp_code += '\n\n'
-            return gp_code
-        
+                self.write_particle(root, write)
+                write('\n\n')
+
         else:
-            return self.convert( Converter.convert(self, obj) )
+            self.write_to( Converter.convert(self, obj), write )
+
+    def write(self, obj, outfile):
+        ''' Writes the GraphPhys code of obj to a file-like object as it is produced, without holding
+            all of it in memory. '''
+        self.write_to(obj, outfile.write)
+    
+    def convert(self, obj):
+        if isinstance(obj, str):
+            return obj
+        # The pieces are joined a block at a time as they come, since holding
+        # them all as separate strings would take several times their size
+        blocks = []
+        pieces = []
+        def write(piece):
+            pieces.append(piece)
+            if len(pieces) == GraphPhysConverter.JOIN_BLOCK_SIZE:
+                blocks.append(''.join(pieces))
+                del pieces[:]
+        self.write_to(obj, write)
+        blocks.append(''.join(pieces))
+        return ''.join(blocks)
+
+    def convert_to_file(self, obj, filename, output_format):
+        ''' Writes the GraphPhys code of obj to a file as it is produced (see write). The code goes to a
+            temporary file beside it, which replaces the file only once the conversion has succeeded, so
+            a failed conversion leaves no truncated file behind.
+        '''
+        filename = self.get_real_filename(filename, output_format)
+        temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        outfile = open(temp_filename, "w+", GraphPhysConverter.FILE_BUFFER_SIZE)
+        try:
+            try:
+                self.write(obj, outfile)
+            finally:
+                outfile.close()
+        except:
+            os.remove(temp_filename)
+            raise
+        os.rename(temp_filename, filename)
@@ -119,7 +119,7 @@ try:
                 
                 if len(params) > 0:
                     for name, value in params.iteritems():
-                        if isinstance(value, dict):
+                        if hasattr(value, 'iteritems'): # Plain dicts, or stored parameter dictionaries
                             value = '<table border="0" cellspacing="0" cellborder="1">%s</table>' % self.make_dot_params_sublabel(value)
                             padding = 'cellpadding="8"'
                         else:
@@ -48,6 +48,15 @@ class ParticleType(object):
 
         return [klass.get_type_for_name(name) for name in type_names]
 
+    @staticmethod
+    def get_all_types():
+        ''' @return: an iterable of every particle type in the database, as instances of whichever
+                     implementation-class for ParticleType is being used. Used for exporting a
+                     database wholesale, e.g. to a snapshot.
+        '''
+
+        return []
+
 
 class DecayMode(object):
     ''' A common interface for retrieving particle-to-products decay information. As with
@@ -70,6 +79,16 @@ class DecayMode(object):
         
         raise DoesNotExist("No decay mode in database for %s to %s" % (initial.name, [p.name for p in products]) )
 
+    @staticmethod
+    def get_all_modes():
+        ''' @return: an iterable of (initial, products, mode) triples covering every decay mode in the
+                     database, where initial is the initial particle type, products is a list of the
+                     product types (repeated as many times as each is produced), and mode is the
+                     decay mode object itself.
+        '''
+
+        return []
+
 
 ''' PARTICLE_TYPE_IMPL will be set to the database class supporting the ParticleType
     interface. Likewise for DECAY_MODE_IMPL.
@@ -66,6 +66,11 @@ class ParticleType(DB_ParticleType, DotDbDictionary):
             raise DoesNotExist(*e.args)
 
     # Use default implementation of get_types_for_names
+
+    @staticmethod
+    def get_all_types():
+        ''' See db.ParticleType.get_all_types. '''
+        return [ParticleType.particles[name] for name in ParticleType.particles]
     
 class DecayMode(DotDbDictionary, DB_DecayMode):
     ''' A .key-accessible dictionary for holding decay information. '''
@@ -81,12 +86,22 @@ class DecayMode(DotDbDictionary, DB_DecayMode):
     def get_mode_for_particles(initial, products, angular_momentum=None):
         ''' See db.DecayMode.get_mode_for_particles. '''
         
+        # Product order doesn't matter, but the number of times each product appears does
+        product_names = sorted([p.name for p in products])
         try:
-            for decay_mode in DecayMode.decays[initial.type]:
-                if (set([p.type for p in decay_mode.products]) == set([p.type for p in products])
-                    ) and angular_momentum == decay_mode.get('angular_momentum', None):
+            for decay_mode in DecayMode.decays[initial.name]:
+                if sorted([p.name for p in decay_mode['products']]) == product_names \
+                   and angular_momentum == decay_mode.get('angular_momentum', None):
                     return decay_mode 
         except KeyError:
             pass
         
         raise DoesNotExist('No decay found for specified particles')
+
+    @staticmethod
+    def get_all_modes():
+        ''' See db.DecayMode.get_all_modes. '''
+        for initial_name, decay_modes in DecayMode.decays.iteritems():
+            initial = ParticleType.get_type_for_name(initial_name)
+            for decay_mode in decay_modes:
+                yield initial, decay_mode['products'], decay_mode
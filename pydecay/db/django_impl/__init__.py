@@ -18,4 +18,5 @@ if not sys.modules.has_key('pydecaydb'):
     sys.modules['pydecaydb'] = pydecaydb
 
 # Main stuff to be made available (meant to hide Django-specific module structure)
-from pydecaydb.models import ParticleType, DecayMode, ParticleInstance, DecayInstance, InstanceGroup, DecayElementInstance
+from pydecaydb.models import (ParticleType, DecayMode, ParticleInstance, DecayInstance, InstanceGroup,
+                              DecayElementInstance, InstanceTree)
@@ -1,51 +1,206 @@
-from django.db import transaction, models
+from django.core.management.color import no_style
+from django.db import connection, transaction, models
+from django.db.models import Max
 from django.db.models.fields import AutoField
 from django.db.models.fields.related import RelatedField
 from pydecay import *
 from pydecay import db
-from pydecay.converters import Converter
+from pydecay.converters import Converter, InvalidTypeError
+from pydecay.db.django_impl import (ParticleType, ParticleInstance, DecayInstance, InstanceGroup,
+                                    DecayElementInstance, InstanceTree)
+from pydecay.db.django_impl.pydecaydb.models import (LazyParamDictionary, InstanceGroupParam,
+                                                     ParticleInstanceParam, DecayInstanceParam)
 from warnings import warn
+import time
 
 PARAM_NAMES_TO_COLUMN_NAMES = {BRANCHING_FRACTION_PARAM : 'branching_fraction'}
-DATABASE_MODULE = db.PARTICLE_TYPE_IMPL.__module__ # Same module for both; arbitrarily chose particle
 
 class DBInstanceConverter(Converter):
-    ''' Converter for converting a decay tree to ParticleInstance/DecayInstance/etc. database entries. '''
+    ''' Converter for converting a decay tree to ParticleInstance/DecayInstance/etc. database entries.
+        
+        The whole tree (or ProcessGroup) is written in a single transaction: if anything fails, nothing
+        is stored. Primary keys for every new row are allocated up front from the largest ids in use,
+        which lets all the rows be built in memory and then inserted with batched multi-row INSERTs.
+        Rows are inserted a level of the tree at a time, so that every foreign key refers to a row that
+        is already present. Because ids are allocated from the current maxima, the tables written to are
+        locked against other writers for the transaction (see lock_tables), and the database's id
+        sequences are moved past the new rows afterwards, so that later saves don't reuse their ids.
+        
+        After each conversion, rows_written and seconds record how much work the conversion did;
+        rows_per_second() summarizes them.
+    '''
     
     output_type = 'PyDecay database instance'
     
+    def __init__(self, batch_size=None):
+        ''' @param batch_size: the most rows to insert per statement. By default, as many as the database allows. '''
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.seconds = 0.0
+    
+    def rows_per_second(self):
+        ''' @return: the insertion rate achieved by the last conversion. '''
+        if self.seconds == 0:
+            return 0.0
+        return self.rows_written / self.seconds
+    
     def convert(self, obj):
-        ''' Note: NOT atomic! '''
-        
-        if isinstance(obj, db.DECAY_MODE_IMPL.__module__.DecayElementInstance):
+        if isinstance(obj, DecayElementInstance):
             return obj
         
-        elif isinstance(obj, Particle):
-            ptype = db.PARTICLE_TYPE_IMPL.get_type_for_name(obj.type)
-            p = DATABASE_MODULE.ParticleInstance( type=ptype )
-            p.save()
-            p.params = obj.params
-            for decay in obj.decays:
-                dec = DATABASE_MODULE.DecayInstance( initial=p )
-                dec.save()
-                dec.params = decay.params
-                
-                dec.products = [self.convert(x) for x in decay.products]
-            return p
-        
-        elif isinstance(obj, ProcessGroup):
-            g = DATABASE_MODULE.InstanceGroup()
-            g.save()
-            db_particles = [self.convert(p) for p in obj.root_particles]
-            g.root_particles = db_particles
-            g.params = obj.params
-            return g
+        elif isinstance(obj, (Particle, ProcessGroup)):
+            start = time.time()
+            result = self.write_tree(obj)
+            self.seconds = time.time() - start
+            return result
         
         else:
             return self.convert( Converter.convert(self, obj) )
+    
+    @transaction.commit_on_success
+    def write_tree(self, obj):
+        ''' Builds and inserts all the rows for obj.
+            @return: the InstanceGroup or ParticleInstance corresponding to obj.
+        '''
+        # Every model object is built before anything is inserted: DecayElementInstance.__setattr__
+        # commits the transaction if it is dirty, so setting attributes after an insert would break atomicity.
+        # Locking doesn't dirty the transaction.
+        tables = (InstanceGroup, ParticleInstance, DecayInstance,
+                  InstanceGroupParam, ParticleInstanceParam, DecayInstanceParam)
+        self.lock_tables(tables)
+        ids = dict( (model, IdAllocator(model)) for model in tables )
+        
+        if isinstance(obj, ProcessGroup):
+            roots = obj.root_particles
+            group = InstanceGroup( id=ids[InstanceGroup].allocate() )
+            params = {InstanceGroupParam: self.param_rows(obj.params, InstanceGroupParam, ids, group.id)}
+        else:
+            roots = [obj]
+            group = None
+            params = {}
         
+        ptypes = self.get_types_by_name(roots)
+        
+        # levels[i] is a pair ([ParticleInstance], [DecayInstance]) for the particles i steps from a root
+        levels = []
+        particles = [ (p, None) for p in roots ] # (Particle, id of the DecayInstance producing it)
+        while len(particles) > 0:
+            level_particles, level_decays, next_particles = [], [], []
+            for particle, product_of_id in particles:
+                p = ParticleInstance( id=ids[ParticleInstance].allocate(), type=ptypes[particle.type],
+                                      product_of_id=product_of_id, group=(None, group)[product_of_id is None] )
+                level_particles.append(p)
+                params.setdefault(ParticleInstanceParam, []).extend(
+                                  self.param_rows(particle.params, ParticleInstanceParam, ids, p.id) )
+                for decay in particle.decays:
+                    dec = DecayInstance( id=ids[DecayInstance].allocate(), initial_id=p.id )
+                    level_decays.append(dec)
+                    params.setdefault(DecayInstanceParam, []).extend(
+                                      self.param_rows(decay.params, DecayInstanceParam, ids, dec.id) )
+                    next_particles.extend( [(product, dec.id) for product in decay.products] )
+            levels.append( (level_particles, level_decays) )
+            particles = next_particles
+        
+        self.rows_written = 0
+        if group is not None:
+            self.insert(InstanceGroup, [group])
+        for level_particles, level_decays in levels:
+            self.insert(ParticleInstance, level_particles)
+            self.insert(DecayInstance, level_decays)
+        for param_class, rows in params.iteritems():
+            self.insert(param_class, rows)
+        self.reset_sequences(tables)
+        
+        if group is not None:
+            return group
+        return levels[0][0][0]
+    
+    def insert(self, model, rows):
+        model.objects.bulk_create(rows, self.batch_size)
+        self.rows_written += len(rows)
+    
+    @staticmethod
+    def lock_tables(models):
+        ''' Keeps other writers out of the models' tables until the current transaction ends, so that
+            the ids IdAllocator reads can't be taken by a concurrent conversion. Readers aren't blocked.
+        '''
+        cursor = connection.cursor()
+        tables = [ connection.ops.quote_name(model._meta.db_table) for model in models ]
+        if connection.vendor in ('postgresql', 'oracle'):
+            cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % ', '.join(tables))
+        elif connection.vendor == 'mysql':
+            # LOCK TABLES would end the transaction; locking each table's last row also locks
+            # the gap after it, which is where new rows go
+            for table in tables:
+                cursor.execute('SELECT id FROM %s ORDER BY id DESC LIMIT 1 FOR UPDATE' % table)
+        else:
+            # SQLite takes a lock on the whole database at the first write of a transaction,
+            # even one that changes nothing
+            cursor.execute('UPDATE %s SET id = id WHERE 0 = 1' % tables[0])
+    
+    @staticmethod
+    def reset_sequences(models):
+        ''' Moves the id sequences of the models' tables, on databases that have them, past the largest
+            id in use. Rows inserted with explicit ids don't advance them.
+        '''
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+    
+    @staticmethod
+    def get_types_by_name(roots):
+        ''' @return: a map from each particle type name used in the trees under roots onto its ParticleType,
+                     fetched in one query.
+            @raise pydecay.db.DoesNotExist: if any of the names is not in the database.
+        '''
+        names = set()
+        particles = list(roots)
+        while len(particles) > 0:
+            particle = particles.pop()
+            names.add(particle.type)
+            for decay in particle.decays:
+                particles.extend(decay.products)
+        
+        ptypes = dict( (ptype.name, ptype) for ptype in ParticleType.objects.filter(name__in=names) )
+        for name in names:
+            if not ptypes.has_key(name):
+                raise db.DoesNotExist("Unknown particle name '%s'" % name)
+        return ptypes
+    
+    @staticmethod
+    def param_rows(params, param_class, ids, instance_id=None, parent_param_id=None):
+        ''' Flattens a (possibly nested) parameter dictionary into param_class objects, parents before children,
+            as DecayElementInstance.set_params would store them.
+            @return: a list of unsaved param_class objects with their ids allocated.
+        '''
+        rows = []
+        for name, val in params.iteritems():
+            if isinstance(val, LazyParamDictionary):
+                val = val.to_dict()
+            p = param_class( id=ids[param_class].allocate(), name=name,
+                             instance_id=instance_id, parent_param_id=parent_param_id,
+                             value=(val, None)[isinstance(val, dict)] )
+            rows.append(p)
+            if isinstance(val, dict):
+                rows.extend( DBInstanceConverter.param_rows(val, param_class, ids, None, p.id) )
+        return rows
+    
     def convert_to_file(self, *args, **kwargs):
         raise NotImplementedError("DB objects cannot be stored in a file")
+
+
+class IdAllocator(object):
+    ''' Hands out primary keys for new rows of a model, starting after the largest one currently in use.
+        The model's table should be locked first (see DBInstanceConverter.lock_tables).
+    '''
+    
+    def __init__(self, model):
+        self.next_id = (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    
+    def allocate(self):
+        allocated = self.next_id
+        self.next_id += 1
+        return allocated
             
 
 class DBTypeConverter(Converter):
@@ -116,21 +271,44 @@ class DBTypeConverter(Converter):
     it dynamically loads this converter as part of its builtin PyDecayConverter 
     if it finds it in the db module '''
 class PyDecayConverter(Converter):
+    ''' Converter for turning stored ParticleInstance/InstanceGroup trees back into PyDecay objects.
+        The whole stored tree is fetched up front through an InstanceTree, so converting a tree costs
+        the same small number of queries however many particles, decays and parameters it has.
+    '''
     output_type = 'PyDecay object'
     
     def convert(self, obj):
-        if isinstance(obj, DATABASE_MODULE.ParticleInstance):
-            p = Particle( obj.type.name, **obj.params.to_dict() )
-            no_decay_specified = True
-            for decay in obj.decays.all():
-                no_decay_specified = False
-                # Parents get set for free
-                p.add_decay( [self.convert(p) for p in decay.products.all()],
-                             decay.get_branching_fraction(),
-                             **decay.params.to_dict() )
-                
-            return p
+        if isinstance(obj, InstanceGroup):
+            tree = InstanceTree(obj)
+            return ProcessGroup( self.assemble(tree, tree.get_roots()), **tree.group_params )
+        
+        elif isinstance(obj, ParticleInstance):
+            tree = InstanceTree(obj)
+            [root] = self.assemble(tree, tree.get_roots())
+            return root
         
         else:
             # Do not call main Converter function...that was probably how we got here in the first place
-            raise InvalidTypeError("Cannot convert %s object to %s" % ( type(obj).__name__), self.output_type )
+            raise InvalidTypeError("Cannot convert %s object to %s" % ( type(obj).__name__, self.output_type ) )
+    
+    @staticmethod
+    def assemble(tree, roots):
+        ''' Builds Particle objects for roots and everything below them from the rows already loaded in tree.
+            @return: a list of Particle objects, one per root.
+        '''
+        decays_by_initial = {}
+        for decay in tree.decays:
+            decays_by_initial.setdefault(decay.initial_id, []).append(decay)
+        products_by_decay = {}
+        for particle in tree.particles:
+            products_by_decay.setdefault(particle.product_of_id, []).append(particle)
+        
+        def make_particle(instance):
+            p = Particle( instance.type.name, **tree.particle_params.get(instance.id, {}) )
+            for decay in decays_by_initial.get(instance.id, []):
+                # Parents get set for free
+                p.add_decay( [make_particle(product) for product in products_by_decay.get(decay.id, [])],
+                             **tree.decay_params.get(decay.id, {}) )
+            return p
+        
+        return [make_particle(root) for root in roots]
@@ -77,6 +77,17 @@ class DecayMode(Model, DB_DecayMode):
         except DecayMode.DoesNotExist, e:
             raise DoesNotExist(*e.args)
     
+    @staticmethod
+    def get_all_modes():
+        ''' See pydecay.db.DecayMode.get_all_modes. '''
+        
+        products = {}
+        for psm in ProductSetMembership.objects.select_related('particle_type__base_type'):
+            products.setdefault(psm.decay_mode_id, []).extend( [psm.particle_type] * psm.count )
+        
+        for mode in DecayMode.objects.select_related('initial__base_type'):
+            yield mode.initial, products.get(mode.id, []), mode
+    
     def __repr__(self):
         return '<Decay mode: %s -> %s>' % (self.initial.name,
                                            ['%s x %d' % (repr(psm.particle_type), psm.count) for psm
@@ -189,6 +200,11 @@ class ParticleType(Model, DB_ParticleType):
             raise DoesNotExist(*e.args)
     
     
+    @staticmethod
+    def get_all_types():
+        ''' See pydecay.db.ParticleType.get_all_types. '''
+        return ParticleType.objects.select_related('base_type')
+    
     ## There ought to be a way to implement get_types_for_names efficiently using SQL,
     ## but I don't have time to figure it out. The one below doesn't handle duplicate
     ## product types properly.
@@ -325,12 +341,31 @@ class LazyParamDictionary(object):
     ''' A dictionary-like class for representing arbitrary name/value parameters that are stored
         in a database as InstanceParam objects. Nested parameters are loaded lazily, i.e. only when
         accessed, or when the whole object is converted to a dictionary.
+        
+        Alternatively, the dictionary can be created eagerly, from parameter rows that have already
+        been fetched together with all their subparameters (see DecayElementInstance.get_params and
+        InstanceTree.get_params). Nested parameters are then built in memory without any queries.
+        Changing an eager dictionary, or any dictionary nested in it, turns the whole tree of
+        dictionaries back into lazy ones, since the preloaded rows no longer match what is stored.
+        The preloaded rows are kept by the outermost dictionary, its 'root', for that reason.
     '''
     
-    def __init__(self, parent_object, param_instances):
+    def __init__(self, parent_object, param_instances, preloaded_children=None, root=None):
+        ''' @param parent_object: the InstanceParam or DecayElementInstance these parameters belong to.
+            @param param_instances: the InstanceParam objects directly under parent_object.
+            @param preloaded_children: for eager loading, a map from the id of each nested parameter
+                                       below param_instances onto the list of its subparameters, as
+                                       built by InstanceParam.children_by_parent.
+            @param root: for a nested dictionary, the outermost dictionary it was obtained from,
+                         which holds the preloaded rows instead.
+        '''
         self.nested = {}
         self.held_values = {}
         self.parent_object = parent_object
+        if root is None:
+            root = self
+            self.preloaded_children = preloaded_children
+        self.root = root
         
         for param in param_instances:
             if param.value is None:
@@ -345,11 +380,30 @@ class LazyParamDictionary(object):
         else:
             return self.parent_object.param_class
     
+    def is_eager(self):
+        return self.root.preloaded_children is not None
+    
+    def make_lazy(self):
+        ''' Stops the whole tree of dictionaries this one belongs to from using preloaded rows. '''
+        self.root.preloaded_children = None
+    
+    def get_child_params(self, param):
+        ''' @return: the subparameters of a nested parameter of this dictionary. '''
+        if self.is_eager():
+            return self.root.preloaded_children.get(param.id, [])
+        else:
+            return param.child_params.all()
+    
     def __getitem__(self, key):
         if self.nested.has_key(key):
-            return LazyParamDictionary(self.nested[key], self.nested[key].child_params.all() )
+            return LazyParamDictionary(self.nested[key], self.get_child_params(self.nested[key]), root=self.root)
         else:
             return self.held_values[key].value
+    
+    def get(self, key, default=None):
+        if self.has_key(key):
+            return self[key]
+        return default
         
     def update(self, new_dict):
         ''' Note that this operation is NOT atomic: if an exception occurs in updating
@@ -359,6 +413,7 @@ class LazyParamDictionary(object):
     
     @transaction.commit_on_success
     def __setitem__(self, key, value):
+        self.make_lazy()
         if not isinstance(value, dict) and not isinstance(value, LazyParamDictionary) and self.held_values.has_key(key):
             p = self.held_values[key]
             p.value = value
@@ -379,6 +434,7 @@ class LazyParamDictionary(object):
                                                              )[0]
                                            
     def __delitem__(self, key):
+        self.make_lazy()
         try:
             self.nested.pop(key).delete()
         except KeyError:
@@ -386,6 +442,21 @@ class LazyParamDictionary(object):
             
     def has_key(self, key):
         return self.nested.has_key(key) or self.held_values.has_key(key)
+    
+    __contains__ = has_key
+    
+    def keys(self):
+        return self.held_values.keys() + self.nested.keys()
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.held_values) + len(self.nested)
+    
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
 
     def to_dict(self):
         ''' @return: a normal dict version of this dictionary with all subparameters stored locally. '''
@@ -393,7 +464,11 @@ class LazyParamDictionary(object):
         for name, param in self.held_values.iteritems():
             # We convert everything to non-unicode strings b/c these may be used as kwargs
             values.update({str(name): str(param.value)})
-        values.update( InstanceParam.instances_as_map( self.nested.values() ) )
+        if self.is_eager():
+            for name in self.nested.iterkeys():
+                values[str(name)] = self[name].to_dict()
+        else:
+            values.update( InstanceParam.instances_as_map( self.nested.values() ) )
         return values
         
     def __repr__(self):
@@ -439,6 +514,38 @@ class InstanceParam(Model):
         for inst_param in instances:
             params[inst_param.name] = inst_param.get_real_value()
         return params
+
+    @staticmethod
+    def children_by_parent(instances):
+        ''' @param instances: an iterable of InstanceParam objects.
+            @return: a map from the id of each parent parameter onto the list of its subparameters in
+                     instances. Parameters that belong directly to an instance are listed under None.
+        '''
+        children = {}
+        for inst_param in instances:
+            children.setdefault(inst_param.parent_param_id, []).append(inst_param)
+        return children
+
+    @staticmethod
+    def instances_as_maps_by_owner(instances):
+        ''' Builds parameter dictionaries entirely in memory, without querying for subparameters.
+            @param instances: an iterable of InstanceParam objects that includes every subparameter
+                              of every parameter in it (e.g. as fetched by InstanceTree).
+            @return: a map from the id of each instance the parameters belong to onto a dictionary
+                     of that instance's parameters, as LazyParamDictionary.to_dict would build it.
+        '''
+        children = InstanceParam.children_by_parent(instances)
+
+        def real_value(inst_param):
+            if inst_param.value is None:
+                return dict( (str(child.name), real_value(child)) for child in children.get(inst_param.id, []) )
+            else:
+                return str(inst_param.value)
+
+        maps = {}
+        for inst_param in children.get(None, []):
+            maps.setdefault(inst_param.instance_id, {})[str(inst_param.name)] = real_value(inst_param)
+        return maps
     
     def __repr__(self):
         return "'%s': %s" % ( self.name, str( self.get_real_value() ) )
@@ -471,7 +578,7 @@ class DecayElementInstance(Model):
 
     def __getattr__(self, attrname):
         if attrname == 'params':
-            return LazyParamDictionary( self, self.get_params_set().all() )
+            return self.get_params()
 
         else:
             return Model.__getattribute__(self, attrname)        
@@ -487,6 +594,18 @@ class DecayElementInstance(Model):
     def get_params_set(self):
         return self.__getattribute__( self.param_class.__name__.lower() + '_set' )
     
+    def get_params(self, eager=False):
+        ''' @param eager: if true, every parameter of this instance, at any nesting depth, is fetched with
+                          a single query, and nested parameters are then read from memory. Otherwise
+                          (as with the 'params' attribute) each nested parameter is queried when accessed.
+            @return: a LazyParamDictionary of this instance's parameters.
+        '''
+        if not eager:
+            return LazyParamDictionary( self, self.get_params_set().all() )
+        
+        children = InstanceParam.children_by_parent( fetch_param_tree(self.param_class, [], '%s', self.id) )
+        return LazyParamDictionary( self, children.get(None, []), children )
+    
     @staticmethod
     def set_params(params, param_class, parent):
         ''' Sets the parameters of parent to be params.
@@ -584,3 +703,98 @@ class DecayInstance(DecayElementInstance):
                 self.get_decay_mode().branching_fraction
             except DoesNotExist:
                 return None
+
+
+#######################################
+## Whole-tree loading                ##
+#######################################
+
+# Recursive queries for the ids of every particle instance in a tree, and of every parameter (at any
+# nesting depth) of a set of owner instances. %(start)s is a condition selecting the root particles,
+# containing the one query parameter the full query takes.
+PARTICLE_TREE_CTE = '''tree(id) AS (
+        SELECT id FROM %(particle)s WHERE %(start)s
+        UNION ALL
+        SELECT p.id FROM %(particle)s p INNER JOIN %(decay)s d ON p.product_of_id = d.id
+                                        INNER JOIN tree ON d.initial_id = tree.id)'''
+PARAM_TREE_CTE = '''params(id) AS (
+        SELECT id FROM %(param)s WHERE instance_id IN (%(owners)s)
+        UNION ALL
+        SELECT c.id FROM %(param)s c INNER JOIN params ON c.parent_param_id = params.id)'''
+
+def recursive_ids_sql(ctes, result_name):
+    ''' @return: an SQL query selecting the ids produced by the common table expression named
+                 result_name, one of those in ctes. '''
+    return 'WITH RECURSIVE %s SELECT id FROM %s' % (', '.join(ctes), result_name)
+
+def fetch_param_tree(param_class, ctes, owners_sql, query_param):
+    ''' @param ctes: any common table expressions that owners_sql relies on.
+        @param owners_sql: an SQL query selecting the ids of the instances whose parameters are wanted.
+                           The ctes and owners_sql together take the single parameter query_param.
+        @return: a list, ordered by id, of every param_class object belonging to those instances,
+                 including all their subparameters, fetched in one query.
+    '''
+    param_table = param_class._meta.db_table
+    in_params = recursive_ids_sql(ctes + [PARAM_TREE_CTE % {'param': param_table, 'owners': owners_sql}], 'params')
+    return list( param_class.objects.extra(where=['%s.id IN (%s)' % (param_table, in_params)],
+                                           params=[query_param]).order_by('id') )
+
+class InstanceTree(object):
+    ''' Every particle instance, decay instance and parameter in a stored decay tree, or in all the trees
+        of an InstanceGroup, fetched with a fixed number of queries regardless of the size of the tree.
+        The stored tree is walked with recursive common table expressions, so the database must support
+        WITH RECURSIVE (SQLite 3.8.3+, PostgreSQL, MySQL 8).
+        
+        After construction, the instances are available as lists ordered by id, and their parameters as
+        plain dictionaries keyed by instance id, so that the tree can be assembled in memory.
+    '''
+    
+    def __init__(self, root):
+        ''' @param root: the ParticleInstance at the top of the tree, or an InstanceGroup whose trees should all be loaded. '''
+        tables = {'particle': ParticleInstance._meta.db_table, 'decay': DecayInstance._meta.db_table}
+        if isinstance(root, InstanceGroup):
+            tables['start'] = 'group_id = %s'
+            self.group = root
+            self.param_rows = {InstanceGroupParam: fetch_param_tree(InstanceGroupParam, [], '%s', root.id)}
+        else:
+            tables['start'] = 'id = %s'
+            self.group = None
+            self.param_rows = {InstanceGroupParam: []}
+        
+        tree_cte = PARTICLE_TREE_CTE % tables
+        in_tree = recursive_ids_sql([tree_cte], 'tree')
+        
+        self.particles = list( ParticleInstance.objects.select_related('type').extra(
+                                   where=['%s.id IN (%s)' % (tables['particle'], in_tree)], params=[root.id]
+                                   ).order_by('id') )
+        self.decays = list( DecayInstance.objects.extra(
+                                where=['%s.initial_id IN (%s)' % (tables['decay'], in_tree)], params=[root.id]
+                                ).order_by('id') )
+        
+        decays_in_tree = 'SELECT id FROM %(decay)s WHERE initial_id IN (SELECT id FROM tree)' % tables
+        self.param_rows[ParticleInstanceParam] = fetch_param_tree(ParticleInstanceParam, [tree_cte],
+                                                                  'SELECT id FROM tree', root.id)
+        self.param_rows[DecayInstanceParam] = fetch_param_tree(DecayInstanceParam, [tree_cte], decays_in_tree, root.id)
+        
+        self.group_params = InstanceParam.instances_as_maps_by_owner( self.param_rows[InstanceGroupParam] ).get(root.id, {})
+        self.particle_params = InstanceParam.instances_as_maps_by_owner( self.param_rows[ParticleInstanceParam] )
+        self.decay_params = InstanceParam.instances_as_maps_by_owner( self.param_rows[DecayInstanceParam] )
+        
+        self._children = {}
+        self._by_owner = {}
+        for param_class, rows in self.param_rows.iteritems():
+            children = self._children[param_class] = InstanceParam.children_by_parent(rows)
+            by_owner = self._by_owner[param_class] = {}
+            for inst_param in children.get(None, []):
+                by_owner.setdefault(inst_param.instance_id, []).append(inst_param)
+    
+    def get_params(self, instance):
+        ''' @param instance: the InstanceGroup, or any ParticleInstance or DecayInstance, of the loaded tree.
+            @return: an eager LazyParamDictionary of the instance's parameters, built without further queries.
+        '''
+        return LazyParamDictionary( instance, self._by_owner[instance.param_class].get(instance.id, []),
+                                    self._children[instance.param_class] )
+    
+    def get_roots(self):
+        ''' @return: the root ParticleInstance objects of the loaded trees. '''
+        return [p for p in self.particles if p.product_of_id is None]
@@ -0,0 +1,230 @@
+'''
+This module defines a read-only database implementation held entirely in memory and loaded
+from a snapshot file. A snapshot is a copy of every particle type and decay mode in some other
+database implementation (Django, SQLite or dict), exported with export_snapshot() or with
+tools/db_snapshot.py. Loading one is a single unpickling step with no database connection, and
+every lookup afterwards is a dictionary access, which makes this implementation a good fit for
+simulation and conversion workers that resolve the same particle types over and over.
+
+The snapshot to use is configured by pydecay.settings.SNAPSHOT_FILE (or the PYDECAY_SNAPSHOT
+environment variable) and loaded on the first lookup; load() can be called to load a different
+one. The objects returned by lookups cannot be modified.
+
+Each snapshot records where and when it was made (see get_metadata), so that workers can check
+with is_stale() whether the database they were exported from has changed since.
+'''
+
+import cPickle
+import os
+import time
+from warnings import warn
+from pydecay.db import DoesNotExist, ParticleType as DB_ParticleType, DecayMode as DB_DecayMode
+from pydecay.settings import SNAPSHOT_FILE
+
+''' Incremented whenever the layout of snapshot files changes. '''
+SNAPSHOT_FORMAT_VERSION = 1
+
+''' The particle type properties copied from implementations whose types are not dictionaries. '''
+TYPE_FIELDS = ('charge', 'mass', 'mass_err_plus', 'mass_err_minus', 'width', 'width_err_plus',
+               'width_err_minus', 'spin', 'pdg_id')
+
+''' The decay mode properties copied from implementations whose modes are not dictionaries. '''
+MODE_FIELDS = ('branching_fraction', 'angular_momentum')
+
+''' The loaded snapshot: types by name, modes by (initial name, sorted product names, angular momentum). '''
+_types = None
+_modes = None
+_metadata = None
+
+
+class ReadOnlyRecord(object):
+    ''' Base class for snapshot records, whose attributes are fixed when they are created. '''
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __setattr__(self, name, value):
+        raise TypeError('%s objects from a database snapshot are read-only' % self.__class__.__name__)
+
+    __delattr__ = __setattr__
+
+
+class ParticleType(ReadOnlyRecord, DB_ParticleType):
+    ''' A particle type from the snapshot. Its properties are available as attributes. '''
+
+    @staticmethod
+    def get_type_for_name(type_name):
+        ''' See db.ParticleType.get_type_for_name. '''
+        try:
+            return get_types()[type_name]
+        except KeyError:
+            raise DoesNotExist("Unknown particle name '%s'" % type_name)
+
+    @staticmethod
+    def get_all_types():
+        ''' See db.ParticleType.get_all_types. '''
+        return get_types().values()
+
+    def __repr__(self):
+        return '<Particle type: %s>' % self.name
+
+
+class DecayMode(ReadOnlyRecord, DB_DecayMode):
+    ''' A decay mode from the snapshot, with 'initial' and 'products' attributes holding snapshot particle types. '''
+
+    @staticmethod
+    def get_mode_for_particles(initial, products, angular_momentum=None):
+        ''' See db.DecayMode.get_mode_for_particles. '''
+        try:
+            return get_modes()[ (initial.name, tuple(sorted([p.name for p in products])), angular_momentum) ]
+        except KeyError:
+            raise DoesNotExist('No decay mode in database for %s to %s' % (initial.name, [p.name for p in products]))
+
+    @staticmethod
+    def get_all_modes():
+        ''' See db.DecayMode.get_all_modes. '''
+        return [(mode.initial, mode.products, mode) for mode in get_modes().itervalues()]
+
+    def __repr__(self):
+        return '<Decay mode: %s -> %s>' % (self.initial.name, [p.name for p in self.products])
+
+
+#######################################
+## Exporting and loading             ##
+#######################################
+
+def plain_value(value):
+    ''' @return: value converted to a plain Python type that can be pickled without the database code. '''
+    from decimal import Decimal # Only needed for exporting; kept out of the workers' startup path
+    if isinstance(value, Decimal):
+        return float(value)
+    elif isinstance(value, unicode):
+        return str(value)
+    return value
+
+def record_fields(record, field_names, excluded):
+    ''' @return: a dictionary of the properties of a database record, taken from its keys if it is a
+                 dictionary (as in the dict implementation) or from the attributes in field_names otherwise.
+    '''
+    if isinstance(record, dict):
+        items = record.iteritems()
+    else:
+        items = [(name, getattr(record, name, None)) for name in field_names]
+    return dict( (str(name), plain_value(value)) for name, value in items if name not in excluded )
+
+def export_snapshot(path, particle_type_impl=None, decay_mode_impl=None, source_path=None):
+    ''' Writes every particle type and decay mode of a database implementation to a snapshot file.
+        The file is replaced atomically, so workers loading it concurrently never see a partial snapshot.
+        @param particle_type_impl, decay_mode_impl: the implementation classes to export. Default to the
+                                                    active ones, pydecay.db.PARTICLE_TYPE_IMPL and DECAY_MODE_IMPL.
+        @param source_path: the file the exported database is stored in, if any. Its modification time is
+                            recorded so that is_stale() can tell when the snapshot is out of date.
+        @return: the metadata recorded in the snapshot.
+    '''
+    import hashlib
+    import pydecay.db
+    particle_type_impl = particle_type_impl or pydecay.db.PARTICLE_TYPE_IMPL
+    decay_mode_impl = decay_mode_impl or pydecay.db.DECAY_MODE_IMPL
+
+    types = sorted( (str(ptype.name), record_fields(ptype, TYPE_FIELDS, ('name',)))
+                    for ptype in particle_type_impl.get_all_types() )
+    modes = sorted( (str(initial.name), tuple(sorted([str(p.name) for p in products])),
+                     record_fields(mode, MODE_FIELDS, ('products', 'initial')))
+                    for initial, products, mode in decay_mode_impl.get_all_modes() )
+
+    source_mtime = None
+    if source_path is not None and os.path.exists(source_path):
+        source_mtime = os.path.getmtime(source_path)
+
+    metadata = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'created': time.time(),
+        'source': particle_type_impl.__module__,
+        'source_path': source_path,
+        'source_mtime': source_mtime,
+        'digest': hashlib.md5( repr((types, modes)) ).hexdigest(),
+        'n_types': len(types),
+        'n_modes': len(modes),
+    }
+
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    outfile = open(temp_path, 'wb')
+    try:
+        cPickle.dump( (metadata, types, modes), outfile, cPickle.HIGHEST_PROTOCOL )
+    finally:
+        outfile.close()
+    os.rename(temp_path, path)
+    return metadata
+
+def load(path):
+    ''' Loads a snapshot file, replacing any snapshot loaded before.
+        @return: the snapshot's metadata.
+        @raise ValueError: if the file was written in an incompatible snapshot format.
+    '''
+    global _types, _modes, _metadata
+
+    infile = open(path, 'rb')
+    try:
+        metadata, types, modes = cPickle.load(infile)
+    finally:
+        infile.close()
+
+    if metadata.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError('Snapshot %s has format version %s; version %d is required'
+                         % (path, metadata.get('format_version'), SNAPSHOT_FORMAT_VERSION))
+
+    loaded_types = {}
+    for name, fields in types:
+        loaded_types[name] = ParticleType(name=name, **fields)
+
+    loaded_modes = {}
+    for initial_name, product_names, fields in modes:
+        mode = DecayMode( initial=loaded_types[initial_name],
+                          products=[loaded_types[name] for name in product_names], **fields )
+        loaded_modes[ (initial_name, product_names, fields.get('angular_momentum', None)) ] = mode
+
+    _types, _modes, _metadata = loaded_types, loaded_modes, metadata
+    return metadata
+
+def ensure_loaded():
+    ''' Loads the configured snapshot if no snapshot has been loaded yet. '''
+    global _types, _modes, _metadata
+
+    if _types is None:
+        if SNAPSHOT_FILE is None:
+            warn('No particle database snapshot configured (see pydecay.settings.SNAPSHOT_FILE); '
+                 'every lookup will fail.')
+            _types, _modes, _metadata = {}, {}, {}
+        else:
+            load(SNAPSHOT_FILE)
+
+def get_types():
+    ensure_loaded()
+    return _types
+
+def get_modes():
+    ensure_loaded()
+    return _modes
+
+def get_metadata():
+    ''' @return: a dictionary describing the loaded snapshot, with the keys 'created' (a timestamp),
+                 'source' (the exported implementation's module), 'source_path' and 'source_mtime'
+                 (the exported database file and its modification time, if known), 'digest' (a hash
+                 of the snapshot's contents), and 'n_types' and 'n_modes'.
+    '''
+    ensure_loaded()
+    return _metadata
+
+def is_stale(max_age=None):
+    ''' @param max_age: if given, the number of seconds after which a snapshot is considered stale
+                        regardless of its source.
+        @return: whether the loaded snapshot is older than max_age, or its source database file has
+                 been modified since it was exported.
+    '''
+    metadata = get_metadata()
+    if max_age is not None and time.time() - metadata.get('created', 0) > max_age:
+        return True
+    source_path = metadata.get('source_path')
+    if source_path is not None and os.path.exists(source_path):
+        return os.path.getmtime(source_path) != metadata.get('source_mtime')
+    return False
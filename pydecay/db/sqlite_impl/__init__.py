@@ -0,0 +1,312 @@
+'''
+This module defines a database implementation that talks to an SQLite file directly through
+the standard-library sqlite3 module. It holds the same PDT-style information as the Django
+implementation, but needs nothing beyond the Python standard library, which makes it cheap to
+start up on worker nodes that only need to look up particle and decay information.
+
+The file used is configured by pydecay.settings.SQLITE_DB_NAME (or the PYDECAY_SQLITE_DB
+environment variable). If pydecay.settings.SQLITE_READ_ONLY is set, the file is opened for
+lookups only: writes are refused by SQLite, the file is memory-mapped so that reader processes
+share the operating system's page cache, and connections within a process share one cache.
+connect() can be called to switch to a different file or mode at run time.
+
+Every lookup uses one of the fixed, parameterized SQL statements defined below, so sqlite3 compiles
+each of them once per connection and reuses the prepared statement from then on. Decay modes
+are looked up by a product signature (the sorted product names), which is indexed along with the
+initial particle, so get_mode_for_particles is a single index lookup regardless of how many products
+a decay has.
+
+To create and populate a database file, call create_tables() on a writable connection and then use
+ParticleType.create and ParticleType.add_decay_mode, or copy another implementation's contents with
+import_types() (or tools/db_to_sqlite.py).
+'''
+
+import sqlite3
+from pydecay.db import DoesNotExist, ParticleType as DB_ParticleType, DecayMode as DB_DecayMode
+from pydecay.settings import SQLITE_DB_NAME, SQLITE_READ_ONLY
+
+''' The columns of the particle_type table, other than the id. '''
+PARTICLE_FIELDS = ('name', 'charge', 'mass', 'mass_err_plus', 'mass_err_minus', 'width',
+                   'width_err_plus', 'width_err_minus', 'spin', 'pdg_id')
+
+''' The string used to join product names into a decay mode's product signature. '''
+SIGNATURE_SEPARATOR = ' '
+
+''' How many bytes of the database file to memory-map when opened read-only. '''
+READ_ONLY_MMAP_SIZE = 64 * 1024 * 1024
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS particle_type (
+           id INTEGER PRIMARY KEY,
+           name TEXT NOT NULL,
+           charge REAL NOT NULL DEFAULT 0,
+           mass REAL,
+           mass_err_plus REAL,
+           mass_err_minus REAL,
+           width REAL NOT NULL DEFAULT 0,
+           width_err_plus REAL,
+           width_err_minus REAL,
+           spin REAL,
+           pdg_id INTEGER)''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS particle_type_name ON particle_type (name)''',
+    '''CREATE TABLE IF NOT EXISTS decay_mode (
+           id INTEGER PRIMARY KEY,
+           initial_id INTEGER NOT NULL REFERENCES particle_type (id),
+           signature TEXT NOT NULL,
+           branching_fraction REAL,
+           angular_momentum INTEGER)''',
+    '''CREATE INDEX IF NOT EXISTS decay_mode_signature ON decay_mode (initial_id, signature, angular_momentum)''',
+)
+
+SELECT_TYPE_BY_NAME = 'SELECT id, %s FROM particle_type WHERE name = ?' % ', '.join(PARTICLE_FIELDS)
+INSERT_TYPE = 'INSERT INTO particle_type (%s) VALUES (%s)' % (', '.join(PARTICLE_FIELDS),
+                                                              ', '.join(['?'] * len(PARTICLE_FIELDS)))
+SELECT_ALL_TYPES = 'SELECT id, %s FROM particle_type ORDER BY id' % ', '.join(PARTICLE_FIELDS)
+SELECT_ALL_MODES = '''SELECT initial_id, id, signature, branching_fraction, angular_momentum FROM decay_mode ORDER BY id'''
+SELECT_MODE = '''SELECT id, signature, branching_fraction, angular_momentum FROM decay_mode
+                 WHERE initial_id = ? AND signature = ? AND angular_momentum IS ?'''
+INSERT_MODE = '''INSERT INTO decay_mode (initial_id, signature, branching_fraction, angular_momentum)
+                 VALUES (?, ?, ?, ?)'''
+
+''' The module-wide connection, opened on first use. '''
+_connection = None
+
+def connect(db_name=None, read_only=None):
+    ''' Opens the database file that lookups should use from now on, replacing any
+        previously opened connection and clearing the lookup caches.
+        @param db_name: the path of the SQLite file. Defaults to pydecay.settings.SQLITE_DB_NAME.
+        @param read_only: whether to open the file for lookups only. Defaults to
+                          pydecay.settings.SQLITE_READ_ONLY.
+        @return: the new sqlite3 connection.
+        @raise ValueError: if no db_name is given and none is configured.
+    '''
+    global _connection
+
+    if db_name is None:
+        db_name = SQLITE_DB_NAME
+    if db_name is None:
+        raise ValueError('No SQLite particle database configured: set the PYDECAY_SQLITE_DB environment '
+                         'variable or pydecay.settings.SQLITE_DB_NAME, or call connect() with a file name')
+    if read_only is None:
+        read_only = SQLITE_READ_ONLY
+
+    if _connection is not None:
+        _connection.close()
+
+    if read_only:
+        sqlite3.enable_shared_cache(True)
+    _connection = sqlite3.connect(db_name, cached_statements=len(SCHEMA) + 8)
+    if read_only:
+        _connection.execute('PRAGMA query_only = ON')
+        _connection.execute('PRAGMA mmap_size = %d' % READ_ONLY_MMAP_SIZE)
+
+    ParticleType._cache.clear()
+    DecayMode._cache.clear()
+    return _connection
+
+def get_connection():
+    ''' @return: the module-wide sqlite3 connection, opening it with the configured settings if necessary. '''
+    if _connection is None:
+        connect()
+    return _connection
+
+def create_tables(connection=None):
+    ''' Creates the tables and indexes used by this implementation if they are not already present. '''
+    connection = connection or get_connection()
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+
+def field_value(record, name):
+    ''' @return: a property of a record from another database implementation, taken from its keys if it is
+                 a dictionary (as in the dict implementation) or from its attributes otherwise, as a value
+                 sqlite3 can store.
+    '''
+    if isinstance(record, dict):
+        value = record.get(name, None)
+    else:
+        value = getattr(record, name, None)
+    if value is not None and not isinstance(value, (int, long, float, basestring)):
+        value = float(value) # e.g. the Decimals of the Django implementation
+    return value
+
+def import_types(particle_type_impl, decay_mode_impl, connection=None):
+    ''' Copies every particle type and decay mode of another database implementation into the database,
+        creating its tables if necessary, in a single transaction. Types whose names are already present,
+        and modes that are already present, are left as they are.
+        @param particle_type_impl, decay_mode_impl: the implementation classes to copy from, e.g.
+                                                    pydecay.db.django_impl.ParticleType and DecayMode.
+        @return: the number of particle types and of decay modes added.
+    '''
+    connection = connection or get_connection()
+    create_tables(connection)
+
+    ids = dict( (row[1], row[0]) for row in connection.execute(SELECT_ALL_TYPES) )
+    existing_modes = set( (row[0], row[2], row[4]) for row in connection.execute(SELECT_ALL_MODES) )
+    n_types = n_modes = 0
+    try:
+        for ptype in particle_type_impl.get_all_types():
+            name = str(ptype.name)
+            if ids.has_key(name):
+                continue
+            fields = dict( (field, field_value(ptype, field)) for field in PARTICLE_FIELDS )
+            fields['name'] = name
+            for field in ('charge', 'width'):
+                if fields[field] is None:
+                    fields[field] = 0
+            ids[name] = connection.execute(INSERT_TYPE, [fields[field] for field in PARTICLE_FIELDS]).lastrowid
+            n_types += 1
+
+        for initial, products, mode in decay_mode_impl.get_all_modes():
+            key = (ids[str(initial.name)], product_signature([str(p.name) for p in products]),
+                   field_value(mode, 'angular_momentum'))
+            if key in existing_modes:
+                continue
+            connection.execute(INSERT_MODE, key[:2] + (field_value(mode, 'branching_fraction'), key[2]))
+            existing_modes.add(key)
+            n_modes += 1
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+    ParticleType._cache.clear()
+    DecayMode._cache.clear()
+    return n_types, n_modes
+
+def product_signature(names):
+    ''' @param names: an iterable of product particle names, which may contain repeats.
+        @return: the string under which a decay to those products is indexed. Product order does
+                 not matter, but the number of times each product appears does.
+    '''
+    return SIGNATURE_SEPARATOR.join(sorted(names))
+
+
+class ParticleType(DB_ParticleType):
+    ''' A particle type row. Each column of the particle_type table is available as an attribute. '''
+
+    ''' Types already fetched, keyed by name. '''
+    _cache = {}
+
+    def __init__(self, id=None, **fields):
+        self.id = id
+        for field in PARTICLE_FIELDS:
+            setattr(self, field, fields.get(field, None))
+
+    @staticmethod
+    def from_row(row):
+        ''' @param row: a tuple of (id,) + PARTICLE_FIELDS, as selected by SELECT_TYPE_BY_NAME. '''
+        return ParticleType(row[0], **dict(zip(PARTICLE_FIELDS, row[1:])))
+
+    @staticmethod
+    def get_type_for_name(type_name):
+        ''' See db.ParticleType.get_type_for_name. '''
+
+        try:
+            return ParticleType._cache[type_name]
+        except KeyError:
+            pass
+
+        row = get_connection().execute(SELECT_TYPE_BY_NAME, (type_name,)).fetchone()
+        if row is None:
+            raise DoesNotExist("Unknown particle name '%s'" % type_name)
+
+        ptype = ParticleType._cache[type_name] = ParticleType.from_row(row)
+        return ptype
+
+    # The default get_types_for_names is used; after the first lookup of each name it never reaches the DB
+
+    @staticmethod
+    def get_all_types():
+        ''' See db.ParticleType.get_all_types. '''
+        ptypes = [ParticleType.from_row(row) for row in get_connection().execute(SELECT_ALL_TYPES)]
+        for ptype in ptypes:
+            ParticleType._cache.setdefault(ptype.name, ptype)
+        return ptypes
+
+    @staticmethod
+    def create(name, **fields):
+        ''' Inserts a new particle type and commits it.
+            @param name: the PDG-style name of the type (e.g. 'pi+').
+            @param fields: values for any of the other PARTICLE_FIELDS.
+            @return: the new ParticleType.
+        '''
+        fields['name'] = name
+        fields.setdefault('charge', 0)
+        fields.setdefault('width', 0)
+        connection = get_connection()
+        cursor = connection.execute(INSERT_TYPE, [fields.get(field, None) for field in PARTICLE_FIELDS])
+        connection.commit()
+
+        ptype = ParticleType._cache[name] = ParticleType(cursor.lastrowid, **fields)
+        return ptype
+
+    def add_decay_mode(self, products, branching_fraction=None, angular_momentum=None):
+        ''' Inserts a decay mode of this type and commits it.
+            @param products: an iterable of ParticleType objects
+            @param branching_fraction: the branching fraction of this decay mode, if known
+            @param angular_momentum: the total angular momentum of the decay, if it distinguishes
+                                     this mode from another with the same products
+            @return: the new DecayMode.
+        '''
+        signature = product_signature([p.name for p in products])
+        connection = get_connection()
+        cursor = connection.execute(INSERT_MODE, (self.id, signature, branching_fraction, angular_momentum))
+        connection.commit()
+        return DecayMode(cursor.lastrowid, self, signature, branching_fraction, angular_momentum)
+
+    def __repr__(self):
+        return '<Particle type: %s>' % self.name
+
+
+class DecayMode(DB_DecayMode):
+    ''' A decay mode row. The initial particle type is available as the 'initial' attribute; the product
+        types are looked up from the mode's product signature when the 'products' attribute is first used.
+    '''
+
+    ''' Modes already fetched, keyed by (initial id, product signature, angular momentum). '''
+    _cache = {}
+
+    def __init__(self, id, initial, signature, branching_fraction=None, angular_momentum=None):
+        self.id = id
+        self.initial = initial
+        self.signature = signature
+        self.branching_fraction = branching_fraction
+        self.angular_momentum = angular_momentum
+        self._products = None
+
+    @property
+    def products(self):
+        if self._products is None:
+            names = self.signature.split(SIGNATURE_SEPARATOR) if self.signature else []
+            self._products = ParticleType.get_types_for_names(names)
+        return self._products
+
+    @staticmethod
+    def get_mode_for_particles(initial, products, angular_momentum=None):
+        ''' See db.DecayMode.get_mode_for_particles. '''
+
+        signature = product_signature([p.name for p in products])
+        key = (initial.id, signature, angular_momentum)
+        try:
+            return DecayMode._cache[key]
+        except KeyError:
+            pass
+
+        row = get_connection().execute(SELECT_MODE, key).fetchone()
+        if row is None:
+            raise DoesNotExist('No decay mode in database for %s to %s' % (initial.name, [p.name for p in products]))
+
+        mode = DecayMode._cache[key] = DecayMode(row[0], initial, *row[1:])
+        return mode
+
+    @staticmethod
+    def get_all_modes():
+        ''' See db.DecayMode.get_all_modes. '''
+        types_by_id = dict( (ptype.id, ptype) for ptype in ParticleType.get_all_types() )
+        for row in get_connection().execute(SELECT_ALL_MODES).fetchall():
+            mode = DecayMode(row[1], types_by_id[row[0]], *row[2:])
+            yield mode.initial, mode.products, mode
+
+    def __repr__(self):
+        return '<Decay mode: %s -> %s>' % (self.initial.name, self.signature.split(SIGNATURE_SEPARATOR))
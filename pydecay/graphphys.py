@@ -40,6 +40,8 @@ The purpose of the various pieces of an ID is to ensure that the - character may
 an identifier, but if it is followed by a >, forming the -> symbol, it is interpreted as a decay.
 '''
 
+import re
+
 from pydecay import *
 from pyparsing import (Literal, Word, OneOrMore, ZeroOrMore, Forward, Group, Optional,
     Combine, alphas, nums, restOfLine, cStyleComment, nums, alphanums, CaselessKeyword,
@@ -55,7 +57,8 @@ decay_parser = None
 ''' The ParserElement representing a GraphPhys particle ID. Useful for validating IDs. '''
 arrow_start = Literal('-')
 arrow_end = Literal('>')
-id_chunk = Word(alphanums + '`~!@$%^&*()_+|\/<>.:?')
+id_chunk_chars = alphanums + '`~!@$%^&*()_+|\/<>.:?'
+id_chunk = Word(id_chunk_chars)
 id_continuation = ZeroOrMore(arrow_start + ~arrow_end + Optional(id_chunk)) # -'s in middle are OK as long as no >'s
 non_neg_id = Combine(id_chunk + id_continuation)
 neg_id = Combine( arrow_start + Optional(~arrow_end + id_chunk) + id_continuation)
@@ -264,7 +267,8 @@ def get_parser(force=False):
         param_list = Forward()
         stmt_list = Forward()
 
-        param_val = (float_number | ID | param_list).setName("param_val")
+        # A number followed by more ID characters, like the range 1.7:2.1, is an ID
+        param_val = ((float_number + ~id_chunk) | ID | param_list).setName("param_val")
 
         # We don't want to suppress the equals, since there may be parameters with no values
         param_sequence = OneOrMore(ID + Optional(equals + param_val) + 
@@ -326,12 +330,21 @@ def get_parser(force=False):
         
     return decay_parser
 
+''' The ID rule as a regular expression, for validating IDs quickly: an unquoted ID is any run of id_chunk
+    characters and -'s with no -> in it, and a quoted ID is anything but a " or a line break between two "'s.
+    Like ID.parseString, it allows whitespace before and after the ID. '''
+id_regex = re.compile( r'[ \t\n\r]*(?:(?:[%s]|-(?!>))+|"[^"\n\r]*")[ \t\n\r]*\Z' % re.escape(id_chunk_chars) )
+
+''' The results of is_valid_id so far, by name, up to MAX_VALID_ID_CACHE of them '''
+valid_id_cache = {}
+MAX_VALID_ID_CACHE = 10000
+
 def is_valid_id(name):
     ''' @param name: a possible ID to check
         @return: whether or not name can be parsed as an ID in GraphPhys '''
-    global ID
-    try:
-        ID.parseString(name, parseAll=True)
-        return True
-    except ParseException:
-        return False
+    valid = valid_id_cache.get(name)
+    if valid is None:
+        if len(valid_id_cache) >= MAX_VALID_ID_CACHE:
+            valid_id_cache.clear()
+        valid = valid_id_cache[name] = id_regex.match(name) is not None
+    return valid
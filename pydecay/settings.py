@@ -4,6 +4,8 @@ setting up database options, including which database implementation
 classes to use.
 '''
 
+import os
+
 ''' Name of the parameter which should be considered a DB override for decay branching fraction. '''
 BRANCHING_FRACTION_PARAM = 'fraction'
 
@@ -22,11 +24,26 @@ DB_PORT = ''
 DB_USER = ''
 DB_PASSWORD = ''
 
+''' The SQLITE_... settings are used for the standalone sqlite3 database implementation.
+    SQLITE_DB_NAME is the implementation's own file, which has a different schema from the Django
+    database in DB_NAME (see pydecay.db.sqlite_impl.import_types for filling it from another
+    implementation). It can be overridden per process with the PYDECAY_SQLITE_DB environment
+    variable, which is handy for worker nodes that keep their own copy of the database file.
+    SQLITE_READ_ONLY opens the file for lookups only, so that many reader processes can share it. '''
+SQLITE_DB_NAME = os.environ.get('PYDECAY_SQLITE_DB', None)
+SQLITE_READ_ONLY = False
+
+''' The snapshot file loaded by the in-memory snapshot database implementation. Can be overridden
+    per process with the PYDECAY_SNAPSHOT environment variable. '''
+SNAPSHOT_FILE = os.environ.get('PYDECAY_SNAPSHOT', None)
+
 ''' This parameter should either be a pair of type objects (ParticleType, DecayMode),
     representing the particle type and decay mode types from the database implementation,
     or a string with the fully qualified name of a module containing classes by those names.
     The following package names are available in the default PyDecay distribution:
         * 'pydecay.db.django_impl' (relational database)
+        * 'pydecay.db.sqlite_impl' (relational database without Django)
+        * 'pydecay.db.snapshot_impl' (read-only, in-memory copy of one of the others)
         * 'pydecay.db.dict_impl'   (dictionary-based "database")
         * 'pydecay.db'             (null implementation on which lookup always fails)
     For more information on each of these implementations, consult their respective definitions.    
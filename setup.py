@@ -12,6 +12,8 @@ setup(name='pydecay',
             'pydecay/converters',\
             'pydecay/db/dict_impl',\
             'pydecay/db/django_impl',
-            'pydecay/db/django_impl/pydecaydb'
+            'pydecay/db/django_impl/pydecaydb',
+            'pydecay/db/sqlite_impl',
+            'pydecay/db/snapshot_impl'
             ],
     )
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+################################################################################
+#
+# Generates events from a GraphPhys decay tree with the simulator's streaming
+# interface (generator.py) and histograms the invariant mass of two of the
+# particles as the events come in, without writing them anywhere. With
+# several processes, each fills its own histogram and they are merged.
+#
+# Usage: histogram_while_generating.py <gp file> <events> <node 1> <node 2> [processes]
+#
+# The nodes are numbered as in the decay plan (printed at the start).
+#
+################################################################################
+import sys
+
+import numpy as np
+
+from pydecay import graphphys
+from generator import Simulation
+from histograms import Histogram, HistogramSet
+
+def main(argv):
+    if len(argv) < 5:
+        print "\n\nUsage: histogram_while_generating.py <gp file> <events> <node 1> <node 2> [processes]\n\n"
+        sys.exit(-1)
+
+    n_events = int(argv[2])
+    node1, node2 = int(argv[3]), int(argv[4])
+    n_workers = 1
+    if len(argv) > 5:
+        n_workers = int(argv[5])
+
+    simulation = Simulation(graphphys.get_parser().parseFile(argv[1]), n_workers=n_workers)
+    for node, type_name in enumerate(simulation.plan.types):
+        print node, type_name
+
+    histogram = Histogram('mass', 'Mass', [node1, node2], 100, 0.0, 2.0)
+    simulation.fill(n_events, HistogramSet([histogram]))
+
+    print '%d events generated, %d tried' % (n_events, simulation.n_tried)
+    print 'mean %f, rms %f' % (histogram.moments.mean, np.sqrt(histogram.moments.variance))
+    for low, count in zip(histogram.edges[:-1], histogram.to_arrays()['counts']):
+        print '%.2f %d' % (low, count)
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+################################################################################
+#
+# Reads a binary event file written by the simulator (mc_simulator.py -o),
+# splitting it into one range of events per process, and histograms the
+# invariant mass of two of the particles.
+#
+# Each process memory-maps the same file and reads only its own range, so
+# nothing but the histograms is passed between processes.
+#
+# Usage: read_events_in_parallel.py <event file> <node 1> <node 2> [processes]
+#
+# The nodes are numbered as in the file's header (printed at the start).
+#
+################################################################################
+import sys
+import multiprocessing
+
+import numpy as np
+
+from event_io import MappedEventFile
+
+bins = np.linspace(0.0, 2.0, 101)
+
+def histogram_shard(args):
+    infile_name, node1, node2, shard, n_shards = args
+    events = MappedEventFile(infile_name)
+    start, stop = events.get_shard(shard, n_shards)
+
+    counts = np.zeros(len(bins) - 1)
+    for chunk in events.iter_events(start, stop):
+        p4 = chunk.get_vectors(node1) + chunk.get_vectors(node2)
+        mass = np.sqrt(np.maximum(p4[:, 0]**2 - (p4[:, 1:]**2).sum(axis=1), 0.0))
+        present = chunk.get_present(node1) & chunk.get_present(node2)
+        counts += np.histogram(mass[present], bins, weights=chunk.weights[present])[0]
+    return counts
+
+def main(argv):
+    if len(argv) < 4:
+        print "\n\nUsage: read_events_in_parallel.py <event file> <node 1> <node 2> [processes]\n\n"
+        sys.exit(-1)
+
+    infile_name = argv[1]
+    node1, node2 = int(argv[2]), int(argv[3])
+    n_shards = multiprocessing.cpu_count()
+    if len(argv) > 4:
+        n_shards = int(argv[4])
+
+    events = MappedEventFile(infile_name)
+    for node, type_name in enumerate(events.types):
+        print node, type_name
+    print '%d events' % events.n_events
+
+    pool = multiprocessing.Pool(n_shards)
+    counts = sum(pool.map(histogram_shard, [(infile_name, node1, node2, shard, n_shards)
+                                            for shard in range(n_shards)]))
+    for low, count in zip(bins[:-1], counts):
+        print '%.2f %d' % (low, count)
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
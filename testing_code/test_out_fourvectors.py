@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import sys
+import time
+from math import sqrt
+
+import numpy as np
+
+from fourvectors import *
+
+################################################################################
+# Check the NumPy four-vector functions against each other, then time a
+# typical analysis step (sum two particles, take the invariant mass and boost
+# one of them into the pair's rest frame) for n events, both with arrays and
+# one object at a time. The per-object timing uses ROOT's TLorentzVector if
+# ROOT is available, and the same arithmetic in plain Python otherwise.
+#
+# Usage: test_out_fourvectors.py <number of events>
+################################################################################
+def python_step(a, b):
+    # What TLorentzVector does for (a + b).M() and a.Boost(-(a + b).BoostVector())
+    e, x, y, z = a[0] + b[0], a[1] + b[1], a[2] + b[2], a[3] + b[3]
+    m = sqrt(max(e*e - x*x - y*y - z*z, 0.0))
+    bx, by, bz = -x/e, -y/e, -z/e
+    b2 = bx*bx + by*by + bz*bz
+    gamma = 1.0 / sqrt(1.0 - b2)
+    bp = bx*a[1] + by*a[2] + bz*a[3]
+    gamma2 = (gamma - 1.0)/b2 if b2 > 0 else 0.0
+    return m, (gamma*(a[0] + bp), a[1] + gamma2*bp*bx + gamma*bx*a[0],
+               a[2] + gamma2*bp*by + gamma*by*a[0], a[3] + gamma2*bp*bz + gamma*bz*a[0])
+
+def main(argv):
+
+    n_events = int(argv[1])
+    rng = np.random.RandomState(4357)
+
+    a = make(0.0, *rng.normal(size=(3, n_events)))
+    a[:, E] = np.sqrt(0.4937**2 + momentum(a)**2)
+    b = make(0.0, *rng.normal(size=(3, n_events)))
+    b[:, E] = np.sqrt(0.1396**2 + momentum(b)**2)
+
+    ############################################################################
+    # Consistency checks
+    ############################################################################
+    pair = total(a, b)
+    in_pair_frame = to_rest_frame(np.stack([a, b], axis=1), pair[:, np.newaxis])
+    print 'mass invariant under boosts:     %g' % np.abs(mass(in_pair_frame[:, 0]) - 0.4937).max()
+    print 'pair at rest in its own frame:   %g' % np.abs(total(in_pair_frame[:, 0], in_pair_frame[:, 1])[:, 1:]).max()
+    print 'boost there and back:            %g' % np.abs(from_rest_frame(to_rest_frame(a, pair), pair) - a).max()
+    print 'back to back in pair frame:      %g' % np.abs(cos_angle(in_pair_frame[:, 0], in_pair_frame[:, 1]) + 1).max()
+    print 'helicity angles in [-1, 1]:      %s' % (np.abs(cos_helicity(a, pair)) <= 1 + 1e-12).all()
+
+    ############################################################################
+    # Timing
+    ############################################################################
+    start = time.time()
+    masses = invariant_mass(a, b)
+    boosted = to_rest_frame(a, total(a, b))
+    array_time = time.time() - start
+
+    n_objects = min(n_events, 200000)
+    try:
+        from ROOT import TLorentzVector
+        label = 'ROOT TLorentzVector'
+        va = [TLorentzVector(p[1], p[2], p[3], p[0]) for p in a[:n_objects]]
+        vb = [TLorentzVector(p[1], p[2], p[3], p[0]) for p in b[:n_objects]]
+        start = time.time()
+        for i in xrange(n_objects):
+            p = va[i] + vb[i]
+            m = p.M()
+            va[i].Boost(-p.BoostVector())
+        object_time = time.time() - start
+    except ImportError:
+        label = 'per-object Python (ROOT not available)'
+        la, lb = a[:n_objects].tolist(), b[:n_objects].tolist()
+        start = time.time()
+        for i in xrange(n_objects):
+            m, boosted_a = python_step(la[i], lb[i])
+        object_time = time.time() - start
+        print 'per-object results agree:        %g' % abs(boosted_a[0] - boosted[n_objects - 1, E])
+
+    print 'arrays:     %10.0f events/s' % (n_events / array_time)
+    print '%s: %10.0f events/s' % (label, n_objects / object_time)
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from pyparsing import ParseException
+
+from pydecay import Particle, ProcessGroup
+from pydecay import graphphys
+from pydecay.converters import GraphPhysConverter
+
+################################################################################
+# Check graphphys.is_valid_id, which uses a regular expression, against the
+# pyparsing ID rule it replaces: on every string of up to 4 characters from an
+# alphabet of the characters that matter to the rule, and on random strings
+# (including non-ASCII ones). Then time both, and GraphPhysConverter on a
+# large decay tree with each.
+#
+# The parser isn't built here: get_parser() makes ID skip comments too, so
+# after it has been called ID also accepts e.g. 'a //c', which is not an ID.
+#
+# Usage: test_out_graphphys_ids.py <number of random strings>
+################################################################################
+
+# Characters with a special meaning to the ID rule, and some that have none
+ALPHABET = ['a', '7', '+', '-', '>', '"', ' ', '\t', '\n', '\\', '{', ',', '/', '*']
+RANDOM_CHARACTERS = ALPHABET + ['(', '.', ':', '_', '=', ';', '[', '\r', '\x0b', '#', u'\xe9']
+
+def pyparsing_is_valid_id(name):
+    # The old is_valid_id
+    try:
+        graphphys.ID.parseString(name, parseAll=True)
+        return True
+    except ParseException:
+        return False
+
+def regex_is_valid_id(name):
+    # is_valid_id without its cache
+    return graphphys.id_regex.match(name) is not None
+
+def make_tree(depth, fanout):
+    # A decay tree with fanout products per decay, depth levels deep, with
+    # names and parameters that need quoting now and then
+    particle = Particle('X-%d' % depth, mass='%g' % (depth + 1.0), lineshape='BW')
+    if depth > 0:
+        products = [ make_tree(depth - 1, fanout) for i in range(fanout) ]
+        particle.add_decay(products, prob='0.5', label='a b')
+    return particle
+
+def main(argv):
+
+    n_random = int(argv[1])
+    rng = np.random.RandomState(4357)
+
+    ############################################################################
+    # Agreement with the pyparsing rule
+    ############################################################################
+    strings = [ ''.join(chars) for n in range(5) for chars in itertools.product(ALPHABET, repeat=n) ]
+    for i in range(n_random):
+        chars = rng.choice(len(RANDOM_CHARACTERS), rng.randint(1, 12))
+        strings.append( u''.join([ RANDOM_CHARACTERS[c] for c in chars ]) )
+        # Quoted strings, which the random ones rarely are
+        strings.append( u'"%s"' % strings[-1] )
+
+    disagreements = [ s for s in strings if pyparsing_is_valid_id(s) != graphphys.is_valid_id(s) ]
+    n_valid = len([ s for s in strings if graphphys.is_valid_id(s) ])
+    print 'strings checked:  %d (%d valid IDs)' % (len(strings), n_valid)
+    print 'disagreements:    %d %s' % (len(disagreements), [repr(s) for s in disagreements[:10]])
+
+    ############################################################################
+    # Timing
+    ############################################################################
+    # Names as a converter writes them: parameter names and values and types, which
+    # repeat, and node names, which don't
+    repeated = [ name for i in range(20000) for name in ('mass', '1.8696', 'pi+', 'a b') ]
+    unique = [ 'pi+_%d' % (140000000 + i) for i in range(80000) ]
+    for label, validate in [('pyparsing', pyparsing_is_valid_id), ('regex', regex_is_valid_id),
+                            ('regex, cached', graphphys.is_valid_id)]:
+        rates = []
+        for names in (repeated, unique):
+            start = time.time()
+            for name in names:
+                validate(name)
+            rates.append( len(names) / (time.time() - start) )
+        print '%-15s %10.0f repeated names/s, %10.0f unique names/s' % (label + ':', rates[0], rates[1])
+
+    root = make_tree(8, 3)
+    for label, validate in [('pyparsing', pyparsing_is_valid_id), ('regex, cached', graphphys.is_valid_id)]:
+        is_valid_id = graphphys.is_valid_id
+        graphphys.is_valid_id = validate
+        try:
+            start = time.time()
+            gp_code = GraphPhysConverter().convert(ProcessGroup([root]))
+            print 'converting %d particles, %-14s %.2f s' % (gp_code.count('[type='), label + ':', time.time() - start)
+        finally:
+            graphphys.is_valid_id = is_valid_id
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
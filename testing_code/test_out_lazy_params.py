@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import sys
+
+import pydecay.settings
+
+################################################################################
+# Check that writing to a parameter dictionary nested in an eager
+# LazyParamDictionary (see DecayElementInstance.get_params) is seen when the
+# parameters are read again through the outer dictionary: the outer dictionary
+# must stop serving the subparameters it preloaded before the write.
+#
+# The Django database is created in a new SQLite file, which must not exist.
+#
+# Usage: test_out_lazy_params.py <database file>
+################################################################################
+
+def main(argv):
+
+    pydecay.settings.DB_NAME = argv[1]
+    pydecay.settings.DB_ENGINE = 'django.db.backends.sqlite3'
+
+    from django.core.management import call_command
+    from pydecay import Particle
+    from pydecay.db.django_impl import ParticleType, ParticleInstance
+    from pydecay.db.django_impl.pydecaydb.models import ParticleBaseType
+    from pydecay.db.django_impl.converters import DBInstanceConverter
+
+    call_command('syncdb', interactive=False, verbosity=0)
+    base = ParticleBaseType(mass=5.2796, mass_err_plus=0, mass_err_minus=0, width=0,
+                            width_err_plus=0, width_err_minus=0)
+    base.save()
+    ParticleType(name='B0', base_type=base).save()
+
+    particle = Particle('B0')
+    particle.add_param('sel', {'Mass': '1:2', 'cuts': {'P': '0:3'}})
+    stored = ParticleInstance.objects.get( id=DBInstanceConverter().convert(particle).id )
+
+    checks = []
+    def check(label, params, expected):
+        found = params.to_dict()
+        checks.append(found == expected)
+        print '%-45s %s %s' % (label + ':', ('FAILED', 'ok')[found == expected], found)
+
+    expected = {'sel': {'Mass': '1:2', 'cuts': {'P': '0:3'}}}
+    params = stored.get_params(eager=True)
+    check('eager, as stored', params, expected)
+
+    params['sel']['Mass'] = '2:3'
+    expected['sel']['Mass'] = '2:3'
+    check('value changed through a nested dictionary', params, expected)
+
+    params = stored.get_params(eager=True)
+    params['sel']['cuts']['Pt'] = '1:4'
+    expected['sel']['cuts']['Pt'] = '1:4'
+    check('value added two levels down', params, expected)
+
+    params = stored.get_params(eager=True)
+    del params['sel']['cuts']
+    del expected['sel']['cuts']
+    check('nested dictionary deleted', params, expected)
+
+    check('stored, read lazily', stored.get_params(eager=False), expected)
+    check('stored, read eagerly', stored.get_params(eager=True), expected)
+
+    print '%d of %d checks passed' % (sum(checks), len(checks))
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
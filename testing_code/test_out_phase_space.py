@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import sys
+import time
+
+import numpy as np
+
+from phase_space import *
+
+################################################################################
+# Generate 3-body decays D+ -> K- pi+ pi+ at rest with the NumPy phase-space
+# generator, check that energy and momentum are conserved and the daughters
+# have the right masses, and print the generation rate.
+#
+# Usage: test_out_phase_space.py <number of events> [<batch size>]
+################################################################################
+def main(argv):
+
+    n_events = int(argv[1])
+    batch_size = 100000
+    if len(argv) > 2:
+        batch_size = int(argv[2])
+
+    parent_mass = 1.8696
+    masses = np.array([0.493677, 0.139570, 0.139570])
+
+    rng = np.random.RandomState(4357)
+
+    n = 0
+    total_time = 0.0
+    max_violation = 0.0
+    max_mass_error = 0.0
+    weight_sum = 0.0
+    while n<n_events:
+
+        size = min(batch_size, n_events - n)
+        parent = np.zeros((size, 4))
+        parent[:, PZ] = 4.0 # Give the parent some momentum to exercise the boost
+        parent[:, E] = np.sqrt(parent_mass**2 + 4.0**2)
+
+        start = time.time()
+        daughters, weights = generate(parent, masses, rng)
+        total_time += time.time() - start
+
+        violation = np.abs(daughters.sum(axis=1) - parent).max()
+        daughter_masses = np.sqrt(daughters[:, :, E]**2 - (daughters[:, :, 1:]**2).sum(axis=2))
+        max_violation = max(max_violation, violation)
+        max_mass_error = max(max_mass_error, np.abs(daughter_masses - masses).max())
+        weight_sum += weights.sum()
+
+        n += size
+
+    print 'events:                 %d' % n
+    print 'events per second:      %.0f' % (n / total_time)
+    print 'mean weight:            %f' % (weight_sum / n)
+    print 'max 4-momentum error:   %g' % max_violation
+    print 'max daughter mass error: %g' % max_mass_error
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
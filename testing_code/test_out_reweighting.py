@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import sys
+
+import numpy as np
+
+from pydecay import graphphys
+from pydecay.db import dict_impl
+from generator import Simulation, concatenate_batches
+from reweighting import reweight, get_lineshape_factors
+import fourvectors
+
+################################################################################
+# Check reweighting (see reweighting.py) on D+ -> K*0 pi+, K*0 -> K+ pi-, with
+# a rare D+ -> K- pi+ pi+ decay:
+#
+# - A weighted sample, in which the rare decay and the K*0 mass tail are
+#   oversampled, is reweighted to new branching fractions and compared with an
+#   unweighted sample generated with those branching fractions: the fraction of
+#   rare decays and the K*0 and K- pi+ mass distributions should agree within
+#   their errors.
+# - Reweighting to a lineshape that doesn't change, with a tabulated and with a
+#   plain lineshape, should give factors of exactly 1.
+#
+# Usage: test_out_reweighting.py <number of events>
+################################################################################
+
+TREE = '''
+D+ [mass=1.8696];
+Kst [type=K*(892)0, lineshape=%(lineshape)s%(kst_options)s];
+K+ [mass=0.4937]; pi- [mass=0.1396]; pi+ [mass=0.1396];
+Km [type=K-, mass=0.4937]; pip1 [type=pi+, mass=0.1396]; pip2 [type=pi+, mass=0.1396];
+D+ -> {Kst pi+} [prob=%(common)s];
+D+ -> {Km pip1 pip2} [prob=%(rare)s%(rare_options)s];
+Kst -> {K+ pi-} [prob=1];
+'''
+
+def generate(n_events, seed, lineshape='BW', common=0.998, rare=0.002, kst_options='', rare_options=''):
+    # A sample of the tree, as one EventBatch, and its plan
+    source = TREE % {'lineshape': lineshape, 'common': common, 'rare': rare,
+                     'kst_options': kst_options, 'rare_options': rare_options}
+    simulation = Simulation(graphphys.get_parser().parseString(source), seed=seed)
+    return simulation.plan, concatenate_batches(list(simulation.generate_chunks(n_events)))
+
+def get_histogram(masses, weights, bins, mass_range):
+    # A histogram normalized to the total weight of the events, and its errors
+    present = np.isfinite(masses)
+    counts = np.histogram(masses[present], bins, mass_range, weights=weights[present])[0]
+    squares = np.histogram(masses[present], bins, mass_range, weights=weights[present]**2)[0]
+    return counts / weights.sum(), np.sqrt(squares) / weights.sum()
+
+def compare(label, a, b):
+    # Prints how well two histograms (or single values) with errors agree
+    (a, a_errors), (b, b_errors) = a, b
+    pulls = (np.atleast_1d(a) - b) / np.sqrt(np.atleast_1d(a_errors)**2 + b_errors**2 + 1e-30)
+    chi2 = (pulls**2).sum()
+    print '%-40s chi2 %6.1f / %3d  %s' % (label + ':', chi2, len(pulls), ('FAILED', 'ok')[chi2 < 2 * len(pulls) + 10])
+    return chi2 < 2 * len(pulls) + 10
+
+def main(argv):
+
+    n_events = int(argv[1])
+    dict_impl.ParticleType.particles['K*(892)0'] = dict_impl.ParticleType(mass=0.8955, width=0.0473)
+    results = []
+
+    ############################################################################
+    # Branching fractions: reweighted against regenerated
+    ############################################################################
+    plan, weighted = generate(n_events, 1, kst_options=', oversample=[Mass=1.0:1.4, factor=20]',
+                              rare_options=', oversample=250')
+    direct = generate(n_events, 2, common=0.9, rare=0.1)[1]
+
+    # The D+ decays to the K*0 (decay 0) or to K- pi+ pi+ (decay 1); both trees have the same nodes
+    d_plus = list(plan.types).index('D+')
+    kst, k_minus, pi_plus = plan.get_products(0)[0], plan.get_products(1)[0], plan.get_products(1)[1]
+    probabilities = plan.probabilities.copy()
+    probabilities[0], probabilities[1] = 0.9, 0.1
+    weights = reweight(plan, weighted.vectors, weighted.choices, weighted.weights, probabilities=probabilities)
+
+    samples = []
+    for batch, event_weights in [(weighted, weights), (direct, direct.weights)]:
+        # The fraction's error includes the fluctuations of the total weight, which the
+        # common decay's oversampled K*0 masses dominate
+        in_rare = batch.choices[:, d_plus] == 1
+        total = event_weights.sum()
+        fraction = event_weights[in_rare].sum() / total
+        error = np.sqrt( (1 - fraction)**2 * (event_weights[in_rare]**2).sum() +
+                         fraction**2 * (event_weights[~in_rare]**2).sum() ) / total
+        print '%-40s %.4f +- %.4f' % ('fraction of rare decays, %s:' % ('reweighted', 'regenerated')[len(samples)],
+                                      fraction, error)
+
+        kst_masses = fourvectors.mass(batch.vectors[:, kst])
+        k_pi_masses = fourvectors.mass(batch.vectors[:, k_minus] + batch.vectors[:, pi_plus])
+        samples.append( ((fraction, error), get_histogram(kst_masses, event_weights, 40, (0.64, 1.4)),
+                         get_histogram(k_pi_masses, event_weights, 30, (0.6, 1.75))) )
+    results.append( compare('fraction of rare decays', samples[0][0], samples[1][0]) )
+    results.append( compare('K*0 mass', samples[0][1], samples[1][1]) )
+    results.append( compare('K- pi+ mass in rare decays', samples[0][2], samples[1][2]) )
+
+    ############################################################################
+    # Unchanged lineshapes
+    ############################################################################
+    for lineshape in ('BW', 'RBW'):
+        plan, batch = generate(min(n_events, 100000), 3, lineshape=lineshape)
+        node = list(plan.types).index('K*(892)0')
+        factors = [ get_lineshape_factors(plan, node, batch.vectors, batch.weights),
+                    get_lineshape_factors(plan, node, batch.vectors, batch.weights,
+                                          plan.masses[node], plan.widths[node], lineshape) ]
+        exact = len([ f for f in factors if (f == 1.0).all() ]) == len(factors)
+        print '%-40s %s (factors from %.17g to %.17g)' % ('unchanged %s lineshape:' % lineshape,
+                                                          ('FAILED', 'ok')[exact], min([f.min() for f in factors]),
+                                                          max([f.max() for f in factors]))
+        results.append(exact)
+
+    print '%d of %d checks passed' % (sum(results), len(results))
+
+
+################################################################################
+if __name__ == "__main__":
+    main(sys.argv)
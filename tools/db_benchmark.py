@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+''' Times particle-type and decay-mode lookups against one or more pydecay.db implementations,
+    each named by its module, e.g.
+
+    > python db_benchmark.py -g ../examples/btodk.gp pydecay.db.sqlite_impl pydecay.db.django_impl
+
+    For each implementation two numbers are reported: the cold start (importing the implementation in
+    a fresh interpreter and performing the first lookup) and the average time per lookup once warm.
+    The particle types and decays looked up are taken from the GraphPhys files given with -g, or from
+    the names given with --names. The databases are expected to hold those types already; lookups that
+    fail are timed like any other and counted as misses.
+'''
+
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+from pydecay import graphphys
+from pydecay.db import DoesNotExist
+
+COLD_START_CODE = '''
+import time
+start = time.time()
+%(setup)s
+from %(impl)s import ParticleType
+try:
+    ParticleType.get_type_for_name(%(name)r)
+except Exception:
+    pass
+print time.time() - start
+'''
+
+def collect_lookups(gp_files):
+    ''' @return: a pair (type names, decays) covering every particle and decay in the given files,
+                 where each decay is a pair (initial type name, list of product type names).
+    '''
+    names = set()
+    decays = []
+    def visit(particle):
+        names.add(particle.type)
+        for decay in particle.decays:
+            decays.append( (particle.type, [p.type for p in decay.products]) )
+            for product in decay.products:
+                visit(product)
+
+    for gp_file in gp_files:
+        for root in graphphys.get_parser().parseFile(gp_file):
+            visit(root)
+    return sorted(names), decays
+
+def time_cold_start(impl, name, setup_module=None, repeats=3):
+    ''' @return: the best time, over several fresh interpreters, to import impl and look up one name. '''
+    setup = ('', 'import %s' % setup_module)[setup_module is not None]
+    code = COLD_START_CODE % {'setup': setup, 'impl': impl, 'name': name}
+    return min( float(subprocess.check_output([sys.executable, '-c', code])) for i in range(repeats) )
+
+def time_lookups(impl, names, decays, n_lookups):
+    ''' @return: a tuple (seconds per type lookup, seconds per decay mode lookup, misses). '''
+    module = __import__(impl, globals(), locals(), ['ParticleType', 'DecayMode'])
+    ptype_class, mode_class = module.ParticleType, module.DecayMode
+
+    misses = [0]
+    def lookup_type(name):
+        try:
+            return ptype_class.get_type_for_name(name)
+        except DoesNotExist:
+            misses[0] += 1
+
+    for name in names: # Warm up whatever caching the implementation does
+        lookup_type(name)
+
+    start = time.time()
+    for i in xrange(n_lookups):
+        lookup_type(names[i % len(names)])
+    per_type = (time.time() - start) / n_lookups
+
+    resolved = []
+    for initial, products in decays:
+        try:
+            resolved.append( (ptype_class.get_type_for_name(initial), ptype_class.get_types_for_names(products)) )
+        except DoesNotExist:
+            pass
+
+    per_mode = None
+    if len(resolved) > 0:
+        start = time.time()
+        for i in xrange(n_lookups):
+            initial, products = resolved[i % len(resolved)]
+            try:
+                mode_class.get_mode_for_particles(initial, products)
+            except DoesNotExist:
+                misses[0] += 1
+        per_mode = (time.time() - start) / n_lookups
+
+    return per_type, per_mode, misses[0]
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options] impl_module [impl_module ...]')
+    parser.add_option("-g", "--gp", dest="gp_files", action="append", default=[],
+                      help='GraphPhys file whose particles and decays should be looked up. May be repeated.')
+    parser.add_option("--names", dest="names", default=None,
+                      help='Comma-separated particle names to look up, in addition to those from -g.')
+    parser.add_option("-n", "--lookups", dest="n_lookups", type="int", default=10000,
+                      help='Number of warm lookups to time per implementation.')
+    parser.add_option("--setup", dest="setup_module", default=None,
+                      help='Module to import before using any implementation, e.g. to populate the dict '
+                            + 'implementation or to point the SQLite implementation at a file.')
+
+    (options, impls) = parser.parse_args(argv[1:])
+    if len(impls) == 0:
+        parser.error('No database implementation modules given')
+
+    names, decays = collect_lookups(options.gp_files)
+    if options.names:
+        names = sorted( set(names) | set(options.names.split(',')) )
+    if len(names) == 0:
+        parser.error('Nothing to look up: give -g or --names')
+
+    if options.setup_module:
+        __import__(options.setup_module)
+
+    print '%-28s %12s %14s %14s %8s' % ('implementation', 'cold start', 'per type', 'per decay', 'misses')
+    for impl in impls:
+        cold = time_cold_start(impl, names[0], options.setup_module)
+        per_type, per_mode, misses = time_lookups(impl, names, decays, options.n_lookups)
+        per_mode = ('%11.2f us' % (per_mode * 1e6), '%14s' % '-')[per_mode is None]
+        print '%-28s %10.1f ms %11.2f us %s %8d' % (impl, cold * 1e3, per_type * 1e6, per_mode, misses)
+
+if __name__ == '__main__':
+    main(sys.argv)
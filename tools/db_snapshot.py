@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+''' Exports a pydecay.db implementation to a snapshot file for pydecay.db.snapshot_impl, or describes
+    an existing snapshot. For example, to export the configured SQLite database and check the result:
+
+    > python db_snapshot.py -i pydecay.db.sqlite_impl -o particles.snapshot
+    > python db_snapshot.py --info particles.snapshot
+'''
+
+import sys
+import time
+from optparse import OptionParser
+
+from pydecay import settings
+from pydecay.db import snapshot_impl
+
+def source_path_for(impl):
+    ''' @return: the file holding the database of the given implementation module, if it has one. '''
+    if impl == 'pydecay.db.sqlite_impl':
+        return settings.SQLITE_DB_NAME
+    elif impl == 'pydecay.db.django_impl' and settings.DB_ENGINE.endswith('sqlite3'):
+        return settings.DB_NAME
+    return None
+
+def describe(metadata):
+    created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metadata['created']))
+    lines = ['created:     %s' % created,
+             'source:      %s' % metadata['source'],
+             'source file: %s' % metadata['source_path'],
+             'contents:    %d particle types, %d decay modes' % (metadata['n_types'], metadata['n_modes']),
+             'digest:      %s' % metadata['digest']]
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option("-o", "--out", dest="outfile_name", default=None,
+                      help='Name of the snapshot file to write.')
+    parser.add_option("-i", "--impl", dest="impl", default=None,
+                      help='Module of the database implementation to export. Defaults to pydecay.settings.DATABASE_IMPL.')
+    parser.add_option("--setup", dest="setup_module", default=None,
+                      help='Module to import before exporting, e.g. one that populates the dict implementation.')
+    parser.add_option("--info", dest="info_file", default=None,
+                      help='Describe an existing snapshot file instead of writing one.')
+    parser.add_option("--max-age", dest="max_age", type="float", default=None,
+                      help='With --info, the age in seconds beyond which the snapshot is reported stale.')
+
+    (options, args) = parser.parse_args(argv[1:])
+
+    if options.info_file:
+        snapshot_impl.load(options.info_file)
+        print describe(snapshot_impl.get_metadata())
+        print 'stale:       %s' % snapshot_impl.is_stale(options.max_age)
+        return
+
+    if options.outfile_name is None:
+        parser.error('Either --out or --info is required')
+
+    if options.setup_module:
+        __import__(options.setup_module)
+
+    impl = options.impl or settings.DATABASE_IMPL
+    if not isinstance(impl, str):
+        impl = impl[0].__module__
+    module = __import__(impl, globals(), locals(), ['ParticleType', 'DecayMode'])
+
+    metadata = snapshot_impl.export_snapshot(options.outfile_name, module.ParticleType, module.DecayMode,
+                                             source_path_for(impl))
+    print describe(metadata)
+
+if __name__ == '__main__':
+    main(sys.argv)
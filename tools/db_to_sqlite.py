@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+''' Copies the particle types and decay modes of a pydecay.db implementation into a database file for
+    pydecay.db.sqlite_impl, creating the file if necessary. For example, to fill a file from the
+    Django database configured in pydecay.settings and then use it:
+
+    > python db_to_sqlite.py -i pydecay.db.django_impl -o particles.sqlite
+    > export PYDECAY_SQLITE_DB=particles.sqlite
+'''
+
+import sys
+from optparse import OptionParser
+
+from pydecay import settings
+from pydecay.db import sqlite_impl
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option("-o", "--out", dest="outfile_name", default=None,
+                      help='SQLite file to fill. Defaults to pydecay.settings.SQLITE_DB_NAME.')
+    parser.add_option("-i", "--impl", dest="impl", default=None,
+                      help='Module of the database implementation to copy. Defaults to pydecay.settings.DATABASE_IMPL.')
+    parser.add_option("--setup", dest="setup_module", default=None,
+                      help='Module to import before copying, e.g. one that populates the dict implementation.')
+
+    (options, args) = parser.parse_args(argv[1:])
+
+    if options.setup_module:
+        __import__(options.setup_module)
+
+    impl = options.impl or settings.DATABASE_IMPL
+    if not isinstance(impl, str):
+        impl = impl[0].__module__
+    if impl == 'pydecay.db.sqlite_impl':
+        parser.error('Copy from another implementation than the SQLite one')
+    module = __import__(impl, globals(), locals(), ['ParticleType', 'DecayMode'])
+
+    connection = sqlite_impl.connect(options.outfile_name, read_only=False)
+    n_types, n_modes = sqlite_impl.import_types(module.ParticleType, module.DecayMode, connection)
+    print 'added %d particle types and %d decay modes from %s' % (n_types, n_modes, impl)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,36 +1,256 @@
 #!/usr/bin/env python
 
+''' Checks that every decay in GraphPhys files is kinematically possible: that the masses of the
+    products of each decay add up to no more than the mass of the particle decaying. Any number of
+    files can be checked at once, and directories are searched for .gp files; for example
+
+    > python kinematics_check.py -j 4 -o report.json nightly/ extra.gp
+
+    The files are parsed by a pool of worker processes. Masses given as a 'mass' parameter are used
+    as they are; the others are looked up in the particle database once per particle type for the
+    whole run, whichever implementation is used (-i), and the decays of all the files are then
+    checked together. The report written with -o is JSON: for each file, its status ('ok',
+    'impossible', 'unresolved' or 'error'), the impossible decays it has and those that couldn't
+    be checked because some particle's mass is unknown; and the particle types with unknown masses.
+    The exit status is 1 if any file is not 'ok'.
+'''
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import numpy as np
+
 from pydecay import *
 from pydecay import graphphys
+from pydecay import db
+
+def find_gp_files(paths):
+    ''' @return: the paths that are files, and the .gp files in and below those that are directories. '''
+    gp_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            gp_files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            subdirectories.sort()
+            gp_files += [ os.path.join(directory, name) for name in sorted(names) if name.endswith('.gp') ]
+    return gp_files
+
+def read_tree(path):
+    ''' Parses a GraphPhys file into the tables the check works on, without touching the database.
+        @return: a dictionary holding the file's 'path'; the 'types' of its particles, and their
+                 'masses' where given by a parameter (NaN where not), as an array; and its decays,
+                 as arrays of the 'parents' of the decays, of all their 'products' one decay after
+                 another, and of the decay each product belongs to ('product_decays'), all numbered
+                 from 0 within the file. If the file can't be read, it holds the 'error' instead.
+    '''
+    types = []
+    masses = []
+    parents = []
+    products = []
+    product_decays = []
+    def add_particle(particle):
+        number = len(types)
+        types.append(particle.type)
+        masses.append( float(particle.params.get('mass', np.nan)) )
+        for decay in particle.decays:
+            decay_number = len(parents)
+            parents.append(number)
+            # The products' slots are taken before their own decays add any
+            slots = range(len(products), len(products) + len(decay.products))
+            product_decays.extend([decay_number] * len(slots))
+            products.extend([None] * len(slots))
+            for slot, product in zip(slots, decay.products):
+                products[slot] = add_particle(product)
+        return number
+
+    try:
+        for root in graphphys.get_parser().parseFile(path).root_particles:
+            add_particle(root)
+    except Exception, e:
+        return {'path': path, 'error': '%s: %s' % (e.__class__.__name__, e)}
+    return {'path': path, 'error': None, 'types': types, 'masses': np.array(masses, dtype=float),
+            'parents': np.array(parents, dtype=int), 'products': np.array(products, dtype=int),
+            'product_decays': np.array(product_decays, dtype=int)}
+
+class MassCache(object):
+    ''' The masses of particle types, each looked up in a database implementation only once.
+        Types the database doesn't have, or has no mass for, are listed in 'missing'.
+    '''
+    def __init__(self, particle_type_impl):
+        self.particle_type_impl = particle_type_impl
+        self.masses = {}
+        self.missing = set()
+
+    def resolve(self, type_names):
+        ''' Looks up the types not seen before, all in one go if the database has them all. '''
+        new_names = sorted( set(type_names) - set(self.masses.keys()) - self.missing )
+        if not new_names:
+            return
+        try:
+            ptypes = zip(new_names, self.particle_type_impl.get_types_for_names(new_names))
+        except db.DoesNotExist:
+            ptypes = []
+            for name in new_names:
+                try:
+                    ptypes.append( (name, self.particle_type_impl.get_type_for_name(name)) )
+                except db.DoesNotExist:
+                    self.missing.add(name)
+        for name, ptype in ptypes:
+            try:
+                self.masses[name] = float(ptype.mass)
+            except (AttributeError, TypeError, ValueError):
+                self.missing.add(name)
+
+    def get_masses(self, type_names):
+        ''' @return: an array of the masses of types that have been resolved, NaN where unknown. '''
+        return np.array([ self.masses.get(name, np.nan) for name in type_names ], dtype=float)
+
+def check_trees(trees, cache):
+    ''' Checks the decays of the trees returned by read_tree (except those with an error), all at once.
+        Adds to each tree the lists 'impossible' and 'unresolved', of its impossible decays and of
+        those with a particle of unknown mass, by number.
+    '''
+    trees = [ tree for tree in trees if tree['error'] is None ]
+    for tree in trees:
+        tree['impossible'] = []
+        tree['unresolved'] = []
+    if not trees:
+        return
 
-def find_bad_decays(particle):
-    bad_decays = []
-    for decay in particle.decays:
-        # Make sure this isn't a generic decay before checking masses
-        if len(decay.products) > 0 and sum([float(p.mass) for p in decay.products]) > float(particle.mass):
-            bad_decays.append(decay)
-        for p in decay.products:
-            bad_decays += find_bad_decays(p)
-            
-    return bad_decays
+    # Lay every tree's particles and decays end to end
+    n_particles = np.array([ len(tree['types']) for tree in trees ])
+    n_decays = np.array([ len(tree['parents']) for tree in trees ])
+    particle_offsets = np.cumsum(n_particles) - n_particles
+    decay_offsets = np.cumsum(n_decays) - n_decays
+    types = np.array([ name for tree in trees for name in tree['types'] ], dtype=object)
+    masses = np.concatenate([ tree['masses'] for tree in trees ])
+    parents = np.concatenate([ tree['parents'] + offset for tree, offset in zip(trees, particle_offsets) ])
+    products = np.concatenate([ tree['products'] + offset for tree, offset in zip(trees, particle_offsets) ])
+    product_decays = np.concatenate([ tree['product_decays'] + offset for tree, offset in zip(trees, decay_offsets) ])
+    if len(parents) == 0:
+        return
+
+    # Masses not given as parameters come from the database, once per type
+    unknown = np.isnan(masses)
+    names, inverse = np.unique(types[unknown].astype(str), return_inverse=True)
+    cache.resolve(names)
+    masses[unknown] = cache.get_masses(names)[inverse]
+
+    n_products = np.bincount(product_decays, minlength=len(parents))
+    sums = np.bincount(product_decays, masses[products], minlength=len(parents))
+    # A decay can't be checked if any of its particles' masses is unknown
+    unknown = np.isnan(sums) | np.isnan(masses[parents])
+
+    # Generic decays (with no products) aren't checked
+    checked = n_products > 0
+    with np.errstate(invalid='ignore'):
+        impossible = checked & ~unknown & (sums > masses[parents])
+    unresolved = checked & unknown
+
+    decay_trees = np.repeat(np.arange(len(trees)), n_decays)
+    for decay in np.flatnonzero(impossible | unresolved):
+        tree = trees[decay_trees[decay]]
+        tree[('unresolved', 'impossible')[bool(impossible[decay])]].append( decay - decay_offsets[decay_trees[decay]] )
+
+def describe_decay(tree, decay):
+    products = tree['products'][tree['product_decays'] == decay]
+    return ' '.join([ '%s ->' % tree['types'][tree['parents'][decay]] ] + [ tree['types'][product] for product in products ])
+
+def get_report(trees, cache):
+    ''' @return: the report of the check, as a dictionary that can be saved as JSON. '''
+    files = []
+    for tree in trees:
+        entry = {'path': tree['path']}
+        if tree['error'] is not None:
+            entry.update({'status': 'error', 'error': tree['error']})
+        else:
+            status = 'ok'
+            if tree['unresolved']:
+                status = 'unresolved'
+            if tree['impossible']:
+                status = 'impossible'
+            entry.update({'status': status, 'n_decays': len(tree['parents']),
+                          'impossible': [ describe_decay(tree, decay) for decay in tree['impossible'] ],
+                          'unresolved': [ describe_decay(tree, decay) for decay in tree['unresolved'] ]})
+        files.append(entry)
+    return {'files': files, 'missing_types': sorted(cache.missing)}
+
+def print_report(report, outfile=sys.stdout):
+    single = len(report['files']) == 1
+    for entry in report['files']:
+        # With a single file, the messages have no file name in front
+        prefix = ('%s: ' % entry['path'], '')[single]
+        if entry['status'] == 'error':
+            print >> outfile, '%sCould not be read: %s' % (prefix, entry['error'])
+            continue
+        if entry['status'] == 'ok' and single:
+            print >> outfile, 'All decays specified are kinematically possible.'
+        for decay in entry['impossible']:
+            print >> outfile, '%sImpossible decay specified: %s' % (prefix, decay)
+        for decay in entry['unresolved']:
+            print >> outfile, '%sUnknown mass in decay: %s' % (prefix, decay)
+    if report['missing_types']:
+        print >> outfile, 'Particle types with unknown masses: %s' % ', '.join(report['missing_types'])
+    if not single:
+        counts = {}
+        for entry in report['files']:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        print >> outfile, '%d files checked: %s' % (len(report['files']),
+                                                     ', '.join(['%d %s' % (counts[status], status)
+                                                                for status in sorted(counts.keys())]))
 
 def main(argv):
-    infile_name = argv[1]
-    g = graphphys.get_parser().parseFile(infile_name)
-
-    bad_decays = []    
-    for root in g.root_particles:
-        bad_decays += find_bad_decays(root)
-        
-    if len(bad_decays) == 0:
-        print 'All decays specified are kinematically possible.'
+    parser = OptionParser(usage='%prog [options] file_or_directory [...]')
+    parser.add_option("-j", "--workers", dest="n_workers", type="int", default=1,
+                      help='Number of processes to parse the files in. Defaults to 1.')
+    parser.add_option("-o", "--output", dest="outfile_name", default=None,
+                      help='Write a JSON report to this file.')
+    parser.add_option("-i", "--impl", dest="impl", default=None,
+                      help='Module of the database implementation to look masses up in. '
+                           'Defaults to pydecay.settings.DATABASE_IMPL.')
+    parser.add_option("--setup", dest="setup_module", default=None,
+                      help='Module to import before looking anything up, e.g. one that populates the dict '
+                           'implementation or points the SQLite implementation at a file.')
+
+    (options, paths) = parser.parse_args(argv[1:])
+    if len(paths) == 0:
+        parser.error('No GraphPhys files given')
+    if options.setup_module:
+        __import__(options.setup_module)
+    particle_type_impl = db.PARTICLE_TYPE_IMPL
+    if options.impl:
+        particle_type_impl = __import__(options.impl, globals(), locals(), ['ParticleType']).ParticleType
+
+    start = time.time()
+    gp_files = find_gp_files(paths)
+    if options.n_workers > 1:
+        pool = multiprocessing.Pool(options.n_workers)
+        try:
+            trees = pool.map(read_tree, gp_files, chunksize=max(1, len(gp_files) // (4 * options.n_workers)))
+        finally:
+            pool.terminate()
     else:
-        for decay in bad_decays:
-            message = 'Impossible decay specified: %s ->' % decay.parent.type
-            for p in decay.products:
-                message = ' '.join([message, p.type])
-            print message
+        trees = map(read_tree, gp_files)
+
+    cache = MassCache(particle_type_impl)
+    check_trees(trees, cache)
+    report = get_report(trees, cache)
+    report['seconds'] = time.time() - start
+
+    print_report(report)
+    if options.outfile_name:
+        outfile = open(options.outfile_name, 'w')
+        try:
+            json.dump(report, outfile, indent=1, sort_keys=True)
+        finally:
+            outfile.close()
+
+    return int( [entry for entry in report['files'] if entry['status'] != 'ok'] != [] )
 
 if __name__ == '__main__':
-    import sys
-    main(sys.argv)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+#
+# Benchmarks the simulator on synthetic decay trees and the GraphPhys examples,
+# and writes the results as JSON, so that runs on different commits can be
+# compared:
+#
+#     benchmark.py -o before.json
+#     (check out another commit)
+#     benchmark.py -o after.json --compare before.json
+#
+# A synthetic tree is given by its depth, fan-out (products per decay) and
+# number of alternative decays of each particle, e.g. --tree 3,2,2; its
+# intermediate particles have the lineshape given by --lineshape. The examples
+# need the particle database pydecay is set up with to know their particles'
+# masses (see --setup); cases that can't be built, or whose process dies or
+# runs past --timeout, are recorded with their error.
+#
+# For each case it measures, in a process of its own:
+#   compile:       building the Simulation (compiling and checking the plan)
+#   choose_decays: choosing the decay channels (DecayPlan.choose_decays)
+#   lineshapes:    sampling masses (generator.get_masses)
+#   phase_space:   generating decays (phase_space.generate)
+#   cuts:          evaluating generation-time cuts (generator.apply_cuts)
+#   other:         the rest of the generation
+#   output:        writing the events to an event file (event_io.EventWriter)
+# in seconds, the events generated per second (excluding compile and output),
+# and the peak memory of the process and its growth during the case, in MB.
+# Events are generated in one process, as with -j 1.
+#
+
+################################################################################
+# Import the needed modules
+################################################################################
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from pydecay import Particle, graphphys
+from generator import DEFAULT_SEED, Simulation
+import generator
+import phase_space
+import decay_plan
+import event_io
+
+# Format of the results file
+RESULTS_VERSION = 1
+
+# Trees benchmarked when none are given: depth, fan-out, alternatives
+DEFAULT_TREES = [ (2, 2, 2), (3, 2, 2), (5, 2, 1), (2, 4, 2), (2, 2, 4) ]
+
+EXAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'examples')
+
+STAGES = ('compile', 'choose_decays', 'lineshapes', 'phase_space', 'cuts', 'other', 'output')
+
+
+################################################################################
+# Synthetic decay trees
+################################################################################
+
+class SyntheticType(object):
+    def __init__(self, mass, width):
+        self.mass = mass
+        self.width = width
+
+class SyntheticParticle(Particle):
+    ''' A particle whose type isn't in the database: it carries its own mass and width. '''
+    def __init__(self, type, mass, width, **params):
+        super(SyntheticParticle, self).__init__(type, mass=mass, **params)
+        object.__setattr__(self, 'db_type', SyntheticType(mass, width))
+
+    def get_db_type(self):
+        return self.db_type
+
+def make_tree(depth, fanout, alternatives, lineshape='BW'):
+    ''' @return: the root of a decay tree depth levels deep, in which every particle above the
+                 final state has the given number of alternative decays, each to fanout products.
+                 Final-state particles are pions; each level above is 1.5 times as heavy as its
+                 products, with a width of 5% of its mass and the given lineshape (none if None).
+                 The decays of each particle have probabilities in the ratio 1:2:3...
+    '''
+    masses = [0.1396]
+    for level in range(depth):
+        masses.append( 1.5 * fanout * masses[-1] )
+
+    def make_particle(level):
+        if level == 0:
+            return SyntheticParticle('pi+', masses[0], 0.0)
+        params = {}
+        if lineshape and level < depth:
+            params['lineshape'] = lineshape
+        particle = SyntheticParticle('X%d' % level, masses[level], 0.05 * masses[level], **params)
+        for alternative in range(alternatives):
+            products = [ make_particle(level - 1) for i in range(fanout) ]
+            particle.add_decay(products, prob=str(alternative + 1))
+        return particle
+
+    return make_particle(depth)
+
+
+################################################################################
+# Timing the stages of the generator
+################################################################################
+
+class StageTimer(object):
+    ''' Times the stages of the generator by wrapping the functions that carry them out, for as
+        long as it is installed.
+    '''
+    def __init__(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.originals = []
+
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.times[stage] += time.time() - start
+        return timed
+
+    def patch(self, owner, name, stage):
+        original = owner.__dict__[name]
+        self.originals.append( (owner, name, original) )
+        setattr(owner, name, self.wrap(stage, original))
+
+    def install(self):
+        self.patch(decay_plan.DecayPlan, 'choose_decays', 'choose_decays')
+        self.patch(generator, 'get_masses', 'lineshapes')
+        self.patch(phase_space, 'generate', 'phase_space')
+        self.patch(generator, 'apply_cuts', 'cuts')
+
+    def uninstall(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+
+################################################################################
+# Running the cases
+################################################################################
+
+def get_rss():
+    # The resident memory of this process, in MB
+    statm = open('/proc/self/statm')
+    try:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 1e6
+    finally:
+        statm.close()
+
+def run_case(get_source, n_events, write_output):
+    ''' Runs one case in this process.
+        @param get_source: a function returning the decay tree to simulate
+        @return: the case's results (see the module comment).
+    '''
+    start_rss = get_rss()
+    times = dict.fromkeys(STAGES, 0.0)
+
+    start = time.time()
+    simulation = Simulation(get_source(), DEFAULT_SEED)
+    times['compile'] = time.time() - start
+
+    directory = tempfile.mkdtemp()
+    writer = None
+    if write_output:
+        writer = event_io.EventWriter(os.path.join(directory, 'events.ev'), simulation.plan)
+    timer = StageTimer()
+    timer.install()
+    try:
+        generating = 0.0
+        start = time.time()
+        for batch in simulation.generate_chunks(n_events):
+            generating += time.time() - start
+            if writer:
+                start = time.time()
+                writer.write_batch(batch)
+                times['output'] += time.time() - start
+            start = time.time()
+        if writer:
+            start = time.time()
+            writer.close()
+            times['output'] += time.time() - start
+    finally:
+        timer.uninstall()
+        shutil.rmtree(directory)
+
+    for stage in ('choose_decays', 'lineshapes', 'phase_space', 'cuts'):
+        times[stage] = timer.times[stage]
+    times['other'] = max(generating - sum([timer.times[stage] for stage in timer.times]), 0.0)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3 # kB on Linux
+
+    return {
+        'n_nodes': simulation.plan.n_nodes,
+        'n_decays': simulation.plan.n_decay_modes,
+        'n_tried': simulation.n_tried,
+        'n_forbidden': simulation.n_forbidden,
+        'seconds': times,
+        'events_per_second': n_events / max(generating, 1e-9),
+        'peak_rss_mb': peak_rss,
+        'rss_growth_mb': peak_rss - start_rss,
+        'status': 'ok',
+    }
+
+def run_case_in_process(get_source, n_events, write_output, timeout=None):
+    ''' Runs one case in a process of its own, so that its memory use is its own.
+        @param timeout: seconds after which the process is killed, if given.
+        @return: the case's results, or just its status if it failed, if the process died without
+                 giving a result, or if it ran out of time.
+    '''
+    queue = multiprocessing.Queue()
+    def target():
+        try:
+            queue.put( run_case(get_source, n_events, write_output) )
+        except Exception, e:
+            queue.put( {'status': 'error: %s: %s' % (e.__class__.__name__, e)} )
+    process = multiprocessing.Process(target=target)
+    process.start()
+    start = time.time()
+
+    result = None
+    timed_out = False
+    while result is None and process.is_alive():
+        if timeout is not None and time.time() - start > timeout:
+            process.terminate()
+            timed_out = True
+            break
+        try:
+            result = queue.get(timeout=1.0)
+        except Queue.Empty:
+            pass
+    if result is None and not timed_out:
+        # The result may have been put just before the process exited
+        try:
+            result = queue.get(timeout=1.0)
+        except Queue.Empty:
+            pass
+    process.join()
+
+    if result is None:
+        if timed_out:
+            return {'status': 'error: timed out after %g s' % timeout}
+        return {'status': 'error: process exited with code %s' % process.exitcode}
+    return result
+
+def run_best(get_source, n_events, write_output, repeat, timeout=None):
+    # The fastest of several runs of a case
+    results = [ run_case_in_process(get_source, n_events, write_output, timeout) for i in range(repeat) ]
+    if results[0]['status'] != 'ok':
+        return results[0]
+    return max(results, key=lambda result: result['events_per_second'])
+
+def get_label():
+    # The commit being benchmarked, if this is a git checkout
+    try:
+        process = subprocess.Popen(['git', 'describe', '--always', '--dirty'], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        output = process.communicate()[0]
+    except OSError:
+        return ''
+    return output.strip()
+
+
+################################################################################
+# Reporting
+################################################################################
+
+def print_results(results, previous=None, outfile=sys.stdout):
+    # One line per case; with previous results, the ratio of the events per
+    # second of each case to what it was
+    old_cases = {}
+    if previous:
+        old_cases = dict([ (case['name'], case) for case in previous['cases'] ])
+    print >> outfile, "%-28s %6s %12s %9s  %s" % ('case', 'nodes', 'events/s', 'peak MB',
+                                                  ' '.join(['%8s' % stage[:8] for stage in STAGES]))
+    for case in results['cases']:
+        if case['status'] != 'ok':
+            print >> outfile, "%-28s %s" % (case['name'], case['status'])
+            continue
+        line = "%-28s %6d %12.0f %9.1f  %s" % (case['name'], case['n_nodes'], case['events_per_second'],
+                                               case['peak_rss_mb'],
+                                               ' '.join(['%8.3f' % case['seconds'][stage] for stage in STAGES]))
+        old = old_cases.get(case['name'])
+        if old and old['status'] == 'ok':
+            line += "  x%.2f" % (case['events_per_second'] / old['events_per_second'])
+        print >> outfile, line
+
+
+################################################################################
+################################################################################
+if __name__ == '__main__':
+
+    ################################################################################
+    # Parse the command line options
+    ################################################################################
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option("-n", "--events", dest="n_events", type="int", default=100000,
+                      help='Number of events to generate in each case. Defaults to %default.')
+    parser.add_option("-t", "--tree", dest="trees", action="append", default=[],
+                      help='A synthetic tree to benchmark, given as depth,fanout,alternatives. May be given '
+                           'more than once. Defaults to %s.' % ' '.join(['%d,%d,%d' % tree for tree in DEFAULT_TREES]))
+    parser.add_option("--lineshape", dest="lineshape", default='BW',
+                      help='Lineshape of the intermediate particles of synthetic trees, or none. Defaults to %default.')
+    parser.add_option("--examples", dest="examples", default=EXAMPLES_DIRECTORY,
+                      help='Directory of GraphPhys files to benchmark as well; empty for none. '
+                           'Defaults to the examples directory.')
+    parser.add_option("--no-output", dest="write_output", action="store_false", default=True,
+                      help='Don\'t time writing the events to an event file.')
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=1,
+                      help='Run each case this many times and keep the fastest. Defaults to %default.')
+    parser.add_option("-o", "--output", dest="outfile_name", default=None,
+                      help='Write the results to this JSON file.')
+    parser.add_option("--compare", dest="compare", default=None,
+                      help='Compare the events per second with those of an earlier results file.')
+    parser.add_option("--label", dest="label", default=None,
+                      help='Label of the results. Defaults to the git commit.')
+    parser.add_option("--setup", dest="setup_module", default=None,
+                      help='Module to import before running the cases, e.g. one that points pydecay at a '
+                           'particle database with the masses of the examples\' particles.')
+    parser.add_option("--timeout", dest="timeout", type="float", default=None,
+                      help='Seconds after which a case is stopped and recorded as an error. By default, '
+                           'cases run until they finish.')
+
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error('No arguments are expected')
+    lineshape = options.lineshape
+    if lineshape.lower() == 'none':
+        lineshape = None
+    try:
+        trees = [ tuple([int(n) for n in tree.split(',')]) for tree in options.trees ] or DEFAULT_TREES
+    except ValueError:
+        parser.error('Trees are given as depth,fanout,alternatives')
+    if [ tree for tree in trees if len(tree) != 3 ]:
+        parser.error('Trees are given as depth,fanout,alternatives')
+    if options.setup_module:
+        __import__(options.setup_module)
+
+    ################################################################################
+    # Run the cases
+    ################################################################################
+    results = {
+        'version': RESULTS_VERSION,
+        'label': options.label if options.label is not None else get_label(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'n_events': options.n_events,
+        'lineshape': options.lineshape,
+        'cases': [],
+    }
+
+    cases = []
+    for depth, fanout, alternatives in trees:
+        def get_source(depth=depth, fanout=fanout, alternatives=alternatives):
+            return make_tree(depth, fanout, alternatives, lineshape)
+        cases.append( ('tree-%d-%d-%d' % (depth, fanout, alternatives), get_source) )
+    if options.examples:
+        for path in sorted(glob.glob(os.path.join(options.examples, '*.gp'))):
+            def get_source(path=path):
+                return graphphys.get_parser().parseFile(path)
+            cases.append( (os.path.basename(path), get_source) )
+
+    for name, get_source in cases:
+        result = run_best(get_source, options.n_events, options.write_output, options.repeat, options.timeout)
+        result['name'] = name
+        results['cases'].append(result)
+        print >> sys.stderr, "%s: %s" % (name, result['status'])
+
+    ################################################################################
+    # Write out the results
+    ################################################################################
+    previous = None
+    if options.compare:
+        infile = open(options.compare)
+        try:
+            previous = json.load(infile)
+        finally:
+            infile.close()
+    print_results(results, previous)
+
+    if options.outfile_name:
+        outfile = open(options.outfile_name, 'w')
+        try:
+            json.dump(results, outfile, indent=1, sort_keys=True)
+        finally:
+            outfile.close()
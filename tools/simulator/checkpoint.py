@@ -0,0 +1,106 @@
+################################################################################
+# Checkpoints of simulation runs
+#
+# While mc_simulator.py writes an event file, it keeps a checkpoint beside it
+# (the file's name plus CHECKPOINT_SUFFIX): a small JSON file recording how
+# far the run has got, replaced after a chunk once CHECKPOINT_INTERVAL seconds
+# have passed since the last one. If the run is stopped, the same command with
+# --resume carries on from the checkpoint, and the file it ends up with is the
+# same, byte for byte, as an uninterrupted run's.
+#
+# The generator draws its random numbers from one stream per chunk, seeded
+# with [seed, chunk] (see generator.get_chunk_rng), so the state of the
+# random number generator at a checkpoint is just the seed of the next
+# chunk's stream.
+#
+# Checkpoints guard against the run's process being stopped or killed: the
+# event file is flushed to the operating system, not synced to disk, before
+# each checkpoint, since syncing costs as much as the writing itself. If the
+# whole machine goes down, the file may turn out shorter than its checkpoint
+# says, which --resume reports rather than trusting it.
+#
+# A checkpoint holds:
+#   plan_digest:    DecayPlan.get_digest() of the plan being generated
+#   seed, n_events, chunk_size, compression, dtype, histograms: the settings
+#                   of the run, which must be the same to resume it
+#   rng:            the seed of the next chunk's random number stream
+#   chunks_written, events_written: how much of the run is in the file
+#   offset:         the end of the last chunk written, in the event file
+#   n_tried, n_forbidden, cut_counts, sum_weights: the generation statistics so far (see
+#                   generator.Simulation)
+#   histogram_state: the contents of the run's histograms (see histograms.py)
+#
+################################################################################
+
+import json
+import os
+
+import numpy as np
+
+CHECKPOINT_SUFFIX = '.ckpt'
+
+# Default number of seconds between checkpoints
+CHECKPOINT_INTERVAL = 60.0
+
+def get_settings(simulation, n_events, chunk_size, compression, dtype, histogram_set):
+    ''' @return: the settings of a run that a checkpoint is only valid for. '''
+    return {
+        'histograms': histogram_set.get_definitions(),
+        'plan_digest': simulation.plan.get_digest(),
+        'seed': simulation.seed,
+        'n_events': n_events,
+        'chunk_size': chunk_size,
+        'compression': compression,
+        'dtype': np.dtype(dtype).str,
+    }
+
+def get_state(settings, simulation, writer, chunks_written, histogram_set):
+    ''' @return: the checkpoint of a run whose first chunks_written chunks have been written. Flushes
+                 the event file first, so the checkpoint never runs ahead of the file.
+    '''
+    state = dict(settings)
+    state.update({
+        'rng': [simulation.seed, chunks_written],
+        'chunks_written': chunks_written,
+        'events_written': writer.n_events,
+        'offset': writer.flush(),
+        'n_tried': simulation.n_tried,
+        'n_forbidden': simulation.n_forbidden,
+        'cut_counts': simulation.cut_counts.tolist(),
+        'sum_weights': simulation.sum_weights,
+        'histogram_state': histogram_set.get_state(),
+    })
+    return state
+
+def write_checkpoint(path, state):
+    ''' Saves the checkpoint of the event file at path. '''
+    # Written to a temporary file that then replaces the old checkpoint, so
+    # there is always one complete checkpoint
+    temp_path = path + CHECKPOINT_SUFFIX + '.tmp'
+    outfile = open(temp_path, 'w')
+    try:
+        json.dump(state, outfile)
+    finally:
+        outfile.close()
+    os.rename(temp_path, path + CHECKPOINT_SUFFIX)
+
+def read_checkpoint(path, settings):
+    ''' @return: the checkpoint of the event file at path.
+        @raise ValueError: if there is no checkpoint, or it was made with different settings.
+    '''
+    if not os.path.exists(path + CHECKPOINT_SUFFIX):
+        raise ValueError('%s has no checkpoint to resume from' % path)
+    infile = open(path + CHECKPOINT_SUFFIX)
+    try:
+        state = json.load(infile)
+    finally:
+        infile.close()
+
+    for name, value in sorted(settings.items()):
+        if state.get(name) != value:
+            raise ValueError('Cannot resume %s: its %s was %s, not %s' % (path, name, state.get(name), value))
+    return state
+
+def remove_checkpoint(path):
+    if os.path.exists(path + CHECKPOINT_SUFFIX):
+        os.remove(path + CHECKPOINT_SUFFIX)
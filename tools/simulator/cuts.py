@@ -0,0 +1,150 @@
+################################################################################
+# Generation-time cuts
+#
+# Cuts are declared with a 'cuts' parameter, in the same form as the
+# preFitSelectors of a reconstruction: a list of variables, each with a range
+# low:high, either end of which may be left out. On a particle,
+#
+#     Kst [type=K*(892)0, lineshape=BW, cuts=[Mass=0.8:1.0, P=:2.5]];
+#
+# the cuts apply to the particle's four-vector in every event it appears in,
+# and are evaluated as soon as its parent has decayed, before the particle
+# decays itself. On a decay,
+#
+#     D -> {Km pip1 pip2} [prob=0.3, cuts=[Pt=0.5:]];
+#
+# they apply to the decaying particle, only in the events in which it undergoes
+# that decay, and are evaluated before its products are generated. Events that
+# fail a cut are rejected on the spot, and none of the rest of the event is
+# generated.
+#
+# The variables are the quantities of fourvectors.py, in the lab frame:
+# Mass, P, Pt, E and CosTheta.
+#
+# A range can also be oversampled rather than cut on, to generate more events
+# in a rare corner of phase space: with
+#
+#     Kst [type=K*(892)0, lineshape=BW, oversample=[Mass=1.3:1.5, factor=20]];
+#
+# events in which the particle falls outside the range are kept only with
+# probability 1/20, and given 20 times the weight, instead of all being
+# rejected. The weighted events describe the same distributions as
+# unweighted ones, with 20 times more events in the range for the same
+# number generated.
+#
+################################################################################
+
+import numpy as np
+
+import fourvectors
+
+def energy(p):
+
+    return p[..., fourvectors.E]
+
+# Functions computing each variable from an array of four-vectors, by
+# lower-case name
+cut_variables = {
+    'mass'     : fourvectors.mass,
+    'p'        : fourvectors.momentum,
+    'pt'       : fourvectors.pt,
+    'e'        : energy,
+    'costheta' : fourvectors.cos_theta,
+}
+
+class Cut(object):
+    ''' A range on one variable of a particle's four-vector. Either end of the range may be
+        None, for no limit. 'label' describes the cut in efficiency reports. If 'prescale' is
+        given, the range is oversampled: events outside it are kept with probability 1/prescale
+        and their weight multiplied by prescale, rather than rejected.
+    '''
+    def __init__(self, variable, low, high, label, prescale=None):
+        self.variable = variable
+        self.low = low
+        self.high = high
+        self.label = label
+        self.prescale = prescale
+
+    def passes(self, vectors):
+        ''' @param vectors: an array of four-vectors, of shape (n_events, 4)
+            @return: a boolean array of shape (n_events,), true for the events that pass.
+        '''
+        values = cut_variables[self.variable.lower()](vectors)
+        passed = np.isfinite(values)
+        with np.errstate(invalid='ignore'):
+            if self.low is not None:
+                passed &= values >= self.low
+            if self.high is not None:
+                passed &= values <= self.high
+        return passed
+
+    def __str__(self):
+        limits = [ '%g' % limit for limit in (self.low, self.high) if limit is not None ]
+        if self.low is None:
+            limits.insert(0, '')
+        if self.high is None:
+            limits.append('')
+        text = '%s %s=%s' % (self.label, self.variable, ':'.join(limits))
+        if self.prescale is not None:
+            text += ' (oversampled x%g)' % self.prescale
+        return text
+
+def parse_range(value):
+    ''' @param value: a range of the form 'low:high', ':high' or 'low:'
+        @return: (low, high), where a missing end is None.
+        @raise ValueError: if value is not a range.
+    '''
+    if not isinstance(value, basestring) or value.count(':') != 1:
+        raise ValueError('Invalid cut range %r; expected low:high' % (value,))
+    def parse_limit(limit):
+        if limit.strip() == '':
+            return None
+        return float(limit)
+    low, high = [ parse_limit(limit) for limit in value.split(':') ]
+    if low is not None and high is not None and low > high:
+        raise ValueError('Invalid cut range %s: the lower end is above the upper end' % value)
+    return low, high
+
+def parse_cuts(params, label):
+    ''' @param params: the parameters of a particle or decay
+        @param label: what the cuts apply to, for reports
+        @return: a list of the Cuts declared by the 'cuts' parameter, if there is one.
+        @raise ValueError: if a cut has an unknown variable or an invalid range.
+    '''
+    if not params.has_key('cuts'):
+        return []
+    if not isinstance(params['cuts'], dict):
+        raise ValueError('Invalid cuts for %s; expected a list like [Mass=low:high]' % label)
+
+    cuts = []
+    for variable, value in sorted(params['cuts'].items()):
+        if not cut_variables.has_key(variable.lower()):
+            raise ValueError('Unknown cut variable %s for %s; known variables are %s' %
+                             (variable, label, ', '.join(sorted(cut_variables.keys()))))
+        low, high = parse_range(value)
+        cuts.append( Cut(variable, low, high, label) )
+    return cuts
+
+def parse_oversample(params, label):
+    ''' @param params: the parameters of a particle
+        @param label: what the range applies to, for reports
+        @return: a list holding the Cut of the range declared by the 'oversample' parameter, with
+                 its factor as the prescale, or an empty list if there is none.
+        @raise ValueError: if the parameter doesn't give exactly one variable with a valid range,
+                           and a factor of at least 1.
+    '''
+    if not params.has_key('oversample'):
+        return []
+    ranges = params['oversample']
+    if not isinstance(ranges, dict) or not ranges.has_key('factor') or len(ranges) != 2:
+        raise ValueError('Invalid oversampling for %s; expected [Mass=low:high, factor=f]' % label)
+
+    factor = float(ranges['factor'])
+    if not factor >= 1:
+        raise ValueError('Invalid oversampling factor %s for %s; it must be at least 1' % (factor, label))
+    variable = [ name for name in ranges.keys() if name != 'factor' ][0]
+    if not cut_variables.has_key(variable.lower()):
+        raise ValueError('Unknown oversampling variable %s for %s; known variables are %s' %
+                         (variable, label, ', '.join(sorted(cut_variables.keys()))))
+    low, high = parse_range(ranges[variable])
+    return [ Cut(variable, low, high, label, factor) ]
@@ -0,0 +1,638 @@
+################################################################################
+# Compiled decay plans
+#
+# A DecayPlan is a GraphPhys decay tree flattened into arrays, so that the
+# simulator can generate events from it without touching Particle objects,
+# params dictionaries or the database again. Compiling a plan does all of
+# that once, up front.
+#
+# Every particle in the tree is a node and every decay is a decay, each
+# numbered from 0. Nodes are numbered in depth-first order (the root is node
+# 0, and each product's subtree comes before the next product's), so a node's
+# parent always has a lower number than the node, and the final-state
+# particles of an event come in the same order as a depth-first walk of the
+# tree would visit them.
+#
+# A plan can have several roots, for a ProcessGroup holding several decay
+# trees: each event then starts from one of the roots, chosen with the
+# relative rates given by the roots' 'rate' parameters (1 by default), e.g.
+#
+#     B0 [rate=2];
+#     Bp [rate=1];
+#
+# The roots' trees share one set of nodes: a subtree that appears under
+# several roots, identical down to its parameters, is compiled only once,
+# and is then a product of one decay of each of those roots' trees. Since
+# any event holds only one root's tree, no two of those decays ever happen
+# in the same event. The nodes are numbered so that parents still come
+# before their products; with a single root this is the depth-first order.
+#
+# Decays are chosen with Walker's alias method (as built by Vose's
+# algorithm), which picks one of a node's decays in constant time however
+# many it has. The probability of each decay is set by decay_probabilities().
+#
+# A decay can be oversampled, to generate more events of a rare channel, with
+# an 'oversample' parameter:
+#
+#     D -> {Km pip1 pip2} [prob=0.001, oversample=100];
+#
+# The decay is then chosen 100 times more often relative to its parent's other
+# decays than its probability says, and the events in which it is chosen are
+# given correspondingly less weight, and the others more (see
+# sampling_probabilities), so that weighted sums over the events are the same
+# as for unweighted events.
+#
+################################################################################
+
+import hashlib
+from warnings import warn
+
+import numpy as np
+
+from pydecay import Particle
+from cuts import parse_cuts, parse_oversample
+from lineshapes import table_lineshapes
+
+# Lineshape code of nodes that always have their nominal mass
+NO_LINESHAPE = -1
+
+class DecayPlan(object):
+    ''' The arrays describing a compiled decay tree. For each node:
+            types:          particle type name
+            masses:         nominal mass
+            widths:         width (0 where it is not known)
+            lineshapes:     index into lineshape_names of the node's lineshape,
+                            or NO_LINESHAPE
+            decay_starts:   index of the node's first decay
+            n_decays:       number of decays of the node; the node's decays are
+                            decay_starts[i] to decay_starts[i] + n_decays[i] - 1
+            thresholds:     the smallest mass the node can have and still undergo
+                            one of its decays (0 for nodes that don't decay)
+            min_masses:     the smallest mass the node can have: its nominal mass,
+                            or its threshold if it has a lineshape
+            lineshape_params: the GraphPhys parameters of nodes with a tabulated
+                            lineshape (see lineshapes.table_lineshapes), or None
+            lineshape_tables: the LineshapeTable of nodes with a tabulated
+                            lineshape, or None
+        and for each decay:
+            decay_parents:  node that decays
+            product_starts: position of the decay's first product in products
+            n_products:     number of products
+            probabilities:  probability of the decay among its parent's decays
+            decay_weights:  the factor by which choosing the decay multiplies an event's
+                            weight: 1, unless the parent's decays are oversampled
+            alias_cuts, aliases: the parent's alias table. To choose a decay, pick
+                            one of the parent's decays d uniformly, then keep it
+                            with probability alias_cuts[d], or take aliases[d]
+                            instead. The table picks decays with their sampling
+                            probabilities, probabilities * decay_weights.
+            max_weights:    the largest phase-space weight of the decay, by which the
+                            generator divides its weights to accept events (see
+                            generator.calibrate_weights), or None until it is measured
+        and for each root of the plan, by position in 'roots':
+            roots:          the root's node
+            root_rates:     probability of an event starting from the root
+            root_alias_cuts, root_aliases: the roots' alias table, as for the decays
+        'products' holds the product nodes of every decay, one after the other. A node that is
+        shared by several roots' trees is a product of several decays.
+        'cuts' holds the generation-time cuts of the tree (see cuts.py), and 'node_cuts' and
+        'decay_cuts' the positions in 'cuts' of the cuts on each node and each decay. Oversampled
+        ranges of particles are cuts with a prescale.
+    '''
+    def __init__(self):
+        self.types = []
+        self.masses = []
+        self.widths = []
+        self.lineshapes = []
+        self.decay_starts = []
+        self.n_decays = []
+        self.thresholds = []
+        self.min_masses = []
+        self.lineshape_params = []
+        self.lineshape_tables = []
+        self.decay_parents = []
+        self.product_starts = []
+        self.n_products = []
+        self.probabilities = []
+        self.decay_weights = []
+        self.alias_cuts = []
+        self.aliases = []
+        self.max_weights = None
+        self.products = []
+        self.lineshape_names = []
+        self.cuts = []
+        self.node_cuts = []
+        self.decay_cuts = []
+        self.roots = []
+        self.root_rates = []
+        self.root_alias_cuts = []
+        self.root_aliases = []
+
+    @property
+    def n_nodes(self):
+        return len(self.types)
+
+    @property
+    def n_roots(self):
+        return len(self.roots)
+
+    @property
+    def n_decay_modes(self):
+        return len(self.decay_parents)
+
+    @property
+    def weighted(self):
+        ''' Whether events generated from the plan have weights other than 0 and 1. '''
+        return bool( (self.decay_weights != 1).any() or [cut for cut in self.cuts if cut.prescale is not None] )
+
+    def get_products(self, decay):
+        ''' @return: the product nodes of a decay. '''
+        start = self.product_starts[decay]
+        return self.products[start:start + self.n_products[decay]]
+
+    def get_decays(self, node):
+        ''' @return: the decays of a node. '''
+        return np.arange(self.decay_starts[node], self.decay_starts[node] + self.n_decays[node])
+
+    def choose_decays(self, node, n, rng):
+        ''' Picks a decay of a node for each of n events, according to the sampling probabilities.
+            @return: an array of n decay numbers.
+        '''
+        # One uniform number gives both the column of the alias table (its
+        # integer part) and the uniform number to compare with the cut (its
+        # fractional part)
+        u = rng.random_sample(n) * self.n_decays[node]
+        column = np.minimum(u.astype(int), self.n_decays[node] - 1)
+        choices = self.decay_starts[node] + column
+        return np.where(u - column < self.alias_cuts[choices], choices, self.aliases[choices])
+
+    def choose_roots(self, n, rng):
+        ''' Picks the root each of n events starts from, according to the roots' rates.
+            @return: an array of n positions in 'roots'.
+        '''
+        u = rng.random_sample(n) * self.n_roots
+        column = np.minimum(u.astype(int), self.n_roots - 1)
+        return np.where(u - column < self.root_alias_cuts[column], column, self.root_aliases[column])
+
+    def get_end_states(self, present, choices):
+        ''' @param present: a boolean array of shape (n_events, n_nodes), true for the nodes
+                            that appear in each event.
+            @param choices: an array of the same shape holding the decay each node underwent
+                            in each event, or -1 where it did not decay.
+            @return: a boolean array of the same shape, true for the final-state particles of each event.
+        '''
+        no_products = np.append(self.n_products == 0, True) # Index -1: did not decay
+        return present & no_products[choices]
+
+    def get_digest(self):
+        ''' @return: a hex digest of everything in the plan that affects the events generated from it,
+                     to tell whether two plans are the same.
+        '''
+        digest = hashlib.md5()
+        digest.update( repr((list(self.types), self.lineshape_names,
+                             [(cut.variable, cut.low, cut.high, cut.prescale) for cut in self.cuts],
+                             [list(cuts) for cuts in self.node_cuts], [list(cuts) for cuts in self.decay_cuts])) )
+        for name in ('masses', 'widths', 'lineshapes', 'decay_starts', 'n_decays', 'thresholds',
+                     'min_masses', 'decay_parents', 'product_starts', 'n_products', 'probabilities',
+                     'decay_weights', 'alias_cuts', 'aliases', 'products', 'roots', 'root_rates',
+                     'root_alias_cuts', 'root_aliases'):
+            array = getattr(self, name)
+            digest.update( name + array.dtype.str + array.tostring() )
+        for table in self.lineshape_tables:
+            if table is not None:
+                digest.update( table.thetas.tostring() + table.cdf.tostring() )
+        return digest.hexdigest()
+
+
+def mass_and_width(particle):
+    ''' @return: the nominal mass and width of a particle. A particle with a lineshape takes
+                 these from its database type; others take them from their own parameters,
+                 which default to those of their database type.
+    '''
+    source = particle
+    if hasattr(particle, 'lineshape'):
+        source = particle.get_db_type()
+    try:
+        width = float(source.width)
+    except AttributeError:
+        width = 0.0
+    return float(source.mass), width
+
+def decay_probabilities(decays):
+    ''' @return: the probabilities with which the simulator picks each of a particle's decays.
+                 Each decay's probability comes from its 'prob' parameter if it has one, or
+                 else its branching fraction (see Decay.get_branching_fraction). Decays whose
+                 probability is still unknown share equally whatever probability the known
+                 ones leave (none, with a warning, if they add up to 1 or more); if none is
+                 known, all are equally likely. The results are then normalized to add up to 1.
+        @raise ValueError: if a probability is negative or not a number.
+    '''
+    probabilities = []
+    for decay in decays:
+        if decay.params.has_key('prob'):
+            probabilities.append( float(decay.params['prob']) )
+        else:
+            probabilities.append( decay.get_branching_fraction() )
+
+    for decay, prob in zip(decays, probabilities):
+        if prob is not None and not prob >= 0:
+            raise ValueError('Invalid decay probability %s for %s' % (prob, decay))
+
+    known = [ prob for prob in probabilities if prob is not None ]
+    n_unknown = len(probabilities) - len(known)
+    if len(known) == 0:
+        probabilities = [1.0] * len(probabilities)
+    elif n_unknown > 0:
+        remainder = 1.0 - sum(known)
+        if remainder <= 0:
+            warn('Decays of %s with unknown probabilities will never be chosen, because the '
+                 'others add up to %g' % (decays[0].parent.type, sum(known)))
+            remainder = 0.0
+        probabilities = [ (prob, remainder / n_unknown)[prob is None] for prob in probabilities ]
+
+    total = sum(probabilities)
+    if total == 0:
+        return [ 1.0 / len(probabilities) for prob in probabilities ]
+    return [ prob / total for prob in probabilities ]
+
+def sampling_probabilities(decays, probabilities):
+    ''' @param probabilities: the probabilities of a particle's decays (see decay_probabilities)
+        @return: (sampling, weights): the probabilities with which the generator picks each decay,
+                 which are the probabilities multiplied by the decays' 'oversample' factors (1 by
+                 default) and normalized again, and the weight that picking each decay gives an
+                 event, probabilities / sampling (0 for decays that are never picked).
+        @raise ValueError: if an oversampling factor is not a positive number.
+    '''
+    factors = []
+    for decay in decays:
+        factor = float(decay.params.get('oversample', 1.0))
+        if not factor > 0:
+            raise ValueError('Invalid oversampling factor %s for %s' % (factor, decay))
+        factors.append(factor)
+
+    # Without any oversampling, the probabilities are left exactly as they were
+    if len(set(factors)) <= 1:
+        return probabilities, [1.0] * len(probabilities)
+
+    sampling = [ prob * factor for prob, factor in zip(probabilities, factors) ]
+    total = sum(sampling)
+    sampling = [ prob / total for prob in sampling ]
+    weights = []
+    for prob, sample in zip(probabilities, sampling):
+        if sample > 0:
+            weights.append(prob / sample)
+        else:
+            weights.append(0.0)
+    return sampling, weights
+
+def alias_table(probabilities):
+    ''' Builds an alias table with Vose's algorithm.
+        @param probabilities: probabilities adding up to 1
+        @return: (cuts, aliases), such that picking i uniformly, then keeping it with probability
+                 cuts[i] or taking aliases[i] otherwise, picks each i with probability probabilities[i].
+    '''
+    n = len(probabilities)
+    scaled = [ prob * n for prob in probabilities ]
+    cuts = [1.0] * n
+    aliases = range(n)
+    small = [ i for i in range(n) if scaled[i] < 1.0 ]
+    large = [ i for i in range(n) if scaled[i] >= 1.0 ]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        cuts[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] = (scaled[more] + scaled[less]) - 1.0
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+    # Anything left over is 1 up to rounding error, and keeps cut 1
+    return cuts, aliases
+
+def get_width_channel(plan, node):
+    ''' @return: the nominal masses of the products of the decay that a node's mass-dependent width
+                 is computed for: its most likely decay to two particles.
+        @raise ValueError: if the node has no decay to two particles.
+    '''
+    decays = [ decay for decay in plan.get_decays(node) if plan.n_products[decay] == 2 ]
+    if not decays:
+        raise ValueError('%s needs a decay to two particles for its %s lineshape' %
+                         (plan.types[node], plan.lineshape_names[plan.lineshapes[node]]))
+    decay = max(decays, key=lambda decay: plan.probabilities[decay])
+    return tuple(plan.masses[plan.get_products(decay)])
+
+def build_lineshape_table(plan, node, lineshape, mass, width, high):
+    ''' @return: the LineshapeTable of a node's lineshape (one of lineshapes.table_lineshapes) with
+                 the given mass and width, from the node's threshold up to high.
+        @raise ValueError: if the lineshape's parameters are invalid.
+    '''
+    low = plan.thresholds[node]
+    # A node with no room to decay is reported by check_kinematics; its table
+    # just needs a valid range
+    high = max(high, low + width, low + 1e-6)
+    return table_lineshapes[lineshape](mass, width, plan.lineshape_params[node] or {},
+                                       get_width_channel(plan, node), low, high)
+
+def root_rates(roots, rates=None):
+    ''' @param roots: the root particles of a plan
+        @param rates: the relative rate of each root, instead of their 'rate' parameters
+        @return: the probability of an event starting from each root: the roots' relative rates,
+                 taken from rates if given, or else from their 'rate' parameters (1 by default),
+                 normalized to add up to 1.
+        @raise ValueError: if rates doesn't have one rate per root, a rate is negative or not a
+                           number, or the rates add up to 0.
+    '''
+    if rates is None:
+        rates = [ root.params.get('rate', 1.0) for root in roots ]
+    elif len(rates) != len(roots):
+        raise ValueError('Expected %d root rates, not %d' % (len(roots), len(rates)))
+    rates = [ float(rate) for rate in rates ]
+    for root, rate in zip(roots, rates):
+        if not 0 <= rate < np.inf:
+            raise ValueError('Invalid rate %s for root %s' % (rate, root.type))
+    total = sum(rates)
+    if total == 0:
+        raise ValueError('The rates of the roots add up to 0')
+    return [ rate / total for rate in rates ]
+
+def get_subtree_key(particle, keys, key_numbers):
+    # A number that is the same for two particles exactly when their subtrees
+    # are identical: the same types and parameters, and the same decays with the
+    # same parameters, all the way down. keys holds the numbers of the particles
+    # seen so far, by id, and key_numbers those of the distinct subtrees.
+    if not keys.has_key(id(particle)):
+        key = (particle.type, repr(sorted(particle.params.items())),
+               tuple([ (repr(sorted(decay.params.items())),
+                        tuple([ get_subtree_key(product, keys, key_numbers) for product in decay.products ]))
+                       for decay in particle.decays ]))
+        keys[id(particle)] = key_numbers.setdefault(key, len(key_numbers))
+    return keys[id(particle)]
+
+def compile_plan(roots, lineshapes=None, rates=None):
+    ''' Compiles a decay tree, or several, into a DecayPlan.
+        @param roots: the root Particle of the tree, or a list (or ProcessGroup) of root Particles
+        @param lineshapes: the names of the lineshapes the generator supports, besides the
+                           tabulated ones. If given, an unknown lineshape is an error at
+                           compile time.
+        @param rates: the relative rate of each root, instead of their 'rate' parameters
+        @raise ValueError: if a particle in the tree has an unknown lineshape or invalid lineshape
+                           parameters, invalid cuts or an invalid oversampled range, or one of
+                           its decays has an invalid
+                           probability (see decay_probabilities), oversampling factor or cuts,
+                           or the roots' rates are invalid (see root_rates).
+    '''
+    if isinstance(roots, Particle):
+        roots = [roots]
+    roots = list(roots)
+    if not roots:
+        raise ValueError('No root particle to compile')
+    plan = DecayPlan()
+
+    # Each distinct node is described by a record first, and the records are
+    # numbered once they are all known
+    records = []
+    subtree_keys = {}
+    key_numbers = {}
+    shareable = {} # Records of subtrees below the roots, by subtree key
+
+    def add_cuts(cuts):
+        plan.cuts.extend(cuts)
+        return range(len(plan.cuts) - len(cuts), len(plan.cuts))
+
+    def mark_used(record, used):
+        used.add(record)
+        for decay in records[record]['decays']:
+            for product in decay[-1]:
+                mark_used(product, used)
+
+    def add_node(particle, used, is_root=False):
+        # used holds the records already in the current root's tree, which
+        # can't appear in it a second time
+        key = get_subtree_key(particle, subtree_keys, key_numbers)
+        if not is_root:
+            for record in shareable.get(key, []):
+                if record not in used:
+                    mark_used(record, used)
+                    return record
+
+        mass, width = mass_and_width(particle)
+        lineshape = NO_LINESHAPE
+        if hasattr(particle, 'lineshape'):
+            if lineshapes is not None and particle.lineshape not in lineshapes and \
+               not table_lineshapes.has_key(particle.lineshape):
+                raise ValueError('Unknown lineshape %s for %s' % (particle.lineshape, particle.type))
+            if particle.lineshape not in plan.lineshape_names:
+                plan.lineshape_names.append(particle.lineshape)
+            lineshape = plan.lineshape_names.index(particle.lineshape)
+
+        record = len(records)
+        records.append({'type': particle.type, 'mass': mass, 'width': width, 'lineshape': lineshape,
+                        'lineshape_params': None, 'decays': []})
+        if lineshape != NO_LINESHAPE and table_lineshapes.has_key(particle.lineshape):
+            records[record]['lineshape_params'] = dict(particle.params)
+        records[record]['cuts'] = add_cuts( parse_cuts(particle.params, particle.type) +
+                                            parse_oversample(particle.params, particle.type) )
+        if not is_root:
+            shareable.setdefault(key, []).append(record)
+        used.add(record)
+
+        probabilities = decay_probabilities(particle.decays)
+        sampling, weights = sampling_probabilities(particle.decays, probabilities)
+        for decay, prob, sample, weight in zip(particle.decays, probabilities, sampling, weights):
+            label = '%s -> %s' % (particle.type, ' '.join([product.type for product in decay.products]))
+            cuts = add_cuts(parse_cuts(decay.params, label))
+            records[record]['decays'].append( (prob, sample, weight, cuts,
+                                               [add_node(product, used) for product in decay.products]) )
+        return record
+
+    root_records = [ add_node(root, set(), is_root=True) for root in roots ]
+
+    # Number the nodes so that each comes after every node it is a product of.
+    # A node is taken as soon as the last of those has been, and the one taken
+    # most recently goes first, so a single tree is numbered depth first.
+    n_parents = [0] * len(records)
+    for record in records:
+        for decay in record['decays']:
+            for product in decay[-1]:
+                n_parents[product] += 1
+    order = []
+    pending = root_records[::-1]
+    while pending:
+        record = pending.pop()
+        order.append(record)
+        for product in reversed([ product for decay in records[record]['decays'] for product in decay[-1] ]):
+            n_parents[product] -= 1
+            if n_parents[product] == 0:
+                pending.append(product)
+    numbers = [None] * len(records)
+    for node, record in enumerate(order):
+        numbers[record] = node
+
+    decay_lists = []
+    for record in order:
+        record = records[record]
+        plan.types.append(record['type'])
+        plan.masses.append(record['mass'])
+        plan.widths.append(record['width'])
+        plan.lineshapes.append(record['lineshape'])
+        plan.lineshape_params.append(record['lineshape_params'])
+        plan.node_cuts.append(record['cuts'])
+        decay_lists.append([ (prob, sample, weight, cuts, [numbers[product] for product in products])
+                             for prob, sample, weight, cuts, products in record['decays'] ])
+
+    plan.roots = [ numbers[record] for record in root_records ]
+    plan.root_rates = root_rates(roots, rates)
+    plan.root_alias_cuts, plan.root_aliases = alias_table(plan.root_rates)
+
+    # Lay out the decays node by node, so that each node's decays are contiguous
+    for node, decays in enumerate(decay_lists):
+        start = len(plan.decay_parents)
+        plan.decay_starts.append(start)
+        plan.n_decays.append(len(decays))
+        cuts, aliases = alias_table([sample for prob, sample, weight, decay_cuts, products in decays])
+        for (prob, sample, weight, decay_cuts, products), cut, alias in zip(decays, cuts, aliases):
+            plan.decay_parents.append(node)
+            plan.decay_cuts.append(decay_cuts)
+            plan.product_starts.append(len(plan.products))
+            plan.n_products.append(len(products))
+            plan.probabilities.append(prob)
+            plan.decay_weights.append(weight)
+            plan.alias_cuts.append(cut)
+            plan.aliases.append(start + alias)
+            plan.products.extend(products)
+
+    # Products come after their parents, so going backwards each node's
+    # products are done before the node itself
+    plan.thresholds = [0.0] * plan.n_nodes
+    plan.min_masses = [0.0] * plan.n_nodes
+    for node in reversed(range(plan.n_nodes)):
+        decays = range(plan.decay_starts[node], plan.decay_starts[node] + plan.n_decays[node])
+        sums = [ sum([plan.min_masses[p] for p in plan.get_products(decay)]) for decay in decays ]
+        if sums:
+            plan.thresholds[node] = min(sums)
+        plan.min_masses[node] = plan.masses[node]
+        if plan.lineshapes[node] != NO_LINESHAPE:
+            plan.min_masses[node] = plan.thresholds[node]
+
+    for name in ('masses', 'widths', 'probabilities', 'decay_weights', 'alias_cuts', 'thresholds', 'min_masses',
+                 'root_rates', 'root_alias_cuts'):
+        setattr(plan, name, np.array(getattr(plan, name), dtype=float))
+    for name in ('lineshapes', 'decay_starts', 'n_decays', 'decay_parents', 'product_starts',
+                 'n_products', 'aliases', 'products', 'roots', 'root_aliases'):
+        setattr(plan, name, np.array(getattr(plan, name), dtype=int))
+
+    # Tabulated lineshapes cover every mass the node can have
+    max_masses = get_max_masses(plan)
+    plan.lineshape_tables = [None] * plan.n_nodes
+    for node in range(plan.n_nodes):
+        if plan.lineshape_params[node] is not None:
+            lineshape = plan.lineshape_names[plan.lineshapes[node]]
+            plan.lineshape_tables[node] = build_lineshape_table(plan, node, lineshape, plan.masses[node],
+                                                                plan.widths[node], max_masses[node])
+    return plan
+
+################################################################################
+# Kinematic checks
+################################################################################
+
+# A decay that is open by less than this fraction of the largest mass its
+# parent can have is reported as marginal
+MARGINAL_FRACTION = 0.01
+
+class Channel(object):
+    ''' A distinct decay channel of a plan: a parent type decaying to a multiset of products,
+        each with a given smallest mass. 'decays' lists the decays of the plan that are this channel.
+            threshold: the smallest mass the parent must have to decay to the products
+            max_mass:  the largest mass the parent can have, in the place in the tree where
+                       that is smallest
+            status:    'ok', 'marginal' (open by less than MARGINAL_FRACTION of max_mass, or only
+                       in the tail of the parent's lineshape) or 'infeasible' (never open)
+    '''
+    def __init__(self, parent, products, threshold):
+        self.parent = parent
+        self.products = products
+        self.threshold = threshold
+        self.max_mass = None
+        self.nominal_mass = None
+        self.has_lineshape = False
+        self.decays = []
+
+    @property
+    def status(self):
+        if self.threshold >= self.max_mass:
+            return 'infeasible'
+        if self.max_mass - self.threshold < MARGINAL_FRACTION * self.max_mass:
+            return 'marginal'
+        if self.has_lineshape and self.threshold >= self.nominal_mass:
+            return 'marginal'
+        return 'ok'
+
+    def __str__(self):
+        return '%s -> %s: threshold %.4f, parent mass up to %.4f (%s)' % \
+            (self.parent, ' '.join([product for product, mass in self.products]),
+             self.threshold, self.max_mass, self.status)
+
+# Thresholds of the channels seen so far, by parent type and products (type and
+# smallest mass)
+_threshold_cache = {}
+
+def get_channel_key(parent, products, min_masses):
+    return (parent, tuple(sorted(zip(products, min_masses))))
+
+def get_threshold(key):
+    ''' @return: the threshold of the channel with the given key (see get_channel_key), computed
+                 the first time the channel is seen.
+    '''
+    if not _threshold_cache.has_key(key):
+        _threshold_cache[key] = float(sum([mass for product, mass in key[1]]))
+    return _threshold_cache[key]
+
+def get_max_masses(plan):
+    ''' @return: the largest mass each node of a plan can have: the nominal mass for the roots and
+                 nodes without a lineshape, or else what its parent leaves once the other products
+                 of the decay have their smallest masses, as the generator samples them. A node
+                 shared by several roots' trees takes the largest it can have in any of them.
+    '''
+    max_masses = plan.masses.copy()
+    reached = np.zeros(plan.n_nodes, dtype=bool)
+    # Decays are laid out in the order of their parents, so each parent's
+    # largest mass is known before its decays are reached
+    for decay in range(plan.n_decay_modes):
+        products = plan.get_products(decay)
+        if len(products) < 2:
+            continue
+        room = max_masses[plan.decay_parents[decay]] - plan.min_masses[products].sum()
+        for product in products:
+            if plan.lineshapes[product] != NO_LINESHAPE:
+                max_mass = room + plan.min_masses[product]
+                if reached[product]:
+                    max_mass = max(max_mass, max_masses[product])
+                max_masses[product] = max_mass
+                reached[product] = True
+    return max_masses
+
+def check_kinematics(plan):
+    ''' Checks every decay of a plan against the masses its parent can have where it occurs.
+        Decays with fewer than two products are not checked.
+        @return: a list of the distinct Channels of the plan, in the order they first occur.
+    '''
+    max_masses = get_max_masses(plan)
+    channels = {}
+    for decay in range(plan.n_decay_modes):
+        products = plan.get_products(decay)
+        if len(products) < 2:
+            continue
+        parent = plan.decay_parents[decay]
+        key = get_channel_key(plan.types[parent], [plan.types[p] for p in products],
+                              plan.min_masses[products])
+        if not channels.has_key(key):
+            channels[key] = Channel(key[0], key[1], get_threshold(key))
+        channel = channels[key]
+
+        # Where a channel occurs in several places, check it where its parent is lightest
+        if channel.max_mass is None or max_masses[parent] < channel.max_mass:
+            channel.max_mass = max_masses[parent]
+            channel.nominal_mass = plan.masses[parent]
+            channel.has_lineshape = plan.lineshapes[parent] != NO_LINESHAPE
+        channel.decays.append(decay)
+    return sorted(channels.values(), key=lambda channel: channel.decays[0])
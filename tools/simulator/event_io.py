@@ -0,0 +1,422 @@
+################################################################################
+# Binary event files
+#
+# Events are stored by column rather than by event: for each particle in the
+# decay plan, one array of E, one of px, one of py and one of pz, followed by
+# an array of decay chain ids and an array of event weights. Files are
+# written in chunks of events, so a writer never has to hold a whole file in
+# memory, and each chunk's arrays can optionally be compressed with zlib.
+#
+# File layout (all integers little-endian):
+#
+#   header:  MAGIC, then a uint32 format version and a uint32 length,
+#            followed by that many bytes of JSON describing the events:
+#            the particle types of the plan's nodes, its decays, the
+#            compression used, the columns stored for each particle and
+#            the dtype of the four-vector columns (float64 or float32).
+#   chunks:  CHUNK_MAGIC, then uint32 n_events and uint32 n_new_chains,
+#            then four blocks, each a uint64 length followed by that many
+#            bytes (compressed if the header says so):
+#              new chains: int32 (n_new_chains, n_nodes), the decay each node
+#                          underwent in chains first seen in this chunk
+#              vectors:    (n_nodes, 4, n_events), the four-vector columns,
+#                          NaN for particles not in an event
+#              chain ids:  int32 (n_events)
+#              weights:    float64 (n_events)
+#
+# A decay chain is one combination of decays chosen for the nodes of the
+# plan; events with the same chain id contain the same particles. Chains are
+# numbered in the order they first appear in the file.
+#
+# Alongside each file, the writer saves an index (the file's name plus
+# INDEX_SUFFIX, a .npy array) with one row per chunk, giving the chunk's
+# first event, number of events and number of new chains, the byte offsets of
+# its four blocks' data and the offset of its end. MappedEventFile uses the
+# index to find any event without reading the file, and rebuilds it by
+# scanning the chunk headers if it is missing or out of date.
+#
+# A writer can also resume a file that was being written when its process
+# stopped, from the end of the last chunk known to be complete (see
+# checkpoint.py): anything after that is discarded and writing carries on.
+#
+################################################################################
+
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = 'PYDECAYEV'
+FORMAT_VERSION = 1
+CHUNK_MAGIC = 'CHNK'
+
+COLUMNS = ('E', 'px', 'py', 'pz')
+
+INDEX_SUFFIX = '.idx'
+
+# Columns of the index
+(INDEX_FIRST_EVENT, INDEX_N_EVENTS, INDEX_N_NEW_CHAINS, INDEX_CHAINS, INDEX_VECTORS,
+ INDEX_CHAIN_IDS, INDEX_WEIGHTS, INDEX_END) = range(8)
+
+_header_struct = struct.Struct('<II')
+_chunk_struct = struct.Struct('<4sII')
+_block_struct = struct.Struct('<Q')
+
+class EventWriter(object):
+    ''' Writes batches of events from a decay plan to a binary event file. '''
+
+    def __init__(self, path, plan, compression=None, dtype=np.float64, resume_at=None):
+        ''' @param compression: None, or 'zlib' to compress each chunk's arrays.
+            @param dtype: the type the four-vectors are stored as; np.float32 halves
+                          the size of files at the cost of precision.
+            @param resume_at: if given, the file is not created but resumed: it must hold events
+                              of the same plan, written with the same options, and complete up
+                              to this offset; anything after the offset is discarded, and new
+                              chunks are added from there.
+            @raise ValueError: if the file to resume doesn't match, or is shorter than resume_at.
+        '''
+        if compression not in (None, 'zlib'):
+            raise ValueError('Unknown compression %s' % compression)
+        self.plan = plan
+        self.compression = compression
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.chains = {}
+        self.n_events = 0
+        self.index = []
+        self.path = path
+
+        header = json.dumps({
+            'types': list(plan.types),
+            'decays': [ [int(plan.decay_parents[d]), [int(p) for p in plan.get_products(d)]]
+                        for d in range(plan.n_decay_modes) ],
+            'compression': compression,
+            'columns': COLUMNS,
+            'dtype': self.dtype.str,
+        })
+        header = MAGIC + _header_struct.pack(FORMAT_VERSION, len(header)) + header
+
+        if resume_at is None:
+            self.outfile = open(path, 'wb')
+            self.outfile.write(header)
+        else:
+            self.outfile = open(path, 'r+b')
+            self.resume(header, resume_at)
+
+    def resume(self, header, offset):
+        # Cuts the file back to offset and picks up the chunk index and decay
+        # chains of the events before it
+        if self.outfile.read(len(header)) != header:
+            raise ValueError('%s was not written from the same decay plan and options' % self.path)
+        self.outfile.seek(0, os.SEEK_END)
+        if self.outfile.tell() < offset:
+            raise ValueError('%s is shorter than the %d bytes to resume from' % (self.path, offset))
+        self.outfile.truncate(offset)
+        self.outfile.flush()
+
+        index = build_index(self.path)
+        reader = EventReader(self.path)
+        try:
+            for row in index:
+                reader.infile.seek(row[INDEX_CHAINS] - _block_struct.size)
+                for chain in reader.read_block('<i4', (row[INDEX_N_NEW_CHAINS], reader.n_nodes)):
+                    self.chains[tuple(chain.tolist())] = len(self.chains)
+        finally:
+            reader.close()
+        self.index = index.tolist()
+        self.n_events = int(index[:, INDEX_N_EVENTS].sum())
+        self.outfile.seek(offset)
+
+    def write_block(self, array):
+        # Returns the offset of the block's data in the file
+        data = np.ascontiguousarray(array).tostring()
+        if self.compression == 'zlib':
+            data = zlib.compress(data, 1)
+        self.outfile.write(_block_struct.pack(len(data)))
+        offset = self.outfile.tell()
+        self.outfile.write(data)
+        return offset
+
+    def write(self, vectors, choices, weights):
+        ''' Writes a chunk of events.
+            @param vectors: four-vectors of each node in each event, shape (n_events, n_nodes, 4)
+            @param choices: the decay each node underwent in each event, shape (n_events, n_nodes)
+            @param weights: the weight of each event
+        '''
+        n_events = len(weights)
+        choices = np.ascontiguousarray(choices)
+        unique, inverse = np.unique( choices.view([('', choices.dtype)] * choices.shape[1]),
+                                     return_inverse=True )
+        unique = unique.view(choices.dtype).reshape(-1, choices.shape[1])
+
+        new_chains = []
+        chain_ids = np.empty(len(unique), dtype='<i4')
+        for i, chain in enumerate(unique):
+            key = tuple(chain.tolist())
+            if not self.chains.has_key(key):
+                self.chains[key] = len(self.chains)
+                new_chains.append(chain)
+            chain_ids[i] = self.chains[key]
+        new_chains = np.array(new_chains, dtype='<i4').reshape(-1, choices.shape[1])
+
+        self.outfile.write(_chunk_struct.pack(CHUNK_MAGIC, n_events, len(new_chains)))
+        offsets = [ self.write_block(new_chains),
+                    self.write_block(vectors.transpose(1, 2, 0).astype(self.dtype)),
+                    self.write_block(chain_ids[inverse]),
+                    self.write_block(np.asarray(weights, dtype='<f8')) ]
+        self.index.append( [self.n_events, n_events, len(new_chains)] + offsets + [self.outfile.tell()] )
+        self.n_events += n_events
+
+    def write_batch(self, batch):
+        ''' Writes the events of an EventBatch as one chunk. '''
+        self.write(batch.vectors, batch.choices, batch.weights)
+
+    def flush(self):
+        ''' Hands everything written so far to the operating system, so that it is in the file even
+            if this process is killed.
+            @return: the offset of the end of the last chunk written.
+        '''
+        self.outfile.flush()
+        return self.outfile.tell()
+
+    def close(self):
+        self.outfile.close()
+        write_index(self.path, np.array(self.index, dtype=np.int64).reshape(-1, 8))
+
+
+class Events(object):
+    ''' Events read from a binary event file, as NumPy arrays:
+            columns:   shape (n_nodes, 4, n_events); columns[i, 0] holds the energy of
+                       node i in each event, columns[i, 1:] its momentum
+            chain_ids: the decay chain of each event, an index into chains
+            weights:   the weight of each event
+            chains:    int (n_chains, n_nodes), the decay each node underwent in each
+                       chain, -1 where it did not decay
+            types:     the particle type of each node
+            decays:    (parent node, [product nodes]) for each decay of the plan
+    '''
+    def __init__(self, types, decays, columns, chain_ids, weights, chains):
+        self.types = types
+        self.decays = decays
+        self.columns = columns
+        self.chain_ids = chain_ids
+        self.weights = weights
+        self.chains = chains
+
+    @property
+    def n_events(self):
+        return len(self.weights)
+
+    def get_vectors(self, node):
+        ''' @return: the four-vectors of a node, shape (n_events, 4); a view of the columns. '''
+        return self.columns[node].T
+
+    def get_present(self, node):
+        ''' @return: whether a node appears in each event. '''
+        return np.isfinite(self.columns[node, 0])
+
+
+def read_header(infile):
+    # Reads the header of an event file open at its start, leaving the file at
+    # the first chunk. Returns the types, decays, compression and dtype.
+    if infile.read(len(MAGIC)) != MAGIC:
+        raise ValueError('%s is not an event file' % infile.name)
+    version, length = _header_struct.unpack(infile.read(_header_struct.size))
+    if version != FORMAT_VERSION:
+        raise ValueError('%s has format version %d; version %d is required' % (infile.name, version, FORMAT_VERSION))
+
+    header = json.loads(infile.read(length))
+    return ( [str(t) for t in header['types']],
+             [(parent, products) for parent, products in header['decays']],
+             header['compression'],
+             np.dtype(str(header['dtype'])) )
+
+
+class EventReader(object):
+    ''' Reads a binary event file chunk by chunk. '''
+
+    def __init__(self, path):
+        self.infile = open(path, 'rb')
+        self.types, self.decays, self.compression, self.dtype = read_header(self.infile)
+        self.n_nodes = len(self.types)
+        self.chains = np.zeros((0, self.n_nodes), dtype='<i4')
+
+    def read_block(self, dtype, shape):
+        length, = _block_struct.unpack(self.infile.read(_block_struct.size))
+        data = self.infile.read(length)
+        if self.compression == 'zlib':
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def read_chunk(self):
+        ''' @return: the next chunk of events as an Events object, or None at the end of the file. '''
+        chunk_header = self.infile.read(_chunk_struct.size)
+        if len(chunk_header) == 0:
+            return None
+        magic, n_events, n_new_chains = _chunk_struct.unpack(chunk_header)
+        if magic != CHUNK_MAGIC:
+            raise ValueError('Corrupt event file: bad chunk header')
+
+        new_chains = self.read_block('<i4', (n_new_chains, self.n_nodes))
+        self.chains = np.concatenate([self.chains, new_chains])
+        columns = self.read_block(self.dtype, (self.n_nodes, 4, n_events))
+        chain_ids = self.read_block('<i4', (n_events,))
+        weights = self.read_block('<f8', (n_events,))
+        return Events(self.types, self.decays, columns, chain_ids, weights, self.chains)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read_chunk()
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        self.infile.close()
+
+def read_events(path):
+    ''' Reads a whole binary event file.
+        @return: an Events object holding every event in the file.
+    '''
+    reader = EventReader(path)
+    try:
+        chunks = list(reader)
+    finally:
+        reader.close()
+
+    if len(chunks) == 0:
+        return Events(reader.types, reader.decays, np.zeros((reader.n_nodes, 4, 0), dtype=reader.dtype),
+                      np.zeros(0, dtype='<i4'), np.zeros(0), reader.chains)
+    return Events(reader.types, reader.decays,
+                  np.concatenate([c.columns for c in chunks], axis=2),
+                  np.concatenate([c.chain_ids for c in chunks]),
+                  np.concatenate([c.weights for c in chunks]),
+                  reader.chains)
+
+#######################################
+## Random access                     ##
+#######################################
+
+def write_index(path, index):
+    ''' Saves the chunk index of the event file at path. '''
+    outfile = open(path + INDEX_SUFFIX, 'wb')
+    try:
+        np.save(outfile, index)
+    finally:
+        outfile.close()
+
+def build_index(path):
+    ''' Builds the chunk index of an event file by reading its chunk headers.
+        @return: the index, an int64 array with one row per chunk.
+    '''
+    infile = open(path, 'rb')
+    try:
+        read_header(infile)
+        index = []
+        first_event = 0
+        while True:
+            chunk_header = infile.read(_chunk_struct.size)
+            if len(chunk_header) == 0:
+                break
+            magic, n_events, n_new_chains = _chunk_struct.unpack(chunk_header)
+            if magic != CHUNK_MAGIC:
+                raise ValueError('Corrupt event file: bad chunk header')
+            offsets = []
+            for block in range(4):
+                length, = _block_struct.unpack(infile.read(_block_struct.size))
+                offsets.append(infile.tell())
+                infile.seek(length, 1)
+            index.append( [first_event, n_events, n_new_chains] + offsets + [infile.tell()] )
+            first_event += n_events
+    finally:
+        infile.close()
+    return np.array(index, dtype=np.int64).reshape(-1, 8)
+
+def get_index(path):
+    ''' @return: the chunk index of an event file, read from its index file if that is up to date,
+                 or else built and saved (if possible) for next time.
+    '''
+    file_size = os.path.getsize(path)
+    if os.path.exists(path + INDEX_SUFFIX):
+        index = np.load(path + INDEX_SUFFIX)
+        if len(index) > 0 and index[-1, INDEX_END] == file_size:
+            return index
+    index = build_index(path)
+    try:
+        write_index(path, index)
+    except IOError:
+        pass # Read-only location; the index will be rebuilt next time
+    return index
+
+
+class MappedEventFile(object):
+    ''' Random access to the events of an uncompressed binary event file. The file is memory-mapped,
+        and get_events returns NumPy views of the mapped data, so only the pages that are actually
+        used are read, and several processes can share one file, each reading its own range of events
+        (see get_shard).
+    '''
+    def __init__(self, path):
+        infile = open(path, 'rb')
+        try:
+            self.types, self.decays, self.compression, self.dtype = read_header(infile)
+        finally:
+            infile.close()
+        self.n_nodes = len(self.types)
+        if self.compression is not None:
+            raise ValueError('%s is compressed; only uncompressed event files can be memory-mapped' % path)
+
+        self.index = get_index(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        self.chunk_starts = self.index[:, INDEX_FIRST_EVENT]
+        self.n_events = int(self.index[:, INDEX_N_EVENTS].sum())
+        self.chains = np.concatenate( [np.zeros((0, self.n_nodes), dtype='<i4')] +
+                                      [self.get_array(row[INDEX_CHAINS], '<i4', (row[INDEX_N_NEW_CHAINS], self.n_nodes))
+                                       for row in self.index] )
+
+    def get_array(self, offset, dtype, shape):
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        return self.data[offset:offset + size].view(dtype).reshape(shape)
+
+    def get_chunk(self, chunk):
+        ''' @return: the events of one chunk, as views of the mapped file. '''
+        row = self.index[chunk]
+        n = row[INDEX_N_EVENTS]
+        return Events(self.types, self.decays,
+                      self.get_array(row[INDEX_VECTORS], self.dtype, (self.n_nodes, 4, n)),
+                      self.get_array(row[INDEX_CHAIN_IDS], '<i4', (n,)),
+                      self.get_array(row[INDEX_WEIGHTS], '<f8', (n,)),
+                      self.chains)
+
+    def iter_events(self, start=0, stop=None):
+        ''' Yields the events from start up to (not including) stop as Events objects, one per chunk
+            the range overlaps, each holding views of the mapped file; nothing is copied.
+        '''
+        if stop is None or stop > self.n_events:
+            stop = self.n_events
+        chunk = max(np.searchsorted(self.chunk_starts, start, side='right') - 1, 0)
+        while chunk < len(self.index) and self.chunk_starts[chunk] < stop:
+            events = self.get_chunk(chunk)
+            first = self.chunk_starts[chunk]
+            a, b = max(start - first, 0), min(stop - first, events.n_events)
+            yield Events(self.types, self.decays, events.columns[:, :, a:b], events.chain_ids[a:b],
+                         events.weights[a:b], self.chains)
+            chunk += 1
+
+    def get_events(self, start, stop):
+        ''' @return: the events from start up to (not including) stop as one Events object. Its arrays
+                     are views of the mapped file if the range lies within one chunk, and copies otherwise.
+        '''
+        pieces = list(self.iter_events(start, stop))
+        if len(pieces) == 1:
+            return pieces[0]
+        return Events(self.types, self.decays,
+                      np.concatenate([p.columns for p in pieces] or [np.zeros((self.n_nodes, 4, 0))], axis=2),
+                      np.concatenate([p.chain_ids for p in pieces] or [np.zeros(0, dtype='<i4')]),
+                      np.concatenate([p.weights for p in pieces] or [np.zeros(0)]),
+                      self.chains)
+
+    def get_shard(self, shard, n_shards):
+        ''' @return: the (start, stop) event range of one of n_shards nearly equal parts of the file. '''
+        return (self.n_events * shard // n_shards, self.n_events * (shard + 1) // n_shards)
@@ -0,0 +1,139 @@
+################################################################################
+# Four-vectors with NumPy
+#
+# Functions for arrays of four-vectors, the vectorized counterpart of ROOT's
+# TLorentzVector. A four-vector array has any shape whose last axis holds
+# (E, px, py, pz), e.g. (n_events, 4) for one particle in each event or
+# (n_events, n_particles, 4) for several; every function works on all of the
+# vectors at once and returns arrays of the matching shape.
+#
+################################################################################
+
+import numpy as np
+
+# Positions of the components along the last axis of a four-vector array
+E, PX, PY, PZ = 0, 1, 2, 3
+
+################################################################################
+# Build four-vector arrays
+################################################################################
+def make(e, px, py, pz):
+
+    return np.stack(np.broadcast_arrays(e, px, py, pz), axis=-1).astype(float)
+
+def at_rest(mass):
+
+    mass = np.asarray(mass, dtype=float)
+    return make(mass, 0.0, 0.0, 0.0)
+
+################################################################################
+# Sum of four-vectors, e.g. total(p1, p2, p3) for the system of three particles
+################################################################################
+def total(*vectors):
+
+    return sum(vectors[1:], vectors[0])
+
+################################################################################
+# Scalar quantities
+################################################################################
+def mass2(p):
+
+    return p[..., E]**2 - (p[..., 1:]**2).sum(axis=-1)
+
+def mass(p):
+
+    return np.sqrt(np.maximum(mass2(p), 0.0))
+
+def invariant_mass(*vectors):
+    # Invariant mass of the combination of the given particles
+
+    return mass(total(*vectors))
+
+def momentum(p):
+
+    return np.sqrt((p[..., 1:]**2).sum(axis=-1))
+
+def pt(p):
+
+    return np.sqrt(p[..., PX]**2 + p[..., PY]**2)
+
+def cos_theta(p):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return p[..., PZ] / momentum(p)
+
+def theta(p):
+
+    return np.arctan2(pt(p), p[..., PZ])
+
+def phi(p):
+
+    return np.arctan2(p[..., PY], p[..., PX])
+
+def velocity(p):
+    # beta = p/E, shape (..., 3)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return p[..., 1:] / p[..., E:E + 1]
+
+################################################################################
+# Angles between the momenta of two sets of four-vectors
+################################################################################
+def cos_angle(a, b):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (a[..., 1:] * b[..., 1:]).sum(axis=-1) / (momentum(a) * momentum(b))
+
+def angle(a, b):
+
+    return np.arccos(np.clip(cos_angle(a, b), -1.0, 1.0))
+
+################################################################################
+# Lorentz boosts
+#
+# boost_components is the kernel: it takes and returns the components as
+# separate arrays, which is the fastest layout when the same boost is applied
+# to several particles (arrays of shape (n_particles, n_events) boosted by
+# velocities of shape (n_events,)). The other functions are built on it.
+################################################################################
+def boost_components(e, px, py, pz, bx, by, bz):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b2 = bx**2 + by**2 + bz**2
+        gamma = 1.0 / np.sqrt(1.0 - b2)
+        # (gamma - 1)/beta^2, taking care of zero velocities
+        gamma2 = np.where(b2 > 0, (gamma - 1.0) / np.where(b2 > 0, b2, 1.0), 0.0)
+        bp = bx * px + by * py + bz * pz
+        scale = gamma2 * bp + gamma * e
+        return gamma * (e + bp), px + scale * bx, py + scale * by, pz + scale * bz
+
+def boost(p, beta):
+    # Boost four-vectors p by the velocities beta, shape (..., 3)
+
+    beta = np.asarray(beta, dtype=float)
+    e, px, py, pz = boost_components(p[..., E], p[..., PX], p[..., PY], p[..., PZ],
+                                     beta[..., 0], beta[..., 1], beta[..., 2])
+    return make(e, px, py, pz)
+
+def to_rest_frame(p, frame):
+    # Transform four-vectors p into the rest frame of the four-vectors frame;
+    # frame broadcasts against p, e.g. shape (n, 1, 4) for p of shape (n, k, 4)
+
+    return boost(p, -velocity(frame))
+
+def from_rest_frame(p, frame):
+    # The inverse of to_rest_frame: p is given in the rest frame of frame
+
+    return boost(p, velocity(frame))
+
+################################################################################
+# Helicity angle: the cosine of the angle between a daughter's momentum in
+# its parent's rest frame and the direction of the parent's momentum in the
+# rest frame of reference (the grandparent, or the lab if reference is None)
+################################################################################
+def cos_helicity(daughter, parent, reference=None):
+
+    if reference is not None:
+        daughter = to_rest_frame(daughter, reference)
+        parent = to_rest_frame(parent, reference)
+    return cos_angle(to_rest_frame(daughter, parent), parent)
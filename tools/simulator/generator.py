@@ -0,0 +1,493 @@
+################################################################################
+# Streaming event generation
+#
+# The simulator as a library. A Simulation compiles a decay tree once and then
+# generates events from it, handing them out as EventBatches of a fixed size:
+#
+#     simulation = Simulation(graphphys.get_parser().parseFile('decay.gp'))
+#     for batch in simulation.generate(1000000, batch_size=10000):
+#         ...  # batch.vectors, batch.choices, batch.weights
+#
+# Events are generated only as fast as they are consumed: a single process
+# generates the next chunk when the batches of the last one have been used,
+# and a pool of worker processes is only allowed to run a few chunks ahead.
+# Memory use is bounded by the chunk size, however many events are generated.
+#
+# Simulation.fill fills histograms (see histograms.py) as events are generated,
+# in the worker processes if there are several, and returns only them.
+#
+# A ProcessGroup with several root particles is generated as one mixed sample:
+# each event starts from one of the roots, chosen with the roots' relative
+# rates (see decay_plan.py), and the roots' trees are compiled into one plan.
+#
+# mc_simulator.py is a command-line front end to this module.
+#
+################################################################################
+
+import itertools
+import multiprocessing
+from collections import deque
+from warnings import warn
+
+import numpy as np
+
+from pydecay import Particle
+from lineshapes import prob_lineshapes
+import phase_space
+import fourvectors
+import decay_plan
+
+# Seed of the random number generator; the same as ROOT's TRandom3 default,
+# so that repeated runs produce the same events
+DEFAULT_SEED = 4357
+
+# Number of events generated together in each pass over the decay tree
+BATCH_SIZE = 10000
+
+# Number of events in each chunk. Chunks are the unit of work handed out to
+# worker processes, and each has its own random number stream derived from the
+# seed and the chunk's number, so the events generated don't depend on how
+# many processes share the work.
+CHUNK_SIZE = 50000
+
+# Number of batches generated in a row without any event passing the cuts
+# before a run is given up on
+MAX_ATTEMPTS = 100
+
+# Largest number of phase-space trials generated together for the events of a
+# decay still waiting for one to be accepted
+MAX_TRIALS = 50000
+
+# Number of trials, and of parent masses for parents with a lineshape, with
+# which the largest phase-space weight of each decay is estimated, and the
+# factor by which the estimate is raised to cover weights it didn't see
+CALIBRATION_TRIALS = 5000
+CALIBRATION_MASSES = 4
+CALIBRATION_MARGIN = 1.5
+
+
+################################################################################
+# Return the masses of particles
+################################################################################
+
+def get_masses(plan, node, high, rng):
+    # The masses of a node of the plan in each of a batch of events, where high
+    # holds the largest mass the node can have in each event
+    # Lineshape overrides the nominal mass
+    if plan.lineshapes[node] == decay_plan.NO_LINESHAPE:
+        return np.repeat( plan.masses[node], len(high) )
+    elif plan.lineshape_tables[node] is not None:
+        return plan.lineshape_tables[node].sample( np.repeat(plan.thresholds[node], len(high)), high, rng )
+    else:
+        lineshape = prob_lineshapes[ plan.lineshape_names[plan.lineshapes[node]] ]
+        low = np.repeat( plan.thresholds[node], len(high) )
+        return lineshape( plan.masses[node], plan.widths[node], low, high, rng )
+
+################################################################################
+# Generate events a batch at a time
+################################################################################
+
+class EventBatch(object):
+    ''' A batch of events generated together from a decay plan. 'vectors' holds the four-vector of
+        each node of the plan in each event, as an array of shape (n_events, n_nodes, 4) that is NaN
+        where the node does not appear in the event, and 'choices' holds the decay each node
+        underwent in each event, as an array of shape (n_events, n_nodes) that is -1 where it did
+        not decay. 'weights' holds the weight of each event: 0 for events in which some decay
+        could not be generated or that failed a cut, and which should be discarded, and otherwise
+        1, unless the plan oversamples some decays or ranges (see DecayPlan.weighted).
+
+        'n_tried' is the number of events generated to obtain the batch, including those discarded,
+        'n_forbidden' the number of those discarded because some particle came out too light for
+        the decay chosen for it, and 'cut_counts' an array of shape (n_cuts, 2) holding the number
+        of events each of the plan's cuts was evaluated on and the number that passed it.
+    '''
+    def __init__(self, plan, n_events):
+        self.plan = plan
+        self.n_events = n_events
+        self.vectors = np.empty( (n_events, plan.n_nodes, 4) )
+        self.vectors.fill(np.nan)
+        self.choices = np.empty( (n_events, plan.n_nodes), dtype=int )
+        self.choices.fill(-1)
+        self.weights = np.ones(n_events)
+        self.n_tried = n_events
+        self.n_forbidden = 0
+        self.cut_counts = np.zeros( (len(plan.cuts), 2), dtype=int )
+
+    def take(self, indices):
+        # A new batch holding only the given events (an index array or a slice).
+        # The statistics of how the events were generated aren't carried over.
+        batch = EventBatch(self.plan, 0)
+        batch.vectors = self.vectors[indices]
+        batch.choices = self.choices[indices]
+        batch.weights = self.weights[indices]
+        batch.n_events = len(batch.weights)
+        batch.n_tried = batch.n_events
+        return batch
+
+    def get_present(self):
+        return np.isfinite( self.vectors[:, :, fourvectors.E] )
+
+    def get_end_states(self):
+        return self.plan.get_end_states(self.get_present(), self.choices)
+
+    def get_roots(self):
+        ''' @return: the position in plan.roots of the root each event started from. '''
+        return np.argmax( np.isfinite(self.vectors[:, self.plan.roots, fourvectors.E]), axis=1 )
+
+def generate_products(plan, vectors, decay, rng):
+    # Decay particles with the given four-vectors to the products of a decay,
+    # distributed according to phase space: each event is generated with a
+    # phase-space weight and kept with probability equal to that weight over the
+    # decay's largest weight, or generated again until it is kept. Returns the
+    # products' four-vectors and whether each event succeeded, which it only
+    # doesn't if its parent is too light for the products' smallest masses.
+    products = plan.get_products(decay)
+    n = len(vectors)
+    daughters = np.empty( (n, len(products), 4) )
+    daughters.fill(np.nan)
+    max_weight = 1.0
+    if plan.max_weights is not None:
+        max_weight = plan.max_weights[decay]
+
+    # Each product can be at most as heavy as the parent leaves room for, given
+    # the smallest masses the other products can have
+    min_masses = plan.min_masses[products]
+    room = fourvectors.mass(vectors) - min_masses.sum()
+    succeeded = room > 0
+
+    pending = np.flatnonzero(succeeded)
+    n_trials = 1
+    while len(pending) > 0:
+        # Several trials at once for each event, once the rate at which they
+        # are accepted is known
+        trials = np.repeat(pending, n_trials)
+        end_masses = np.column_stack([ get_masses(plan, p, room[trials] + m, rng)
+                                       for p, m in zip(products, min_masses) ])
+        trial, weights = phase_space.generate(vectors[trials], end_masses, rng)
+        weights /= max_weight
+        if (weights > 1).any():
+            warn('Phase-space weight of a decay of %s exceeds its estimated maximum; '
+                 'its events are slightly biased' % plan.types[plan.decay_parents[decay]])
+        accepted = np.flatnonzero( rng.random_sample(len(trials)) < weights )
+
+        # Each event takes the first of its trials that was accepted
+        events, first = np.unique(trials[accepted], return_index=True)
+        daughters[events] = trial[ accepted[first] ]
+        pending = np.setdiff1d(pending, events, assume_unique=True)
+        if len(pending) > 0:
+            rate = float(len(accepted)) / len(trials)
+            n_trials = int( min(np.ceil(1.0 / rate) if rate > 0 else 4 * n_trials,
+                                max(MAX_TRIALS // len(pending), 1)) )
+
+    return daughters, succeeded
+
+def calibrate_weights(plan, seed=DEFAULT_SEED):
+    ''' Estimates the largest phase-space weight (as phase_space.generate normalizes it) of each decay
+        of a plan to three or more products, from CALIBRATION_TRIALS trials at the parent's nominal
+        mass, or at CALIBRATION_MASSES masses from its threshold to its largest mass if it has a
+        lineshape, and sets plan.max_weights to the estimates times CALIBRATION_MARGIN (1 for
+        decays to two products). phase_space.generate normalizes weights to a bound far above
+        the largest weight of decays to many products, so accepting events with that weight
+        alone keeps very few of them.
+    '''
+    rng = np.random.RandomState(seed)
+    max_masses = decay_plan.get_max_masses(plan)
+    plan.max_weights = np.ones(plan.n_decay_modes)
+    for decay in range(plan.n_decay_modes):
+        products = plan.get_products(decay)
+        if len(products) < 3:
+            continue
+        parent = plan.decay_parents[decay]
+        min_masses = plan.min_masses[products]
+        parent_masses = [ max_masses[parent] ]
+        if plan.lineshapes[parent] != decay_plan.NO_LINESHAPE:
+            parent_masses = np.linspace(min_masses.sum(), max_masses[parent], CALIBRATION_MASSES + 1)[1:]
+
+        largest = 0.0
+        for parent_mass in parent_masses:
+            room = np.repeat(parent_mass - min_masses.sum(), CALIBRATION_TRIALS)
+            if not room[0] > 0:
+                continue
+            vectors = np.zeros( (CALIBRATION_TRIALS, 4) )
+            vectors[:, fourvectors.E] = parent_mass
+            end_masses = np.column_stack([ get_masses(plan, p, room + m, rng) for p, m in zip(products, min_masses) ])
+            largest = max(largest, phase_space.generate(vectors, end_masses, rng)[1].max())
+        if largest > 0:
+            plan.max_weights[decay] = min(largest * CALIBRATION_MARGIN, 1.0)
+
+def apply_cuts(batch, cuts, events, node, rng):
+    # Evaluates the cuts with the given positions in the plan on a node's four-vectors
+    # in the given events, and rejects the events that fail any of them. Each cut
+    # only sees the events that passed the ones before it. Events outside an
+    # oversampled range (a cut with a prescale) are kept with probability
+    # 1/prescale, with their weight scaled up to match. Returns the events that pass.
+    for cut in cuts:
+        if len(events) == 0:
+            break
+        prescale = batch.plan.cuts[cut].prescale
+        passed = batch.plan.cuts[cut].passes( batch.vectors[events, node] )
+        batch.cut_counts[cut] += len(events), passed.sum()
+        if prescale is not None:
+            kept = ~passed & (rng.random_sample(len(events)) * prescale < 1.0)
+            batch.weights[ events[kept] ] *= prescale
+            passed |= kept
+        batch.weights[ events[~passed] ] = 0.0
+        events = events[passed]
+    return events
+
+def generate_batch(plan, initial_vectors, n_events, rng):
+    # initial_vectors holds the four-vector of each root of the plan
+    batch = EventBatch(plan, n_events)
+    roots = np.zeros(n_events, dtype=int)
+    if plan.n_roots > 1:
+        roots = plan.choose_roots(n_events, rng)
+    for i, root in enumerate(plan.roots):
+        events = np.flatnonzero(roots == i)
+        batch.vectors[events, root] = initial_vectors[i]
+        apply_cuts(batch, plan.node_cuts[root], events, root, rng)
+
+    # Parents come before their products in the plan, so by the time each node is
+    # reached, its four-vectors in the events it appears in are known (whichever
+    # root's tree it is in, for a node that several share). Events that have been
+    # rejected are left alone from then on.
+    for node in range(plan.n_nodes):
+        if plan.n_decays[node] == 0:
+            continue
+        events = np.flatnonzero( np.isfinite(batch.vectors[:, node, fourvectors.E]) & (batch.weights > 0) )
+        if len(events) == 0:
+            continue
+
+        choices = plan.choose_decays(node, len(events), rng)
+        batch.choices[events, node] = choices
+        if plan.weighted:
+            batch.weights[events] *= plan.decay_weights[choices]
+
+        for decay in plan.get_decays(node):
+            products = plan.get_products(decay)
+            selected = apply_cuts(batch, plan.decay_cuts[decay], events[choices == decay], node, rng)
+            if len(selected) == 0 or len(products) == 0:
+                continue
+
+            if len(products) == 1:
+                batch.vectors[selected, products[0]] = batch.vectors[selected, node]
+            else:
+                daughters, succeeded = generate_products(plan, batch.vectors[selected, node], decay, rng)
+                batch.vectors[selected[:, np.newaxis], products] = daughters
+                batch.weights[ selected[~succeeded] ] = 0.0
+                batch.n_forbidden += (~succeeded).sum()
+                selected = selected[succeeded]
+
+            for product in products:
+                selected = apply_cuts(batch, plan.node_cuts[product], selected, product, rng)
+
+    return batch
+
+def concatenate_batches(batches):
+    batch = EventBatch(batches[0].plan, 0)
+    batch.n_events = sum([b.n_events for b in batches])
+    batch.vectors = np.concatenate([b.vectors for b in batches])
+    batch.choices = np.concatenate([b.choices for b in batches])
+    batch.weights = np.concatenate([b.weights for b in batches])
+    batch.n_tried = sum([b.n_tried for b in batches])
+    batch.n_forbidden = sum([b.n_forbidden for b in batches])
+    batch.cut_counts = sum([b.cut_counts for b in batches])
+    return batch
+
+def generate_events(plan, initial_vectors, n_events, rng):
+    # Generate batches until there are n_events events that succeeded and passed the cuts
+    batches = []
+    n_generated = 0
+    n_tried = 0
+    n_forbidden = 0
+    cut_counts = np.zeros( (len(plan.cuts), 2), dtype=int )
+    while n_generated < n_events:
+        batch = generate_batch(plan, initial_vectors, BATCH_SIZE, rng)
+        good = np.flatnonzero(batch.weights > 0)[:n_events - n_generated]
+        batches.append( batch.take(good) )
+        n_generated += len(good)
+        n_tried += batch.n_tried
+        n_forbidden += batch.n_forbidden
+        cut_counts += batch.cut_counts
+        if n_generated == 0 and len(batches) >= MAX_ATTEMPTS:
+            raise RuntimeError('No event passed the cuts in %d tries' % n_tried)
+    batch = concatenate_batches(batches)
+    batch.n_tried = n_tried
+    batch.n_forbidden = n_forbidden
+    batch.cut_counts = cut_counts
+    return batch
+
+################################################################################
+# Generate events a chunk at a time, in parallel
+################################################################################
+
+def get_chunk_rng(seed, chunk):
+    # An independent random number stream for each chunk, which depends only
+    # on the seed and the chunk's number
+    return np.random.RandomState([seed, chunk])
+
+def generate_chunk(args):
+    plan, initial_vectors, seed, chunk, n_events = args
+    return generate_events(plan, initial_vectors, n_events, get_chunk_rng(seed, chunk))
+
+def get_chunks(plan, initial_vectors, n_events, seed, first_chunk=0):
+    # The arguments of generate_chunk for each chunk of a run of n_events
+    # events, starting from chunk number first_chunk (so a run can be resumed
+    # with the events it would have had)
+    return ( (plan, initial_vectors, seed, start // CHUNK_SIZE, min(CHUNK_SIZE, n_events - start))
+             for start in xrange(first_chunk * CHUNK_SIZE, n_events, CHUNK_SIZE) )
+
+def map_chunks(function, chunks, n_workers=1, max_pending=None):
+    # Yields function(chunk) for each of chunks, in order. With n_workers > 1
+    # the calls are made by a pool of worker processes. At most max_pending
+    # calls (by default two per worker) are made ahead of the result last
+    # yielded, so a slow consumer holds the workers back rather than letting
+    # finished results pile up in memory.
+    if n_workers > 1:
+        if max_pending is None:
+            max_pending = 2 * n_workers
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            pending = deque([ pool.apply_async(function, (args,))
+                              for args in itertools.islice(chunks, max_pending) ])
+            while pending:
+                result = pending.popleft().get()
+                for args in itertools.islice(chunks, 1):
+                    pending.append( pool.apply_async(function, (args,)) )
+                yield result
+        finally:
+            pool.terminate()
+    else:
+        for result in itertools.imap(function, chunks):
+            yield result
+
+def generate_chunks(plan, initial_vectors, n_events, seed, n_workers=1, max_pending=None, first_chunk=0):
+    # Yields EventBatches of up to CHUNK_SIZE events, n_events in total, in
+    # order (see get_chunks and map_chunks). The events are the same whatever
+    # the number of workers.
+    return map_chunks(generate_chunk, get_chunks(plan, initial_vectors, n_events, seed, first_chunk),
+                      n_workers, max_pending)
+
+def fill_chunk(args):
+    # Generates a chunk and fills an empty copy of a HistogramSet with it.
+    # Returns the histograms and the chunk's statistics, but not its events.
+    histograms, chunk_args = args
+    batch = generate_chunk(chunk_args)
+    filled = histograms.empty_copy()
+    filled.fill(batch)
+    return filled, batch.n_tried, batch.n_forbidden, batch.cut_counts, batch.weights.sum()
+
+def rebatch(batches, batch_size):
+    # Yields the events of a sequence of EventBatches again, in batches of
+    # exactly batch_size events (except perhaps the last)
+    held = []
+    n_held = 0
+    for batch in batches:
+        start = 0
+        while n_held + batch.n_events - start >= batch_size:
+            stop = start + batch_size - n_held
+            held.append( batch.take(slice(start, stop)) )
+            yield concatenate_batches(held)
+            held = []
+            n_held = 0
+            start = stop
+        if start < batch.n_events:
+            held.append( batch.take(slice(start, batch.n_events)) )
+            n_held += batch.n_events - start
+    if held:
+        yield concatenate_batches(held)
+
+################################################################################
+# The streaming interface
+################################################################################
+
+def get_root_particles(source):
+    # The roots of the decay trees to simulate, given a Particle or a ProcessGroup
+    # (or the list of root particles returned by the GraphPhys parser)
+    if isinstance(source, Particle):
+        return [source]
+    roots = list(source)
+    if len(roots) == 0:
+        raise ValueError('No root particle to simulate')
+    return roots
+
+class Simulation(object):
+    ''' Generates events from a decay tree, given as a Particle, or from the trees of a ProcessGroup.
+        The trees are compiled into a DecayPlan (see decay_plan.py) when the Simulation is created.
+        Each event starts from one root particle, which decays at rest with its nominal mass; with
+        several roots, each event's root is chosen according to their rates.
+
+        Events are numbered from the start of the run, and the events of a run depend only on
+        the seed: not on the batch size or the number of worker processes.
+
+        'n_tried', 'n_forbidden' and 'cut_counts' add up the statistics of the EventBatches generated so far
+        (see EventBatch), and 'sum_weights' the weights of their events; they cover whole chunks,
+        so they may run ahead of the events yielded.
+    '''
+    def __init__(self, source, seed=DEFAULT_SEED, n_workers=1, lineshapes=prob_lineshapes, rates=None):
+        ''' @param source: a Particle, or a ProcessGroup
+            @param seed: seed of the random number generator
+            @param n_workers: number of processes to generate events in
+            @param lineshapes: the lineshapes that particles may use, by name
+            @param rates: the relative rate of each of the ProcessGroup's root particles, in order;
+                          by default, those given by their 'rate' parameters
+            @raise ValueError: if source has no root particle, the trees can't be compiled (see
+                               decay_plan.compile_plan), or one of their decays is kinematically
+                               impossible (see decay_plan.check_kinematics).
+        '''
+        self.plan = decay_plan.compile_plan(get_root_particles(source), lineshapes, rates)
+        self.initial_vectors = np.array([ [self.plan.masses[root], 0.0, 0.0, 0.0] for root in self.plan.roots ])
+        self.seed = seed
+        self.n_workers = n_workers
+        self.n_tried = 0
+        self.n_forbidden = 0
+        self.cut_counts = np.zeros( (len(self.plan.cuts), 2), dtype=int )
+        self.sum_weights = 0.0
+
+        # Check that the decays are all possible before generating anything
+        self.channels = decay_plan.check_kinematics(self.plan)
+        for channel in self.channels:
+            if channel.status == 'marginal':
+                warn('Marginal decay channel %s' % channel)
+        infeasible = [ str(channel) for channel in self.channels if channel.status == 'infeasible' ]
+        if infeasible:
+            raise ValueError('Kinematically invalid decays requested:\n    ' + '\n    '.join(infeasible))
+        calibrate_weights(self.plan)
+
+    def generate(self, n_events, batch_size=BATCH_SIZE):
+        ''' Generates n_events events.
+            @return: an iterator over EventBatches of batch_size events (the last may have fewer),
+                     which generates events as the batches are asked for.
+        '''
+        return rebatch(self.generate_chunks(n_events), batch_size)
+
+    def generate_chunks(self, n_events, first_chunk=0):
+        ''' Generates n_events events, a chunk at a time.
+            @param first_chunk: the chunk to start from; the chunks before it are skipped.
+            @return: an iterator over EventBatches of up to CHUNK_SIZE events.
+        '''
+        for batch in generate_chunks(self.plan, self.initial_vectors, n_events, self.seed, self.n_workers,
+                                     first_chunk=first_chunk):
+            self.n_tried += batch.n_tried
+            self.n_forbidden += batch.n_forbidden
+            self.cut_counts += batch.cut_counts
+            self.sum_weights += batch.weights.sum()
+            yield batch
+
+    def fill(self, n_events, histograms):
+        ''' Generates n_events events and fills histograms with them, without keeping the events.
+            With several worker processes, each fills histograms of its own with the chunks it
+            generates, and only those are sent back to be merged.
+            @param histograms: a HistogramSet (see histograms.py)
+            @return: histograms
+            @raise ValueError: if a histogram uses a node the plan doesn't have.
+        '''
+        histograms.check_nodes(self.plan.n_nodes)
+        empty = histograms.empty_copy()
+        chunks = ( (empty, args) for args in get_chunks(self.plan, self.initial_vectors, n_events, self.seed) )
+        for filled, n_tried, n_forbidden, cut_counts, sum_weights in map_chunks(fill_chunk, chunks, self.n_workers):
+            histograms.merge(filled)
+            self.n_tried += n_tried
+            self.n_forbidden += n_forbidden
+            self.cut_counts += cut_counts
+            self.sum_weights += sum_weights
+        return histograms
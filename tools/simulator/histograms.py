@@ -0,0 +1,254 @@
+################################################################################
+# Histograms filled while events are generated
+#
+# A Histogram bins one variable of a particle, or of the combination of
+# several particles (their summed four-vectors), in every event of a batch:
+# e.g. the invariant mass of nodes 2 and 3 of the decay plan,
+#
+#     Histogram('m23', 'mass', [2, 3], 100, 0.5, 1.5)
+#
+# The variables are those of cuts.py: Mass, P, Pt, E and CosTheta. Besides
+# the bin contents, each histogram keeps the sum of squared weights in each
+# bin, the under- and overflow, and the weighted mean and variance of all
+# the values it was filled with (Moments).
+#
+# Histograms are filled a batch at a time with vectorized binning, and can be
+# merged: worker processes each fill their own and the parent adds them up
+# (see generator.Simulation.fill). They are exported as plain NumPy arrays,
+# and a HistogramSet is saved as a .npz file that numpy.load reads back.
+#
+################################################################################
+
+import numpy as np
+
+from cuts import cut_variables
+
+class Moments(object):
+    ''' The number of entries, sum of weights, weighted mean and weighted sum of squared deviations
+        from the mean (m2) of a quantity, accumulated batch by batch. Accumulators are merged with
+        the formula of Chan, Golub and LeVeque, which stays accurate however many are merged.
+    '''
+    def __init__(self):
+        self.n = 0
+        self.sum_weights = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def variance(self):
+        if self.sum_weights == 0:
+            return np.nan
+        return self.m2 / self.sum_weights
+
+    def add(self, values, weights):
+        sum_weights = weights.sum()
+        if sum_weights == 0:
+            self.add_moments(len(values), 0.0, 0.0, 0.0)
+            return
+        mean = (weights * values).sum() / sum_weights
+        self.add_moments(len(values), sum_weights, mean, (weights * (values - mean)**2).sum())
+
+    def add_moments(self, n, sum_weights, mean, m2):
+        self.n += n
+        total = self.sum_weights + sum_weights
+        if sum_weights == 0:
+            return
+        if self.sum_weights == 0:
+            # Taken as they are, so that filling an empty accumulator and merging it
+            # into another gives exactly the same as filling the other directly
+            self.sum_weights, self.mean, self.m2 = sum_weights, mean, m2
+            return
+        delta = mean - self.mean
+        self.mean += delta * sum_weights / total
+        self.m2 += m2 + delta**2 * self.sum_weights * sum_weights / total
+        self.sum_weights = total
+
+    def merge(self, other):
+        self.add_moments(other.n, other.sum_weights, other.mean, other.m2)
+
+
+class Histogram(object):
+    ''' A histogram of a variable of the summed four-vectors of some nodes of a decay plan, with
+        n_bins equal bins from low to high. 'counts' and 'sumw2' hold the sum of weights and of
+        squared weights in each bin, with the underflow first and the overflow last; events in
+        which any of the nodes doesn't appear are not counted.
+    '''
+    def __init__(self, name, variable, nodes, n_bins, low, high):
+        ''' @raise ValueError: if the variable is unknown or the binning is invalid. '''
+        if not cut_variables.has_key(variable.lower()):
+            raise ValueError('Unknown histogram variable %s; known variables are %s' %
+                             (variable, ', '.join(sorted(cut_variables.keys()))))
+        if n_bins < 1 or not low < high:
+            raise ValueError('Invalid binning for histogram %s: %d bins from %g to %g' % (name, n_bins, low, high))
+        self.name = name
+        self.variable = variable
+        self.nodes = list(nodes)
+        self.n_bins = n_bins
+        self.low = float(low)
+        self.high = float(high)
+        self.counts = np.zeros(n_bins + 2)
+        self.sumw2 = np.zeros(n_bins + 2)
+        self.moments = Moments()
+
+    @property
+    def edges(self):
+        return np.linspace(self.low, self.high, self.n_bins + 1)
+
+    def get_values(self, vectors):
+        ''' @param vectors: the four-vectors of every node, shape (n_events, n_nodes, 4)
+            @return: the variable in each event, NaN where a node doesn't appear.
+        '''
+        return cut_variables[self.variable.lower()]( vectors[:, self.nodes].sum(axis=1) )
+
+    def fill_values(self, values, weights):
+        present = np.isfinite(values)
+        values = values[present]
+        weights = weights[present]
+
+        # Bin 0 is the underflow and bin n_bins + 1 the overflow
+        bins = np.floor( (values - self.low) * (self.n_bins / (self.high - self.low)) )
+        bins = np.clip(bins, -1, self.n_bins).astype(int) + 1
+        self.counts += np.bincount(bins, weights, minlength=self.n_bins + 2)
+        self.sumw2 += np.bincount(bins, weights**2, minlength=self.n_bins + 2)
+        self.moments.add(values, weights)
+
+    def fill(self, batch):
+        ''' Fills the histogram with the events of an EventBatch, with their weights. '''
+        self.fill_values(self.get_values(batch.vectors), batch.weights)
+
+    def empty_copy(self):
+        return Histogram(self.name, self.variable, self.nodes, self.n_bins, self.low, self.high)
+
+    def merge(self, other):
+        ''' Adds the contents of another histogram of the same quantity with the same binning.
+            @raise ValueError: if the histograms don't match.
+        '''
+        if (other.variable, other.nodes, other.n_bins, other.low, other.high) != \
+           (self.variable, self.nodes, self.n_bins, self.low, self.high):
+            raise ValueError('Cannot merge histogram %s into %s: they differ' % (other.name, self.name))
+        self.counts += other.counts
+        self.sumw2 += other.sumw2
+        self.moments.merge(other.moments)
+
+    def get_state(self):
+        ''' @return: the contents of the histogram as lists, which can be saved as JSON. '''
+        return { 'counts': self.counts.tolist(), 'sumw2': self.sumw2.tolist(),
+                 'moments': [self.moments.n, self.moments.sum_weights, self.moments.mean, self.moments.m2] }
+
+    def set_state(self, state):
+        ''' Restores the contents returned by get_state. '''
+        self.counts = np.array(state['counts'], dtype=float)
+        self.sumw2 = np.array(state['sumw2'], dtype=float)
+        self.moments = Moments()
+        self.moments.add_moments(*state['moments'])
+
+    def to_arrays(self):
+        ''' @return: the histogram as a dictionary of NumPy arrays: 'edges' (n_bins + 1), 'counts' and
+                     'sumw2' (n_bins), and the scalars 'underflow', 'overflow', 'n', 'sum_weights',
+                     'mean' and 'variance'.
+        '''
+        return {
+            'edges': self.edges,
+            'counts': self.counts[1:-1].copy(),
+            'sumw2': self.sumw2[1:-1].copy(),
+            'underflow': np.array(self.counts[0]),
+            'overflow': np.array(self.counts[-1]),
+            'n': np.array(self.moments.n),
+            'sum_weights': np.array(self.moments.sum_weights),
+            'mean': np.array(self.moments.mean),
+            'variance': np.array(self.moments.variance),
+        }
+
+
+class HistogramSet(object):
+    ''' Histograms filled together, by name. '''
+
+    def __init__(self, histograms=()):
+        self.histograms = []
+        for histogram in histograms:
+            self.add(histogram)
+
+    def add(self, histogram):
+        if histogram.name in [h.name for h in self.histograms]:
+            raise ValueError('There is already a histogram named %s' % histogram.name)
+        self.histograms.append(histogram)
+
+    def __iter__(self):
+        return iter(self.histograms)
+
+    def __len__(self):
+        return len(self.histograms)
+
+    def __getitem__(self, name):
+        for histogram in self.histograms:
+            if histogram.name == name:
+                return histogram
+        raise KeyError(name)
+
+    def check_nodes(self, n_nodes):
+        ''' @raise ValueError: if a histogram uses a node a plan with n_nodes nodes doesn't have. '''
+        for histogram in self.histograms:
+            for node in histogram.nodes:
+                if not 0 <= node < n_nodes:
+                    raise ValueError('Histogram %s uses node %d, but the plan has %d nodes' %
+                                     (histogram.name, node, n_nodes))
+
+    def fill(self, batch):
+        for histogram in self.histograms:
+            histogram.fill(batch)
+
+    def empty_copy(self):
+        return HistogramSet([histogram.empty_copy() for histogram in self.histograms])
+
+    def merge(self, other):
+        for histogram, other_histogram in zip(self.histograms, other.histograms):
+            histogram.merge(other_histogram)
+
+    def get_definitions(self):
+        ''' @return: the name, variable, nodes and binning of each histogram, as lists. '''
+        return [ [h.name, h.variable, h.nodes, h.n_bins, h.low, h.high] for h in self.histograms ]
+
+    def get_state(self):
+        return [ histogram.get_state() for histogram in self.histograms ]
+
+    def set_state(self, state):
+        for histogram, histogram_state in zip(self.histograms, state):
+            histogram.set_state(histogram_state)
+
+    def save(self, path):
+        ''' Saves every histogram's arrays (see Histogram.to_arrays) to a .npz file, as arrays
+            named <histogram name>.<array name>.
+        '''
+        arrays = {}
+        for histogram in self.histograms:
+            for key, array in histogram.to_arrays().items():
+                arrays['%s.%s' % (histogram.name, key)] = array
+        np.savez(path, **arrays)
+
+def load_histograms(path):
+    ''' @return: the histograms saved in a .npz file by HistogramSet.save, as a dictionary from each
+                 histogram's name to a dictionary of its arrays.
+    '''
+    histograms = {}
+    saved = np.load(path)
+    try:
+        for key in saved.files:
+            name, array_name = key.rsplit('.', 1)
+            histograms.setdefault(name, {})[array_name] = saved[key]
+    finally:
+        saved.close()
+    return histograms
+
+def parse_histogram(spec):
+    ''' @param spec: a histogram given as variable:nodes:n_bins:low:high, where nodes is a
+                     comma-separated list of node numbers, e.g. mass:2,3:100:0.5:1.5
+        @return: the Histogram, named after its variable and nodes (e.g. mass_2_3).
+        @raise ValueError: if spec is not a valid histogram.
+    '''
+    fields = spec.split(':')
+    if len(fields) != 5:
+        raise ValueError('Invalid histogram %s; expected variable:nodes:n_bins:low:high' % spec)
+    variable, nodes, n_bins, low, high = fields
+    nodes = [ int(node) for node in nodes.split(',') ]
+    name = '_'.join([variable] + [str(node) for node in nodes])
+    return Histogram(name, variable, nodes, int(n_bins), float(low), float(high))
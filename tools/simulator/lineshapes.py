@@ -0,0 +1,201 @@
+################################################################################
+# Lineshapes: distributions of the mass of short-lived particles
+#
+# Every lineshape is a function
+#
+#     f(mass, width, low, high, rng) -> masses
+#
+# where mass and width are the particle's nominal mass and width, low and high
+# are arrays holding the smallest and largest mass the particle can have in
+# each event of a batch, and rng is a numpy.random.RandomState. It returns an
+# array with one mass per event, drawn from the lineshape truncated to
+# [low, high], or NaN for events where low > high.
+#
+# prob_lineshapes maps the names used in GraphPhys ([lineshape=BW]) to these
+# functions. New lineshapes can be added to it.
+#
+# density_lineshapes maps the same names to the probability density of each
+# lineshape truncated to [low, high],
+#
+#     f(x, mass, width, low, high) -> densities
+#
+# which reweighting.py uses to reweight events to other masses and widths.
+#
+# Lineshapes that depend on more than the mass and width, such as the
+# relativistic Breit-Wigner (RBW) with a mass-dependent width and the Flatte
+# distribution, are tabulated instead. table_lineshapes maps their names to
+# functions
+#
+#     f(mass, width, params, channel, low, high) -> LineshapeTable
+#
+# where params are the particle's GraphPhys parameters, channel the masses of
+# the two products of the decay the width is computed for, and low and high
+# the range of masses the particle can have anywhere. decay_plan.py builds the
+# table of each particle that uses one when the plan is compiled, and the
+# generator samples from it at the same cost whatever the lineshape.
+#
+#     rho [type=rho0, lineshape=RBW, L=1, radius=5.0];
+#     f0 [type=f0(980), lineshape=Flatte, g1=0.165, g2=0.695, m2a=0.4937, m2b=0.4937];
+#
+# RBW takes the orbital angular momentum L of the decay (0, 1 or 2; default
+# 0) and the Blatt-Weisskopf radius in GeV^-1 (default DEFAULT_RADIUS).
+# Flatte takes the couplings g1 and g2 of the decay channel and of a second
+# channel whose particles have masses m2a and m2b. See mc_physics_libraries.py
+# for the formulas.
+#
+################################################################################
+
+import numpy as np
+
+import mc_physics_libraries
+
+# Number of points of lineshape tables
+TABLE_SIZE = 4096
+
+# Default Blatt-Weisskopf radius, in GeV^-1
+DEFAULT_RADIUS = 3.0
+
+################################################################################
+# Cumulative distribution function of a non-relativistic Breit-Wigner
+# (a Cauchy distribution) and its inverse
+################################################################################
+def breit_wigner_cdf(x, peak, width):
+
+    return 0.5 + np.arctan(2.0 * (x - peak) / width) / np.pi
+
+def breit_wigner_inverse_cdf(u, peak, width):
+
+    return peak + 0.5 * width * np.tan(np.pi * (u - 0.5))
+
+################################################################################
+# Non-relativistic Breit-Wigner, sampled by inverting its cumulative
+# distribution, so every random number gives a mass and nothing is rejected
+################################################################################
+def breit_wigner(mass, width, low, high, rng):
+
+    low = np.asarray(low, dtype=float)
+    high = np.asarray(high, dtype=float)
+    if width <= 0:
+        return np.where(low <= high, mass, np.nan)
+
+    with np.errstate(invalid='ignore'):
+        cdf_low = breit_wigner_cdf(low, mass, width)
+        cdf_high = breit_wigner_cdf(high, mass, width)
+        u = cdf_low + (cdf_high - cdf_low) * rng.random_sample(low.shape)
+        return np.where(low <= high, breit_wigner_inverse_cdf(u, mass, width), np.nan)
+
+################################################################################
+# Density of a non-relativistic Breit-Wigner, truncated to [low, high]
+################################################################################
+def breit_wigner_density(x, mass, width, low, high):
+
+    x = np.asarray(x, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inside = (x >= low) & (x <= high)
+        norm = breit_wigner_cdf(high, mass, width) - breit_wigner_cdf(low, mass, width)
+        density = (width / (2.0 * np.pi)) / ((x - mass)**2 + 0.25 * width**2) / norm
+        return np.where(inside, density, 0.0)
+
+prob_lineshapes = {
+    'BW' : breit_wigner,
+}
+
+density_lineshapes = {
+    'BW' : breit_wigner_density,
+}
+
+################################################################################
+# Tabulated lineshapes
+################################################################################
+class LineshapeTable(object):
+    ''' The cumulative distribution of a lineshape on [low, high], tabulated at TABLE_SIZE points
+        spaced evenly in the angle theta = arctan(2 (m - mass) / width), and so closely around the
+        peak and sparsely in the tails. Both sampling and densities interpolate linearly in theta,
+        so that the masses sampled from a range always lie in it.
+    '''
+    def __init__(self, mass, width, density, low, high):
+        ''' @param density: a function giving the lineshape at an array of masses, not normalized
+            @param width: sets the spacing of the table; it needn't be the lineshape's exact width.
+        '''
+        self.mass = mass
+        self.width = width
+        self.low = low
+        self.high = high
+        self.thetas = np.linspace(self.get_theta(low), self.get_theta(high), TABLE_SIZE)
+        masses = self.get_mass(self.thetas)
+        densities = np.maximum(density(masses), 0.0)
+
+        # Integrated in theta, where the density is densities * dm/dtheta
+        in_theta = densities * 0.5 * width / np.cos(self.thetas)**2
+        cdf = np.concatenate([ [0.0], np.cumsum(0.5 * (in_theta[1:] + in_theta[:-1]) * np.diff(self.thetas)) ])
+        if not cdf[-1] > 0:
+            raise ValueError('The lineshape is 0 everywhere from %g to %g' % (low, high))
+        self.cdf = cdf / cdf[-1]
+        self.densities = densities / cdf[-1]
+
+    def get_theta(self, mass):
+
+        return np.arctan(2.0 * (np.asarray(mass, dtype=float) - self.mass) / self.width)
+
+    def get_mass(self, theta):
+
+        return self.mass + 0.5 * self.width * np.tan(theta)
+
+    def sample(self, low, high, rng):
+        ''' @return: masses drawn from the lineshape truncated to [low, high] in each event, or NaN
+                     where low > high.
+        '''
+        low = np.maximum(np.asarray(low, dtype=float), self.low)
+        high = np.minimum(np.asarray(high, dtype=float), self.high)
+        cdf_low = np.interp(self.get_theta(low), self.thetas, self.cdf)
+        cdf_high = np.interp(self.get_theta(high), self.thetas, self.cdf)
+        u = cdf_low + (cdf_high - cdf_low) * rng.random_sample(low.shape)
+        masses = self.get_mass( np.interp(u, self.cdf, self.thetas) )
+        return np.where(low <= high, np.clip(masses, low, high), np.nan)
+
+    def density(self, x, low, high):
+        ''' @return: the density of the lineshape truncated to [low, high] at masses x. '''
+        x = np.asarray(x, dtype=float)
+        low = np.maximum(low, self.low)
+        high = np.minimum(high, self.high)
+        norm = np.interp(self.get_theta(high), self.thetas, self.cdf) - \
+            np.interp(self.get_theta(low), self.thetas, self.cdf)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            density = np.interp(self.get_theta(x), self.thetas, self.densities) / norm
+            return np.where((x >= low) & (x <= high), density, 0.0)
+
+def relativistic_breit_wigner_table(mass, width, params, channel, low, high):
+
+    L = int(float(params.get('L', 0)))
+    radius = float(params.get('radius', DEFAULT_RADIUS))
+    if width <= 0:
+        raise ValueError('A relativistic Breit-Wigner needs a width')
+    m1, m2 = channel
+    mc_physics_libraries.blatt_weisskopf(0.0, L, radius) # Checks L
+    def density(masses):
+        return mc_physics_libraries.relativistic_breit_wigner(masses, mass, width, m1, m2, L, radius)
+    return LineshapeTable(mass, width, density, low, high)
+
+def flatte_table(mass, width, params, channel, low, high):
+
+    try:
+        g1, g2, m2a, m2b = [ float(params[name]) for name in ('g1', 'g2', 'm2a', 'm2b') ]
+    except KeyError, e:
+        raise ValueError('A Flatte lineshape needs the parameter %s' % e)
+    if not (g1 > 0 and g2 >= 0):
+        raise ValueError('Invalid Flatte couplings g1=%g, g2=%g' % (g1, g2))
+    m1a, m1b = channel
+    def density(masses):
+        return mc_physics_libraries.flatte(masses, mass, g1, m1a, m1b, g2, m2a, m2b)
+    # The table is spaced by the width the first channel alone would give at
+    # the peak: the denominator's mass * width term is peak * g1 * rho1
+    if width <= 0:
+        width = g1 * mc_physics_libraries.phase_space_factor(np.array([mass]), m1a, m1b)[0].real
+    if not width > 0:
+        raise ValueError('A Flatte lineshape needs a width, or a mass above its decay\'s threshold')
+    return LineshapeTable(mass, width, density, low, high)
+
+table_lineshapes = {
+    'RBW' : relativistic_breit_wigner_table,
+    'Flatte' : flatte_table,
+}
@@ -1,10 +1,15 @@
-from ROOT import TMath
+from math import pi
+
+import numpy as np
+
+from phase_space import two_body_momentum
 
 ################################################################################
 # Non-relativistic Breit-Wigner function
-# Simply calls the ROOT implementation
+# Same definition as ROOT's TMath::BreitWigner, written out so that the
+# simulator does not need ROOT. Works on numbers or NumPy arrays.
 # 
-# Area under the curve is normalized to be 0 (I think)
+# Area under the curve is normalized to be 1
 #
 # http://root.cern.ch/root/html/TMath.html#TMath:BreitWigner
 # 
@@ -15,13 +20,95 @@ from ROOT import TMath
 ################################################################################
 def breit_wigner(mass, peak, width):
 
-    return TMath.BreitWigner(mass, peak, width)
+    return 0.5 * width / pi / ((mass - peak)**2 + 0.25 * width**2)
 
 ################################################################################
 # Return max value of the BW PDF by evaluating it at the peak
 ################################################################################
 def breit_wigner_max(peak, width):
 
-    return TMath.BreitWigner(peak, peak, width)
+    return breit_wigner(peak, peak, width)
+
+
+################################################################################
+# Squared Blatt-Weisskopf barrier factor of a decay with orbital angular
+# momentum L (0, 1 or 2), breakup momentum q and interaction radius R (in
+# GeV^-1), normalized to tend to 1 at large q. With z = (qR)^2,
+#
+#     L = 0:  1
+#     L = 1:  2z / (1 + z)
+#     L = 2:  13z^2 / ((z - 3)^2 + 9z)
+#
+# Works on NumPy arrays of q.
+#
+################################################################################
+def blatt_weisskopf(q, L, radius):
+
+    z = (np.asarray(q, dtype=float) * radius)**2
+    if L == 0:
+        return np.ones_like(z)
+    elif L == 1:
+        return 2.0 * z / (1.0 + z)
+    elif L == 2:
+        return 13.0 * z**2 / ((z - 3.0)**2 + 9.0 * z)
+    raise ValueError('Blatt-Weisskopf factors are only known for L = 0, 1 and 2, not %s' % L)
+
+################################################################################
+# Mass-dependent width of a resonance of nominal mass m0 and width gamma0
+# decaying to two particles of masses m1 and m2 with orbital angular momentum
+# L:
+#
+#     gamma(m) = gamma0 * (q/q0) * (m0/m) * B_L(q)^2 / B_L(q0)^2
+#
+# where q and q0 are the breakup momenta at m and m0. 0 below threshold.
+#
+################################################################################
+def mass_dependent_width(mass, peak, width, m1, m2, L=0, radius=3.0):
+
+    mass = np.asarray(mass, dtype=float)
+    q = two_body_momentum(mass, m1, m2)
+    q0 = two_body_momentum(peak, m1, m2)
+    if q0 <= 0:
+        raise ValueError('A resonance of mass %g is below the threshold of its decay to %g + %g' % (peak, m1, m2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = blatt_weisskopf(q, L, radius) / blatt_weisskopf(q0, L, radius)
+        return np.where(q > 0, width * (q / q0) * (peak / mass) * ratio, 0.0)
+
+################################################################################
+# Relativistic Breit-Wigner with a mass-dependent width, as a distribution of
+# the mass (not normalized):
+#
+#     m * m0 * gamma(m) / ((m0^2 - m^2)^2 + m0^2 gamma(m)^2)
+#
+################################################################################
+def relativistic_breit_wigner(mass, peak, width, m1, m2, L=0, radius=3.0):
+
+    mass = np.asarray(mass, dtype=float)
+    gamma = mass_dependent_width(mass, peak, width, m1, m2, L, radius)
+    return mass * peak * gamma / ((peak**2 - mass**2)**2 + (peak * gamma)**2)
+
+################################################################################
+# Flatte distribution of the mass of a resonance near the threshold of a
+# second decay channel, such as the f0(980) or a0(980) and KK (not
+# normalized). The resonance decays to the particles of masses m1a and m1b
+# with coupling g1, and couples to a second channel, of masses m2a and m2b,
+# with g2:
+#
+#     m * m0 * g1 rho1 / |m0^2 - m^2 - i m0 (g1 rho1 + g2 rho2)|^2
+#
+# where rho = 2q/m in each channel. Below the second channel's threshold,
+# rho2 is imaginary.
+#
+################################################################################
+def phase_space_factor(mass, ma, mb):
+
+    x = (mass - ma - mb) * (mass + ma + mb) * (mass - ma + mb) * (mass + ma - mb)
+    return np.sqrt(x.astype(complex)) / mass**2
 
+def flatte(mass, peak, g1, m1a, m1b, g2, m2a, m2b):
 
+    mass = np.asarray(mass, dtype=float)
+    rho1 = phase_space_factor(mass, m1a, m1b)
+    rho2 = phase_space_factor(mass, m2a, m2b)
+    amplitude = 1.0 / (peak**2 - mass**2 - 1j * peak * (g1 * rho1 + g2 * rho2))
+    return np.where(rho1.real > 0, mass * peak * g1 * rho1.real * np.abs(amplitude)**2, 0.0)
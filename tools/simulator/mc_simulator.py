@@ -1,153 +1,186 @@
 #!/usr/bin/env python
 #
+# Generates events from a GraphPhys decay tree, and prints them or writes them
+# to a binary event file, and/or histograms them as they are generated. The
+# generation itself is done by generator.py, which can also be used directly
+# from Python.
+#
 
 ################################################################################
 # Import the needed modules
 ################################################################################
-import os
 import sys
-from array import array
+import time
+from optparse import OptionParser
 
-from pydecay import *
-from pydecay import graphphys, db
-from mc_physics_libraries import *
-from ROOT import *
+import numpy as np
 
+from pydecay import graphphys
+import generator
+from generator import DEFAULT_SEED, Simulation
+import event_io
+import checkpoint
+import histograms
 
-def gen_bw_val(particle_type):
-    bw_max = breit_wigner_max( float(particle_type.mass), float(particle_type.width) )
-    while(True):
-        # Generate random numbers from 0-2.0
-        x = 2.0*rnd.Rndm()
-        bw_val = breit_wigner( x, float(particle_type.mass), float(particle_type.width) )        
-        test_val = bw_max * rnd.Rndm()
-        if test_val <= bw_val:
-            return x
 
-prob_lineshapes = {
-    # Each shape name maps to a function f: Particle -> mass
-    'BW' : lambda p: gen_bw_val( db.PARTICLE_TYPE_IMPL.get_type_for_name(p.type) )
-}
 
 ################################################################################
-# Return the masses of particles
+# Write out events
 ################################################################################
 
-def get_mass(particle):
-    # Lineshape overrides any mass specified explicitly on the particle
-    if hasattr(particle, 'lineshape'):
-        return prob_lineshapes[ particle.lineshape ](particle)
-    else:
-        return particle.mass
+def print_vector(vector):
+    print "%f %f %f %f" % tuple(vector)
+
+def print_event(batch, end_states, roots, i):
+    # Write the 4vector of the initial state
+    root = batch.plan.roots[ roots[i] ]
+    print "-------------"
+    print "initial:", batch.plan.types[root]
+    print_vector( batch.vectors[i, root] )
+    if batch.plan.weighted:
+        print "weight: %g" % batch.weights[i]
+
+    # Particles that decay further aren't printed; only their products are
+    for node in np.flatnonzero(end_states[i]):
+        print "end state:", batch.plan.types[node]
+        print_vector( batch.vectors[i, node] )
+
+def print_histogram_summary(histogram_set, outfile=sys.stderr):
+    for histogram in histogram_set:
+        print >> outfile, "%-20s %10d entries, mean %g, rms %g" % (histogram.name, histogram.moments.n,
+                                                                  histogram.moments.mean,
+                                                                  np.sqrt(histogram.moments.variance))
+
+def print_cut_report(plan, n_tried, n_kept, cut_counts, outfile=sys.stderr):
+    # The efficiency of each cut, relative to the events it was evaluated on
+    for cut, (n_cut, n_passed) in zip(plan.cuts, cut_counts):
+        efficiency = float(n_passed) / max(n_cut, 1)
+        print >> outfile, "%-45s %10d of %10d passed (%.2f%%)" % (cut, n_passed, n_cut, 100 * efficiency)
+    print >> outfile, "kept %d of %d events generated (%.2f%%)" % (n_kept, n_tried, 100.0 * n_kept / max(n_tried, 1))
 
 
 ################################################################################
 ################################################################################
 if __name__ == '__main__':
-    
-    ################################################################################
-    # Parse the command line options
-    ################################################################################
-    input_file = sys.argv[1]
-    max_events = int(sys.argv[2])
-
-    # print input_file
-    # print max_events
 
     ################################################################################
-    # Read the input file
+    # Parse the command line options
     ################################################################################
+    parser = OptionParser(usage='%prog [options] input_file max_events')
+    parser.add_option("-j", "--workers", dest="n_workers", type="int", default=1,
+                      help='Number of processes to generate events in. Defaults to 1.')
+    parser.add_option("-s", "--seed", dest="seed", type="int", default=DEFAULT_SEED,
+                      help='Seed of the random number generator. Defaults to %d.' % DEFAULT_SEED)
+    parser.add_option("-o", "--output", dest="outfile_name", default=None,
+                      help='Write the events to this binary event file (see event_io.py) rather than printing them.')
+    parser.add_option("-z", "--compress", dest="compression", action="store_const", const='zlib', default=None,
+                      help='Compress the binary event file.')
+    parser.add_option("--single", dest="dtype", action="store_const", const=np.float32, default=np.float64,
+                      help='Store four-vectors in the binary event file in single precision.')
+    parser.add_option("--resume", dest="resume", action="store_true", default=False,
+                      help='Resume a run that was stopped, from the checkpoint kept beside its output file. '
+                           'The other options must be the same as the first time.')
+    parser.add_option("-H", "--histogram", dest="histograms", action="append", default=[],
+                      help='Histogram a variable of the summed four-vectors of some nodes of the decay plan, '
+                           'given as variable:nodes:bins:low:high, e.g. mass:2,3:100:0.5:1.5. The variables are '
+                           'Mass, P, Pt, E and CosTheta. May be given more than once. Without -o, the events '
+                           'are only histogrammed, not printed.')
+    parser.add_option("--histogram-file", dest="histogram_file", default='histograms.npz',
+                      help='File to save the histograms to, as NumPy arrays. Defaults to %default.')
+    parser.add_option("--rates", dest="rates", default=None,
+                      help='Relative rates of the root particles of the input file, in the order they are '
+                           'listed at the start, separated by commas, e.g. 2,1. Defaults to the roots\' '
+                           '\'rate\' parameters, or equal rates.')
+    parser.add_option("--checkpoint-interval", dest="checkpoint_interval", type="float",
+                      default=checkpoint.CHECKPOINT_INTERVAL,
+                      help='Seconds between checkpoints of runs with an output file; 0 checkpoints after '
+                           'every chunk. Defaults to %g.' % checkpoint.CHECKPOINT_INTERVAL)
+
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('An input file and a number of events are required')
+    if options.resume and not options.outfile_name:
+        parser.error('Only runs with an output file (-o) can be resumed')
     try:
-        [root_particle] = graphphys.get_parser().parseFile( input_file )
-    except ValueError: # Occurs if there are too many list elements in the return value
-        raise Exception('Multiple root nodes not allowed in a simulation')
-
-
-    rnd = TRandom3()
+        histogram_set = histograms.HistogramSet([ histograms.parse_histogram(spec) for spec in options.histograms ])
+    except ValueError, e:
+        parser.error(str(e))
+    rates = None
+    if options.rates:
+        try:
+            rates = [ float(rate) for rate in options.rates.split(',') ]
+        except ValueError:
+            parser.error('Invalid rates %s' % options.rates)
+    input_file = args[0]
+    max_events = int(args[1])
 
     ################################################################################
-    # Walk the particle tree and check that the decays are all valid
+    # Read the input file
     ################################################################################
-    get_end_masses = lambda products: array('d', [ get_mass(x) for x in products ])
-
-    # print get_end_masses
-    # print get_mass(root_particle)
-
-    initial_vector = TLorentzVector( 0.0, 0.0, 0.0, get_mass(root_particle) )
-    event = TGenPhaseSpace()
-
-    def validate_decay(decay):
-        if decay is None:
-            return
-        
-        products = decay.products
-        end_masses = get_end_masses(products)
-        n_products = len(end_masses)
-        
-        if not event.SetDecay(initial_vector, n_products, end_masses, ''):
-            raise Exception('Kinematically invalid decay requested')
-        for product in products:
-            for decay in product.decays:
-                validate_decay( decay )
-    for decay in root_particle.decays:
-        validate_decay(decay)
-
+    simulation = Simulation(graphphys.get_parser().parseFile( input_file ),
+                            options.seed, options.n_workers, rates=rates)
+    plan = simulation.plan
+    if plan.n_roots > 1:
+        for root, rate in zip(plan.roots, plan.root_rates):
+            print >> sys.stderr, "root %d: %s, rate %g" % (root, plan.types[root], rate)
+    histogram_set.check_nodes(plan.n_nodes)
 
     ################################################################################
     # Generate the events
     ################################################################################
-
-
-    def simulate_decay(particle, particle_vector):
-        def weighted_choice(items, rand_func):
-            # items is a list of tuples in the form (item, weight);
-            # rand_func is a 1-argument function that takes an upper bound u
-            # and returns a random number uniformly distributed between 0 and u
-
-            weight_total = sum((item[1] for item in items))
-            n = rand_func(weight_total) # Generates a random # between 0 and total weight
-            for item, weight in items:
-                if n < weight:
-                    return item
-                n = n - weight
-            return item
-
-        # Create a new event object for each level of the recursion stack so that particles
-        # down the tree don't muck with results from this level of the tree
-        event = TGenPhaseSpace() 
-
-        # Start with defining the inital state as a particle at rest
-        products = weighted_choice( [(d, d.prob) for d in particle.decays],
-                                    lambda upper_bound: rnd.Rndm() * upper_bound
-                                    ).products
-            
-        # print 'Simulating decay of %s (%f) to %s' % (particle.type, particle_vector.M(), [p.type for p in products])
-        
-        end_masses = get_end_masses(products)
-        n_products = len(end_masses)
-
-        event.SetDecay(particle_vector, n_products, end_masses, '')
-        event.Generate()
-
-        # print "end_masses: " 
-        # print end_masses
-
-        for i, product in enumerate(products):
-            # If our decay products will decay further, don't print anything yet;
-            # just recursively generate those products
-            if len(product.decays) > 0:
-                simulate_decay( product, event.GetDecay(i) )
+    # Runs writing an event file keep a checkpoint, to be resumed from (see checkpoint.py)
+    writer = None
+    chunks_written = 0
+    if options.outfile_name:
+        settings = checkpoint.get_settings(simulation, max_events, generator.CHUNK_SIZE,
+                                           options.compression, options.dtype, histogram_set)
+        resume_at = None
+        if options.resume:
+            state = checkpoint.read_checkpoint(options.outfile_name, settings)
+            resume_at = state['offset']
+            chunks_written = state['chunks_written']
+            simulation.n_tried = state['n_tried']
+            simulation.n_forbidden = state.get('n_forbidden', 0)
+            simulation.cut_counts = np.array(state['cut_counts'], dtype=int).reshape(simulation.cut_counts.shape)
+            simulation.sum_weights = state['sum_weights']
+            histogram_set.set_state(state['histogram_state'])
+        writer = event_io.EventWriter(options.outfile_name, plan, options.compression, options.dtype, resume_at)
+        checkpoint.write_checkpoint(options.outfile_name,
+                                    checkpoint.get_state(settings, simulation, writer, chunks_written, histogram_set))
+        last_checkpoint = time.time()
+
+    if histogram_set and not writer:
+        # Only the histograms are kept, so the events needn't leave the workers
+        simulation.fill(max_events, histogram_set)
+    else:
+        for batch in simulation.generate_chunks(max_events, chunks_written):
+            histogram_set.fill(batch)
+            if writer:
+                writer.write_batch(batch)
+                chunks_written += 1
+                if time.time() - last_checkpoint >= options.checkpoint_interval:
+                    checkpoint.write_checkpoint(options.outfile_name,
+                                                checkpoint.get_state(settings, simulation, writer, chunks_written,
+                                                                     histogram_set))
+                    last_checkpoint = time.time()
             else:
-                print "end state:", product.type
-                end_vector = event.GetDecay(i)
-                print "%f %f %f %f" % (end_vector.E(), end_vector.X(), end_vector.Y(), \
-                                       end_vector.Z())
-
-    for n in range(max_events):
-        # Write the 4vector of the initial state
-        print "-------------"
-        print "initial:", root_particle.type
-        print "%f %f %f %f" % (initial_vector.E(), initial_vector.X(), initial_vector.Y(), \
-                               initial_vector.Z())
-        
-        simulate_decay(root_particle, initial_vector)
+                end_states = batch.get_end_states()
+                roots = batch.get_roots()
+                for i in range(batch.n_events):
+                    print_event(batch, end_states, roots, i)
+
+    if writer:
+        writer.close()
+        checkpoint.remove_checkpoint(options.outfile_name)
+
+    if histogram_set:
+        histogram_set.save(options.histogram_file)
+        print_histogram_summary(histogram_set)
+
+    if simulation.n_forbidden:
+        print >> sys.stderr, ("discarded %d of %d events generated: a particle was too light for the decay chosen for it"
+                              % (simulation.n_forbidden, simulation.n_tried))
+    if plan.cuts:
+        print_cut_report(plan, simulation.n_tried, max_events, simulation.cut_counts)
+    if plan.weighted:
+        print >> sys.stderr, "sum of weights %g" % simulation.sum_weights
@@ -0,0 +1,123 @@
+################################################################################
+# N-body phase-space generation with NumPy
+#
+# A vectorized version of the GENBOD (Raubold-Lynch) algorithm used by ROOT's
+# TGenPhaseSpace. Rather than generating one event per call, every function
+# here works on a whole batch of events at once: four-vectors are arrays whose
+# last axis holds (E, px, py, pz), and everything else is an array with one
+# entry per event.
+#
+# http://root.cern.ch/root/html/TGenPhaseSpace.html
+#
+################################################################################
+
+import numpy as np
+
+from fourvectors import E, PX, PY, PZ, mass, boost_components
+
+################################################################################
+# Momentum of either daughter in the rest frame of a two-body decay
+# a -> b + c, or 0 where the decay is kinematically forbidden.
+################################################################################
+def two_body_momentum(a, b, c):
+
+    x = (a - b - c) * (a + b + c) * (a - b + c) * (a + b - c)
+    return np.sqrt(np.maximum(x, 0.0)) / (2.0 * a)
+
+################################################################################
+# Generate one batch of decays parent -> daughters, uniformly in phase space.
+#
+# parent: array of shape (n, 4) holding the parent four-vector of each event
+#         in the lab frame.
+# masses: daughter masses, either shape (k,) (the same for every event) or
+#         shape (n, k). There must be at least two daughters.
+# rng:    a numpy.random.RandomState
+#
+# Returns (daughters, weights): daughters has shape (n, k, 4) and holds the
+# daughter four-vectors in the lab frame; weights has shape (n,) and holds
+# each event's phase-space weight, normalized so that it is at most 1 (as
+# TGenPhaseSpace.Generate's return value is). Events in which the daughters
+# are heavier than the parent get weight 0 and NaN four-vectors.
+################################################################################
+def generate(parent, masses, rng):
+
+    parent = np.asarray(parent, dtype=float)
+    n = parent.shape[0]
+    masses = np.ones((n, 1)) * np.asarray(masses, dtype=float) # Broadcast to (n, k)
+    k = masses.shape[1]
+    if k < 2:
+        raise ValueError('Phase-space generation needs at least two daughters, not %d' % k)
+
+    # The work below is done on arrays of shape (k, n), one row per daughter, so that
+    # every operation runs over contiguous memory
+    masses = masses.T
+    parent_mass = mass(parent)
+    mass_sums = np.cumsum(masses, axis=0)
+    available = parent_mass - mass_sums[-1] # Kinetic energy shared among the daughters
+    with np.errstate(invalid='ignore'):
+        allowed = available > 0 # Also False for events whose parent is NaN
+
+    # Invariant masses of the first i+1 daughters, from sorted uniform numbers
+    rno = np.zeros((k, n))
+    rno[-1] = 1.0
+    if k > 3:
+        rno[1:-1] = np.sort(rng.random_sample((k - 2, n)), axis=0)
+    elif k == 3:
+        rno[1] = rng.random_sample(n)
+    inv_mass = rno * available + mass_sums
+
+    pd = two_body_momentum(inv_mass[1:], inv_mass[:-1], masses[1:])
+
+    # The largest value the product of the pd's can take, for normalizing weights
+    em_max = available + mass_sums[1:]
+    em_min = mass_sums[:-1]
+    wt_max = two_body_momentum(em_max, em_min, masses[1:]).prod(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(allowed, pd.prod(axis=0) / wt_max, 0.0)
+
+    # Build the daughters up one at a time in the rest frame of the ones so far,
+    # rotating the system randomly and boosting it along y at each step
+    energy = np.empty((k, n))
+    px = np.zeros((k, n))
+    py = np.empty((k, n))
+    pz = np.zeros((k, n))
+    py[0] = pd[0]
+    energy[0] = np.sqrt(pd[0]**2 + masses[0]**2)
+    angles = rng.random_sample((2, k - 1, n))
+    cos_z = 2.0 * angles[0] - 1.0
+    sin_z = np.sqrt(1.0 - cos_z**2)
+    cos_y = np.cos(2.0 * np.pi * angles[1])
+    sin_y = np.sin(2.0 * np.pi * angles[1])
+    for i in range(1, k):
+        py[i] = -pd[i - 1]
+        energy[i] = np.sqrt(pd[i - 1]**2 + masses[i]**2)
+
+        x, y, z = px[:i + 1], py[:i + 1], pz[:i + 1]
+        cz, sz, cy, sy = cos_z[i - 1], sin_z[i - 1], cos_y[i - 1], sin_y[i - 1]
+        x, y = cz * x - sz * y, sz * x + cz * y     # rotation around z
+        x, z = cy * x - sy * z, sy * x + cy * z     # rotation around y
+        px[:i + 1], py[:i + 1], pz[:i + 1] = x, y, z
+
+        if i == k - 1:
+            break
+
+        # Boost along y into the rest frame of the first i+2 daughters
+        gamma = np.sqrt(pd[i]**2 + inv_mass[i]**2) / inv_mass[i]
+        gamma_beta = pd[i] / inv_mass[i]
+        e = energy[:i + 1]
+        energy[:i + 1], py[:i + 1] = gamma * e + gamma_beta * y, gamma * y + gamma_beta * e
+
+    # Finally, boost everything from the parent's rest frame to the lab
+    if parent[:, 1:].any():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            beta = parent[:, 1:] / parent[:, E:E + 1]
+        energy, px, py, pz = boost_components(energy, px, py, pz, beta[:, 0], beta[:, 1], beta[:, 2])
+
+    daughters = np.empty((n, k, 4))
+    daughters[:, :, E] = energy.T
+    daughters[:, :, PX] = px.T
+    daughters[:, :, PY] = py.T
+    daughters[:, :, PZ] = pz.T
+    daughters[~allowed] = np.nan
+
+    return daughters, weights
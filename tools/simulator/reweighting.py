@@ -0,0 +1,159 @@
+################################################################################
+# Reweighting generated events
+#
+# Rather than generating a sample again to see what other branching fractions
+# or lineshape parameters would give, its events can be reweighted: each
+# event's weight is multiplied by the ratio of its probability under the new
+# parameters to its probability under those it was generated with.
+#
+#     plan = simulation.plan
+#     probabilities = plan.probabilities.copy()
+#     probabilities[3] *= 2
+#     weights = reweight(plan, batch.vectors, batch.choices, batch.weights,
+#                        probabilities=probabilities, lineshapes={2: (0.90, 0.060)})
+#
+# Events read from an event file (event_io.Events) are reweighted the same way,
+# with the plan compiled from the same decay tree, and
+#
+#     vectors = events.columns.transpose(2, 0, 1)
+#     choices = events.chains[events.chain_ids]
+#
+# Reweighting to new branching fractions is exact. Reweighting to a new mass or
+# width of a particle multiplies the weights by the ratio of the particle's new
+# and old lineshapes, truncated to the range the generator drew its mass from,
+# and then normalizes them so that the events it appears in keep their total
+# weight: since the generator keeps each decay with the probability of its
+# phase-space weight, the lineshape alone only gives each event's weight up to
+# a factor that depends on the mass of the particle's parent. So the result is
+# exact where the parent always has the same mass, and otherwise good while the
+# new parameters stay close to the old ones.
+#
+# Reweighting can't give weight to events that were never generated: decays
+# with probability 0, or masses outside the range the generator allowed.
+#
+################################################################################
+
+import numpy as np
+
+import fourvectors
+import decay_plan
+from lineshapes import density_lineshapes, table_lineshapes
+
+def get_decay_factors(plan, choices, probabilities):
+    ''' @param choices: the decay each node underwent in each event, shape (n_events, n_nodes),
+                        -1 where it did not decay
+        @param probabilities: the new probability of each decay of the plan. Those of each node's
+                              decays are normalized to add up to 1.
+        @return: the factor by which each event's weight changes.
+        @raise ValueError: if probabilities has the wrong length or a negative entry, the new
+                           probabilities of some node's decays are all 0, or a decay that has
+                           probability 0 in the plan is given some.
+    '''
+    probabilities = np.array(probabilities, dtype=float)
+    if probabilities.shape != (plan.n_decay_modes,):
+        raise ValueError('Expected %d decay probabilities, not %d' % (plan.n_decay_modes, len(probabilities)))
+    if not (probabilities >= 0).all():
+        raise ValueError('Invalid decay probabilities: %s' % probabilities)
+
+    totals = np.bincount(plan.decay_parents, probabilities, minlength=plan.n_nodes)[plan.decay_parents]
+    if not (totals > 0).all():
+        raise ValueError('The new probabilities of the decays of %s add up to 0' %
+                         plan.types[plan.decay_parents[np.flatnonzero(totals == 0)[0]]])
+    probabilities = probabilities / totals
+    never = (plan.probabilities == 0) & (probabilities > 0)
+    if never.any():
+        raise ValueError('Decay %d was never generated, so events can\'t be reweighted to it' %
+                         np.flatnonzero(never)[0])
+
+    # Index -1, for nodes that did not decay, gives a factor of 1
+    ratios = np.ones(plan.n_decay_modes + 1)
+    chosen = plan.probabilities > 0
+    ratios[:-1][chosen] = probabilities[chosen] / plan.probabilities[chosen]
+    return ratios[choices].prod(axis=1)
+
+def get_density(plan, node, lineshape, mass, width):
+    # The density of a node's mass with the given lineshape and parameters, as
+    # a function of (x, low, high)
+    if table_lineshapes.has_key(lineshape):
+        if lineshape == plan.lineshape_names[plan.lineshapes[node]] and mass == plan.masses[node] and \
+           width == plan.widths[node]:
+            table = plan.lineshape_tables[node]
+        else:
+            table = decay_plan.build_lineshape_table(plan, node, lineshape, mass, width,
+                                                     decay_plan.get_max_masses(plan)[node])
+        return table.density
+    if not density_lineshapes.has_key(lineshape):
+        raise ValueError('No density is known for lineshape %s' % lineshape)
+    def density(x, low, high):
+        return density_lineshapes[lineshape](x, mass, width, low, high)
+    return density
+
+def get_lineshape_factors(plan, node, vectors, weights, mass=None, width=None, lineshape=None):
+    ''' @param node: a node of the plan with a lineshape
+        @param vectors: the four-vectors of every node in each event, shape (n_events, n_nodes, 4)
+        @param weights: the weight of each event
+        @param mass, width, lineshape: the node's new lineshape and its parameters; those the plan
+                                       has are kept for any that aren't given
+        @return: the factor by which each event's weight changes, normalized so that the total
+                 weight of the events the node appears in stays the same (for each decay the node
+                 is a product of, if it is shared by several roots' trees).
+        @raise ValueError: if the node's mass isn't drawn from a lineshape, there is no density for
+                           the old or new lineshape, or the new lineshape's parameters are invalid.
+    '''
+    if plan.lineshapes[node] == decay_plan.NO_LINESHAPE or plan.widths[node] <= 0:
+        raise ValueError('Node %d (%s) has no lineshape to reweight' % (node, plan.types[node]))
+    old_lineshape = plan.lineshape_names[plan.lineshapes[node]]
+    if lineshape is None:
+        lineshape = old_lineshape
+    if mass is None:
+        mass = plan.masses[node]
+    if width is None:
+        width = plan.widths[node]
+    old_density = get_density(plan, node, old_lineshape, plan.masses[node], plan.widths[node])
+    new_density = get_density(plan, node, lineshape, mass, width)
+
+    # The decay the node is a product of fixes the range its mass was drawn from.
+    # A node shared by several roots' trees is a product of one decay in each,
+    # and the events it appears in are reweighted separately for each.
+    positions = np.flatnonzero(plan.products == node)
+    if len(positions) == 0:
+        raise ValueError('Node %d (%s) is a root, whose mass is fixed' % (node, plan.types[node]))
+    factors = np.ones(len(weights))
+    for decay in np.searchsorted(plan.product_starts, positions, side='right') - 1:
+        products = plan.get_products(decay)
+        if len(products) < 2:
+            raise ValueError('Node %d (%s) takes its mass from its parent' % (node, plan.types[node]))
+        parent = plan.decay_parents[decay]
+
+        present = np.flatnonzero( np.isfinite(vectors[:, node, fourvectors.E]) &
+                                  np.isfinite(vectors[:, parent, fourvectors.E]) )
+        masses = fourvectors.mass(vectors[present, node])
+        low = plan.thresholds[node]
+        high = fourvectors.mass(vectors[present, parent]) - plan.min_masses[products].sum() + plan.min_masses[node]
+
+        old = old_density(masses, low, high)
+        new = new_density(masses, low, high)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratios = np.where(old > 0, new / old, 0.0)
+
+        total = weights[present].sum()
+        new_total = (weights[present] * ratios).sum()
+        if new_total > 0:
+            ratios *= total / new_total
+        factors[present] = ratios
+    return factors
+
+def reweight(plan, vectors, choices, weights, probabilities=None, lineshapes=None):
+    ''' Reweights events generated from a plan to new decay probabilities and lineshapes.
+        @param vectors, choices, weights: the events, as in an EventBatch
+        @param probabilities: the new probability of each decay (see get_decay_factors), if they change
+        @param lineshapes: a dictionary from nodes to their new (mass, width), or (mass, width, lineshape)
+        @return: the new weights of the events.
+    '''
+    weights = np.array(weights, dtype=float)
+    if probabilities is not None:
+        weights *= get_decay_factors(plan, choices, probabilities)
+    if lineshapes:
+        for node, parameters in sorted(lineshapes.items()):
+            weights *= get_lineshape_factors(plan, node, vectors, weights, *parameters)
+    return weights